@@ -0,0 +1,79 @@
+"""Shared helpers for the scripts in benchmarks/.
+
+Run them from the repository root, e.g. ``python -m benchmarks.bench_encoder``.
+"""
+
+import os
+import statistics
+import time
+from types import SimpleNamespace
+
+# sgd/__init__.py needs a well-formed TOKEN to import; benchmarks never
+# talk to Google, so a fake one is enough (same as tests/conftest.py).
+os.environ.setdefault(
+    "TOKEN",
+    '{"token": "fake", "refresh_token": "fake", '
+    '"token_uri": "https://oauth2.googleapis.com/token", '
+    '"client_id": "fake.apps.googleusercontent.com", "client_secret": "fake", '
+    '"scopes": ["https://www.googleapis.com/auth/drive"]}',
+)
+
+RELEASE_TAGS = [
+    "2160p.AMZN.WEB-DL.DDP5.1.Atmos.DV.HDR10+.H.265-FLUX",
+    "2160p.BluRay.REMUX.HEVC.TrueHD.7.1.Atmos-FGT",
+    "1080p.BluRay.x264.DTS-HD.MA.5.1-SPARKS",
+    "1080p.NF.WEB-DL.DDP5.1.H.264.DUAL-JHOM",
+    "1080p.DSNP.WEB-DL.DDP5.1.H.264-NTb",
+    "720p.WEBRip.x264.AAC2.0-YTS",
+    "720p.HDTV.x264-KILLERS",
+    "480p.DVDRip.XviD.AC3-COMANDO",
+]
+
+
+class FakeGDrive:
+    """Hands a fixed result list to Streams without touching Drive/OAuth."""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+
+    def get_acc_token(self, account=0):
+        return "ya29." + "a0AfB_byC" * 18
+
+    def token_expires_in(self, account=0):
+        return 3600
+
+
+def movie_meta(**kwargs):
+    meta = SimpleNamespace(
+        type="movie", stream_type="movie", id="tt1234567",
+        titles=["pirates of the goolag"], name="Pirates of the Goolag",
+        original_title="Pirates of the Goolag", year="2016", se=0, ep=0,
+    )
+    meta.__dict__.update(kwargs)
+    return meta
+
+
+def movie_files(n, title="Pirates.of.the.Goolag", year=2016):
+    from sgd.gdrive import DriveFile
+
+    return [
+        DriveFile(
+            id=f"1{i:032d}",
+            name=f"{title}.{year}.{RELEASE_TAGS[i % len(RELEASE_TAGS)]}.v{i}.mkv",
+            size=(i + 1) * 734_003_200,
+            drive_id=f"0AB{i % 5}",
+            md5=f"{i:032x}",
+        )
+        for i in range(n)
+    ]
+
+
+def measure(fn, repeat=20, number=1):
+    """Best/median wall time of ``fn`` in seconds, per call."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {"best": min(samples), "median": statistics.median(samples)}
@@ -0,0 +1,140 @@
+"""Generated release names and title lists for the hot-path benchmarks.
+
+Everything is drawn from a seeded random.Random, so a corpus (and the
+timings measured on it) is the same from run to run and machine to
+machine. Names mix the spellings found on real drives: dotted, spaced and
+bracketed titles in several languages, release tags, language tags and
+the usual ways of writing a season and episode.
+"""
+
+import random
+from types import SimpleNamespace
+
+from benchmarks._common import RELEASE_TAGS
+
+# (title, year, AKA titles in other languages)
+TITLES = [
+    ("Pirates of the Goolag", 2016, ["Piratas do Goolag", "Les Pirates du Goolag", "Die Piraten vom Goolag"]),
+    ("The Long Night Shift", 2019, ["O Longo Turno da Noite", "El Largo Turno de Noche", "La Longue Nuit"]),
+    ("Margo's Secret", 2021, ["O Segredo de Margo", "El Secreto de Margo", "Le Secret de Margo"]),
+    ("Dia D", 2004, ["D-Day", "Le Jour J", "Der Tag X"]),
+    ("Cidade Invisível", 2021, ["Invisible City", "Ciudad Invisible", "La Cité Invisible"]),
+    ("Ação e Reação", 2012, ["Action and Reaction", "Acción y Reacción"]),
+    ("Tokyo Drift Runners", 2008, ["Tōkyō Dorifuto", "Corredores de Tóquio"]),
+    ("Señora Acero", 2014, ["Mrs. Steel", "Senhora do Aço"]),
+    ("The Crown of Ashes", 2023, ["A Coroa de Cinzas", "La Corona de Cenizas", "Die Aschenkrone"]),
+    ("Über den Wolken", 2010, ["Above the Clouds", "Acima das Nuvens", "Au-dessus des Nuages"]),
+    ("It", 2017, ["A Coisa", "Eso", "Ça"]),
+    ("Station 19", 2018, ["Estação 19", "Estación 19"]),
+]
+
+LANGUAGE_TAGS = ["", "DUAL", "MULTi", "DUBLADO", "LEGENDADO", "NACIONAL", "VOSTFR", "SPANiSH", "iTA-ENG"]
+EXTENSIONS = ["mkv", "mkv", "mkv", "mp4", "avi"]
+SEPARATORS = [".", " ", "_"]
+
+# How a season and episode are written, from the common to the odd ones.
+EPISODE_STYLES = [
+    "S{se:02d}E{ep:02d}",
+    "s{se:02d}e{ep:02d}",
+    "S{se:02d}.E{ep:02d}",
+    "S{se:02d} E{ep:02d}",
+    "{se}x{ep:02d}",
+    "T{se:02d}E{ep:02d}",
+    "Season {se} Episode {ep}",
+    "S{se:02d}E{ep:02d}-E{next:02d}",
+]
+
+
+def _pick_title(rng, focus):
+    # `focus` of the names are of TITLES[0], as in a Drive search's results.
+    return TITLES[0] if rng.random() < focus else rng.choice(TITLES)
+
+
+def _title_variant(rng, title, akas):
+    name = rng.choice([title] * 3 + akas)
+    if rng.random() < 0.2:
+        name = name.lower()
+    return name
+
+
+def _join(rng, *parts):
+    sep = rng.choice(SEPARATORS)
+    words = " ".join(p for p in parts if p).split()
+    name = sep.join(words)
+    if rng.random() < 0.1:
+        name = f"[{rng.choice(['WWW.TORRENTS.COM', 'rarbg', 'Comando'])}] {name}"
+    return name
+
+
+def movie_names(n, seed=0, focus=0.0):
+    """`n` movie release names, of random titles from TITLES."""
+    rng = random.Random(seed)
+    names = []
+    for i in range(n):
+        title, year, akas = _pick_title(rng, focus)
+        year = year + rng.choice([0, 0, 0, 1, -1])
+        names.append(_join(
+            rng, _title_variant(rng, title, akas), str(year),
+            rng.choice(RELEASE_TAGS).replace(".", " "), rng.choice(LANGUAGE_TAGS),
+        ) + f".v{i}.{rng.choice(EXTENSIONS)}")
+    return names
+
+
+def episode_releases(n, seed=0, focus=0.0, seasons=3, episodes=12):
+    """`n` ``(release name, title, season, episode)`` of random titles."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        title, _, akas = _pick_title(rng, focus)
+        se, ep = rng.randint(1, seasons), rng.randint(1, episodes)
+        marker = rng.choice(EPISODE_STYLES).format(se=se, ep=ep, next=ep + 1)
+        name = _join(
+            rng, _title_variant(rng, title, akas), marker,
+            rng.choice(RELEASE_TAGS).replace(".", " "), rng.choice(LANGUAGE_TAGS),
+        ) + f".v{i}.{rng.choice(EXTENSIONS)}"
+        out.append((name, title, se, ep))
+    return out
+
+
+def episode_names(n, seed=0, focus=0.0, seasons=3, episodes=12):
+    """`n` episode release names, spread over the seasons of random titles."""
+    return [name for name, *_ in episode_releases(n, seed, focus, seasons, episodes)]
+
+
+def aka_titles(n, seed=0):
+    """A title list of `n` entries, the way Meta returns one (lowercased AKAs)."""
+    rng = random.Random(seed)
+    pool = [t.lower() for title, _, akas in TITLES for t in [title] + akas]
+    titles = pool[:1]
+    while len(titles) < n:
+        base = rng.choice(pool)
+        title = base + rng.choice(["", " the movie", " part 2", " reloaded", " o filme", " la película"])
+        if title in titles:
+            title += f" {len(titles)}"
+        titles.append(title)
+    return titles
+
+
+def drive_files(names, account=0):
+    from sgd.gdrive import DriveFile
+
+    return [
+        DriveFile(
+            id=f"1{i:032d}", name=name, size=(i % 40 + 1) * 367_001_600,
+            drive_id=f"0AB{i % 5}", md5=f"{i:032x}", account=account,
+        )
+        for i, name in enumerate(names)
+    ]
+
+
+def stream_meta(stream_type="movie", titles=None, se=1, ep=2):
+    """Meta-like metadata for TITLES[0] (episode `se`x`ep` of a series)."""
+    title, year, akas = TITLES[0]
+    if titles is None:
+        titles = [t.lower() for t in [title] + akas]
+    return SimpleNamespace(
+        type=stream_type, stream_type=stream_type, id="tt1234567",
+        titles=list(titles), name=title, original_title=title, year=str(year),
+        se=f"{se:02d}" if stream_type == "series" else 0,
+        ep=f"{ep:02d}" if stream_type == "series" else 0,
+    )
@@ -0,0 +1,120 @@
+"""Recall and cost of QUERY_MODE=broad against the strict per-title queries.
+
+Every title of benchmarks/_corpus.py is searched as a movie and as an
+episode (S01E02), in both modes, against a local fake Drive holding a
+synthetic library (see fake_drive.synthetic_library), through the real
+GoogleDrive search and Streams validation. Recall is the share of the
+streams found in strict mode that broad mode finds too; Drive round trips,
+queries and search time (with `--latency-ms` added to every round trip)
+are totalled per mode. `--akas` pads each title list with more spellings
+of its titles, like the long AKA lists IMDb returns.
+
+    python -m benchmarks.bench_broad [--movies 2000] [--episodes 4000]
+        [--akas 40] [--latency-ms 50]
+"""
+
+import argparse
+import itertools
+import logging
+import sys
+import time
+from types import SimpleNamespace
+
+import benchmarks._common  # noqa: F401 (sets a fake TOKEN before sgd is imported)
+from benchmarks import _corpus
+from benchmarks.fake_drive import FakeDriveServer, synthetic_library
+
+SUFFIXES = ["", " the movie", " o filme", " la película", " le film", " der film", " part 1", " dublado",
+            " legendado", " remastered", " extended cut", " director s cut"]
+
+
+def title_list(title, akas, n):
+    """The title, its AKAs and more spellings of them, up to `n`, like Meta's."""
+    from sgd.utils import strip_accents
+
+    titles = []
+    for base, suffix in itertools.product([title] + akas, SUFFIXES):
+        for t in (f"{base}{suffix}".lower(), strip_accents(f"{base}{suffix}".lower())):
+            if t not in titles:
+                titles.append(t)
+    return titles[: max(n, len(akas) + 1)]
+
+
+def metas(n_akas):
+    for i, (title, year, akas) in enumerate(_corpus.TITLES):
+        titles = title_list(title, akas, n_akas)
+        for stream_type in ("movie", "series"):
+            yield SimpleNamespace(
+                type=stream_type, stream_type=stream_type, id=f"tt{9100000 + i}",
+                titles=titles, name=title, original_title=title, year=str(year),
+                se="01" if stream_type == "series" else 0, ep="02" if stream_type == "series" else 0,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--movies", type=int, default=2000)
+    parser.add_argument("--episodes", type=int, default=4000)
+    parser.add_argument("--akas", type=int, default=40, help="titles per search")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    args = parser.parse_args()
+    logging.getLogger("sgd").setLevel(logging.WARNING)
+
+    from sgd import token
+    from sgd.cache import Json
+    from sgd.gdrive import GoogleDrive
+    from sgd.ratelimit import TokenBucket
+    from sgd.streams import Streams
+
+    gdrive_mod = sys.modules["sgd.gdrive"]
+    files, drives = synthetic_library(args.movies, args.episodes)
+
+    with FakeDriveServer((files, drives), latency=args.latency_ms / 1000) as server:
+        gd = GoogleDrive(token, api_url=server.url)
+        gd.limiter = TokenBucket("bench_broad", 1e6, 1e6)
+        gd.drive_names = Json("bench-drivenames.json")
+        # Known up front, so neither mode pays for drives.get.
+        gd.drive_names.contents = dict(drives)
+
+        totals = {mode: dict(requests=0, queries=0, seconds=0.0, streams=0) for mode in ("strict", "broad")}
+        found_both = found_strict = found_broad_only = 0
+        print(f"{len(files)} files, {len(_corpus.TITLES) * 2} searches of {args.akas} titles, "
+              f"{args.latency_ms:g} ms per round trip")
+        print(f"{'search':34} {'strict q':>8} {'broad q':>8} {'strict':>7} {'broad':>6} {'recall':>7}")
+
+        for sm in metas(args.akas):
+            streams = {}
+            for mode in ("strict", "broad"):
+                gdrive_mod.QUERY_MODE = mode
+                requests_, calls = server.requests, server.calls
+                start = time.perf_counter()
+                search = gd.search(sm)
+                elapsed = time.perf_counter() - start
+                streams[mode] = {c.file.id for c in Streams(search, sm).results}
+                total = totals[mode]
+                total["requests"] += server.requests - requests_
+                total["queries"] += server.calls - calls
+                total["seconds"] += elapsed
+                total["streams"] += len(streams[mode])
+                streams[mode, "queries"] = server.calls - calls
+
+            both = len(streams["strict"] & streams["broad"])
+            found_both += both
+            found_strict += len(streams["strict"])
+            found_broad_only += len(streams["broad"] - streams["strict"])
+            recall = both / len(streams["strict"]) if streams["strict"] else 1.0
+            label = f"{sm.name[:24]} ({sm.stream_type})"
+            print(f"{label:34} {streams['strict', 'queries']:8} {streams['broad', 'queries']:8} "
+                  f"{len(streams['strict']):7} {len(streams['broad']):6} {recall:7.0%}")
+
+    gdrive_mod.QUERY_MODE = "strict"
+    print()
+    print(f"{'mode':8} {'round trips':>11} {'queries':>8} {'search s':>9} {'streams':>8}")
+    for mode, total in totals.items():
+        print(f"{mode:8} {total['requests']:11} {total['queries']:8} {total['seconds']:9.2f} {total['streams']:8}")
+    recall = found_both / found_strict if found_strict else 1.0
+    print(f"recall of broad vs strict: {recall:.1%}; streams only broad found: {found_broad_only}")
+
+
+if __name__ == "__main__":
+    main()
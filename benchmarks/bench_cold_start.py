@@ -0,0 +1,82 @@
+"""Cold-start cost of a fresh serverless instance.
+
+Each run is a new interpreter that imports the app and serves its first
+``/manifest.json``, and then its first Drive call (building the Drive
+service, no network). That's what a cold Vercel invocation pays before it
+can answer. Reports the median of --runs and the heaviest imports.
+
+    python -m benchmarks.bench_cold_start [--runs 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import benchmarks._common  # noqa: F401  (sets the fake TOKEN)
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import sgd
+t1 = time.perf_counter()
+resp = sgd.app.test_client().get("/manifest.json")
+assert resp.status_code == 200
+t2 = time.perf_counter()
+sgd.gdrive.accounts[0].drive_instance
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "manifest": t2 - t0, "drive_service": t3 - t2}))
+"""
+
+
+def run_probe():
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], env=os.environ, check=True,
+        capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def top_imports(n=8):
+    """The slowest top-level packages (cumulative) from ``-X importtime``."""
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import sgd"], env=os.environ,
+        check=True, capture_output=True, text=True,
+    ).stderr
+    cumulative = {}
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "|" not in line[12:]:
+            continue
+        _, cum, name = line[12:].split("|")
+        try:
+            # Only direct imports of sgd or its submodules (two levels deep).
+            if len(name) - len(name.lstrip()) <= 3:
+                cumulative[name.strip()] = int(cum) / 1000
+        except ValueError:
+            pass
+    return sorted(cumulative.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [run_probe() for _ in range(args.runs)]
+    print(f"median of {args.runs} fresh interpreters")
+    for key, label in [
+        ("import", "import sgd"),
+        ("manifest", "first /manifest.json"),
+        ("drive_service", "first Drive call (+service)"),
+    ]:
+        print(f"  {label:28} {statistics.median(r[key] for r in runs) * 1000:8.1f} ms")
+
+    print("heaviest imports (cumulative)")
+    for name, ms in top_imports():
+        print(f"  {name:28} {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
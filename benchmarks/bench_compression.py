@@ -0,0 +1,67 @@
+"""Bytes saved and CPU spent compressing stream responses.
+
+Encodes a response of `--streams` movie streams (release names, emoji
+laden titles, Drive urls and proxy headers, as StreamEncoder sends them),
+then compresses it whole, as a cached response is, and streamed, as a
+search's response is (the opening chunk flushed first, then the encoder's
+chunks). CPU time is process time per response. Brotli rows need the
+``brotli`` package.
+
+    python -m benchmarks.bench_compression [--streams 50] [--repeat 200]
+"""
+
+import argparse
+import time
+
+from benchmarks._common import FakeGDrive, movie_files, movie_meta
+
+import sgd.compression as compression
+from sgd.encoder import StreamEncoder
+from sgd.streams import PlaybackUrls, Streams
+
+GZIP_LEVELS = (1, 6, 9)
+BROTLI_QUALITIES = (1, 5, 11)
+
+
+def cpu_time(fn, repeat):
+    """Best process (CPU) time of ``fn`` in seconds, per call."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        best = min(best, time.process_time() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    gdrive = FakeGDrive(movie_files(args.streams))
+    candidates = Streams(gdrive, movie_meta()).results
+    chunks = [b'{"streams":', *StreamEncoder().iter_encode(candidates, PlaybackUrls(gdrive)), b"}"]
+    body = b"".join(chunks)
+
+    settings = [("gzip", "GZIP_LEVEL", level) for level in GZIP_LEVELS]
+    if compression.brotli is not None:
+        settings += [("br", "BROTLI_QUALITY", quality) for quality in BROTLI_QUALITIES]
+
+    print(f"{len(candidates)} streams, {len(body)} bytes uncompressed")
+    print(f"{'':12} {'bytes':>8} {'ratio':>6} {'streamed':>9} {'CPU µs':>8}")
+    saved = compression.GZIP_LEVEL, compression.BROTLI_QUALITY
+    try:
+        for encoding, setting, level in settings:
+            setattr(compression, setting, level)
+            whole = compression.compress(body, encoding)
+            streamed = b"".join(compression.compress_stream(chunks, encoding))
+            cpu = cpu_time(lambda: compression.compress(body, encoding), args.repeat)
+            print(f"{f'{encoding} {level}':12} {len(whole):8d} {len(body) / len(whole):6.1f} "
+                  f"{len(streamed):9d} {cpu * 1e6:8.0f}")
+    finally:
+        compression.GZIP_LEVEL, compression.BROTLI_QUALITY = saved
+
+
+if __name__ == "__main__":
+    main()
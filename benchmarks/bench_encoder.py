@@ -0,0 +1,76 @@
+"""Payload size and encode time of a stream response.
+
+Compares the old serialization (``json.dumps`` of every stream dict,
+internal ``sortkeys`` included) against StreamEncoder, cold and with its
+per-stream cache warm, on the stdlib and (if installed) orjson backends.
+
+    python -m benchmarks.bench_encoder [--streams 50]
+"""
+
+import argparse
+import json
+
+from benchmarks._common import FakeGDrive, measure, movie_files, movie_meta
+
+import sgd.encoder as encoder_mod
+from sgd.encoder import StreamEncoder
+from sgd.streams import PlaybackUrls, Streams
+
+
+def legacy_dumps(candidates, urls):
+    return json.dumps([
+        {
+            "behaviorHints": {**c.behavior_hints, "proxyHeaders": urls.proxy_headers(c.file)},
+            "filename": c.file.name,
+            "url": urls.stream_url(c.file),
+            "name": c.name,
+            "title": c.title,
+            "sortkeys": c.parsed.sortkeys,
+        }
+        for c in candidates
+    ]).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    gdrive = FakeGDrive(movie_files(args.streams))
+    candidates = Streams(gdrive, movie_meta()).results
+    urls = PlaybackUrls(gdrive)
+
+    rows = [("legacy json.dumps", legacy_dumps(candidates, urls),
+             measure(lambda: legacy_dumps(candidates, urls), args.repeat))]
+
+    backends = [("stdlib", None)]
+    if encoder_mod.orjson is not None:
+        backends.append(("orjson", encoder_mod.orjson))
+
+    saved = encoder_mod.orjson
+    try:
+        for label, backend in backends:
+            encoder_mod.orjson = backend
+
+            def cold():
+                encoder = StreamEncoder()
+                return b"".join(encoder.iter_encode(candidates, urls))
+
+            warm_encoder = StreamEncoder()
+            body = b"".join(warm_encoder.iter_encode(candidates, urls))
+            warm = lambda: b"".join(warm_encoder.iter_encode(candidates, urls))
+
+            rows.append((f"StreamEncoder {label} cold", body, measure(cold, args.repeat)))
+            rows.append((f"StreamEncoder {label} warm", body, measure(warm, args.repeat)))
+    finally:
+        encoder_mod.orjson = saved
+
+    print(f"{len(candidates)} streams")
+    print(f"{'':32} {'bytes':>8} {'best µs':>10} {'median µs':>10}")
+    for label, body, timing in rows:
+        print(f"{label:32} {len(body):8d} {timing['best'] * 1e6:10.1f} {timing['median'] * 1e6:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Timings of the stream request hot path, saved as JSON to compare runs.
+
+Measured on generated corpora (see benchmarks/_corpus.py): Drive query
+building (`qgen`, `get_query`) for title lists of several sizes,
+`parse_title` on cold names, `Streams` validation and ranking of movie and
+episode results, and a whole `get_streams` call. The last one goes
+through the real GoogleDrive search (query plan, batches, dedupe, drive
+names), Streams and the encoder, with Drive replaced by an in-process
+service that hands out corpus files and metadata by a fixed Meta.
+
+    python -m benchmarks.bench_hotpath [--names 2000] [--output FILE]
+        [--compare OLD.json]
+
+Results go to bench_results/hotpath-<time>.json unless --output is given;
+with --compare, each case is also printed as a ratio to an older run.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+
+from benchmarks import _corpus
+from benchmarks._common import FakeGDrive, measure
+
+# Share of the files a search returns that are of the title searched for
+# (and, in the episode corpora, a third of those of the episode).
+FOCUS = 0.5
+
+
+class CorpusBatch:
+    def __init__(self, service):
+        self.service = service
+        self.requests = []
+
+    def add(self, request, callback, request_id):
+        self.requests.append((request, callback, request_id))
+
+    def execute(self):
+        # The corpus is dealt out over the files.list queries of the batch,
+        # so the total handed back doesn't grow with the number of queries.
+        lists = [r for r in self.requests if "q" in r[0]]
+        for n, (request, callback, request_id) in enumerate(lists):
+            files = self.service.files_[n :: len(lists)]
+            callback(request_id, {"files": files}, None)
+        for request, callback, request_id in self.requests:
+            if "driveId" in request:
+                callback(request_id, {"id": request["driveId"], "name": f"Drive {request['driveId']}"}, None)
+
+
+class CorpusDriveService:
+    """A Drive v3 service answering files.list with corpus files."""
+
+    def __init__(self, files):
+        self.files_ = [
+            {"id": f.id, "name": f.name, "size": str(f.size), "driveId": f.drive_id, "md5Checksum": f.md5}
+            for f in files
+        ]
+
+    def files(self):
+        return self
+
+    def drives(self):
+        return self
+
+    def list(self, **kwargs):
+        return kwargs
+
+    def get(self, **kwargs):
+        return kwargs
+
+    def new_batch_http_request(self):
+        return CorpusBatch(self)
+
+
+def corpus_drive(files):
+    from sgd import token
+    from sgd.cache import Json
+    from sgd.gdrive import GoogleDrive
+    from sgd.ratelimit import TokenBucket
+
+    gd = GoogleDrive(token)
+    gd.drive_instance = CorpusDriveService(files)
+    gd.limiter = TokenBucket("bench", 1e9, 1e9)
+    # Keep the app's own drive name cache out of it.
+    gd.drive_names = Json("bench-drivenames.json")
+    gd.get_acc_token = FakeGDrive().get_acc_token
+    return gd
+
+
+def bench_queries(args, results):
+    from sgd.gdrive import GoogleDrive
+
+    gd = GoogleDrive.__new__(GoogleDrive)
+    titles = _corpus.aka_titles(args.titles)
+    results["qgen"] = dict(
+        measure(lambda: [GoogleDrive.qgen(t) for t in titles], args.repeat), items=len(titles)
+    )
+    for n in (1, 10, args.titles):
+        for stream_type in ("movie", "series"):
+            sm = _corpus.stream_meta(stream_type, titles[:n])
+            results[f"get_query/{stream_type}/{n}_titles"] = dict(
+                measure(lambda: gd.get_query(sm), args.repeat), items=n
+            )
+
+
+def bench_parse(args, results):
+    from sgd.ptn import parse_title
+
+    for label, names in [
+        ("movie", _corpus.movie_names(args.names)),
+        ("episode", _corpus.episode_names(args.names)),
+    ]:
+        def parse_cold():
+            parse_title.cache_clear()
+            for name in names:
+                parse_title(name)
+
+        results[f"parse_title/{label}"] = dict(measure(parse_cold, args.slow_repeat), items=len(names))
+
+
+def bench_streams(args, results):
+    from sgd.ptn import parse_title
+    from sgd.streams import Streams
+
+    for label, stream_type, names in [
+        ("movie", "movie", _corpus.movie_names(args.names, focus=FOCUS)),
+        ("episode", "series", _corpus.episode_names(args.names, focus=FOCUS, seasons=1, episodes=3)),
+    ]:
+        gdrive = FakeGDrive(_corpus.drive_files(names))
+        sm = _corpus.stream_meta(stream_type)
+        matched = len(Streams(gdrive, sm).results)
+
+        def cold():
+            parse_title.cache_clear()
+            Streams(gdrive, sm)
+
+        results[f"streams/{label}/cold"] = dict(measure(cold, args.slow_repeat), items=len(names), matched=matched)
+        results[f"streams/{label}/parsed"] = dict(
+            measure(lambda: Streams(gdrive, sm), args.slow_repeat), items=len(names), matched=matched
+        )
+
+
+def bench_get_streams(args, results):
+    import sgd.routes as routes
+    from sgd.drivepool import DrivePool
+    from sgd.ptn import parse_title
+
+    saved = routes.gdrive, routes.Meta
+    os.environ.pop("CF_PROXY_URL", None)
+    try:
+        for label, stream_type, stream_id, names in [
+            ("movie", "movie", "tt1234567", _corpus.movie_names(args.names, focus=FOCUS)),
+            ("episode", "series", "tt1234567:1:2", _corpus.episode_names(args.names, focus=FOCUS, seasons=1, episodes=3)),
+        ]:
+            files = _corpus.drive_files(names)
+            sm = _corpus.stream_meta(stream_type, _corpus.aka_titles(args.titles))
+            routes.gdrive = DrivePool([corpus_drive(files)])
+            routes.Meta = lambda stream_type, stream_id, deadline=None, sm=sm: sm
+
+            def cold():
+                routes.stream_cache.clear()
+                routes.stream_encoder.clear()
+                parse_title.cache_clear()
+                return b"".join(routes.get_streams(stream_type, stream_id))
+
+            body = cold()
+            warm = lambda: b"".join(routes.get_streams(stream_type, stream_id))
+            results[f"get_streams/{label}/cold"] = dict(
+                measure(cold, args.slow_repeat), items=len(files), bytes=len(body)
+            )
+            results[f"get_streams/{label}/cached"] = dict(measure(warm, args.repeat), bytes=len(warm()))
+    finally:
+        routes.gdrive, routes.Meta = saved
+        routes.stream_cache.clear()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--names", type=int, default=2000, help="release names per corpus")
+    parser.add_argument("--titles", type=int, default=100, help="titles in the largest AKA list")
+    parser.add_argument("--repeat", type=int, default=50, help="runs of the fast cases")
+    parser.add_argument("--slow-repeat", type=int, default=5, help="runs of the parsing cases")
+    parser.add_argument("--output", help="JSON file to write (default: bench_results/hotpath-<time>.json)")
+    parser.add_argument("--compare", help="an earlier JSON result to compare against")
+    args = parser.parse_args()
+    # One INFO line per search would drown the table.
+    logging.getLogger("sgd").setLevel(logging.WARNING)
+
+    results = {}
+    for bench in (bench_queries, bench_parse, bench_streams, bench_get_streams):
+        bench(args, results)
+
+    old = {}
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)["results"]
+
+    print(f"{'':36} {'items':>6} {'best ms':>10} {'median ms':>10}" + (f" {'vs old':>8}" if old else ""))
+    for case, r in results.items():
+        line = f"{case:36} {r.get('items', ''):>6} {r['best'] * 1e3:10.3f} {r['median'] * 1e3:10.3f}"
+        if case in old:
+            line += f" {r['median'] / old[case]['median']:7.2f}x"
+        print(line)
+
+    output = args.output or os.path.join(
+        "bench_results", f"hotpath-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "benchmark": "hotpath",
+            "time": time.time(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "results": results,
+        }, f, indent=2)
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
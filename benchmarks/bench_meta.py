@@ -0,0 +1,94 @@
+"""Metadata resolution (Meta) replayed from a cassette, with no network.
+
+Every title of the cassette (by default the bundled synthetic one, see
+benchmarks/make_meta_cassette.py) is resolved cold, with its metadata
+cache file removed first, then again from the cache. `--latency` replays
+the recorded request times ("recorded"), a fixed number of seconds, or
+none ("0", which leaves only our own parsing). `--clients` resolves that
+many titles at once, as concurrent stream requests would.
+
+    python -m benchmarks.bench_meta [--cassette FILE] [--latency recorded]
+        [--clients 8] [--no-tmdb]
+"""
+
+import argparse
+import logging
+import os
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmarks._common  # noqa: F401 (sets a fake TOKEN before sgd is imported)
+from benchmarks.make_meta_cassette import DEFAULT_OUTPUT
+
+CINEMETA_URL = re.compile(r"^v3-cinemeta\.strem\.io/meta/(movie|series)/(tt\d+)\.json$")
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cassette", default=DEFAULT_OUTPUT)
+    parser.add_argument("--latency", default="recorded", help='"recorded" or seconds per request')
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--no-tmdb", action="store_true", help="resolve without the TMDB responses")
+    args = parser.parse_args()
+
+    os.environ["UPSTREAM_CASSETTE"] = args.cassette
+    os.environ["UPSTREAM_CASSETTE_MODE"] = "replay"
+    os.environ["UPSTREAM_REPLAY_LATENCY"] = args.latency
+    if args.no_tmdb:
+        os.environ.pop("TMDB_API_KEY", None)
+    else:
+        # Any key will do: it's not part of the recorded urls.
+        os.environ["TMDB_API_KEY"] = "replay"
+    logging.getLogger("sgd").setLevel(logging.WARNING)
+
+    from sgd import cassette
+    from sgd.meta import Meta
+
+    recorder = cassette.active()
+    titles = sorted(m.groups() for m in map(CINEMETA_URL.match, recorder.entries) if m)
+    if not titles:
+        raise SystemExit(f"No Cinemeta responses in {args.cassette}")
+
+    def resolve(title):
+        stream_type, imdb_id = title
+        stream_id = f"{imdb_id}:1:1" if stream_type == "series" else imdb_id
+        start = time.perf_counter()
+        meta = Meta(stream_type, stream_id)
+        return time.perf_counter() - start, len(meta.titles)
+
+    def cache_files():
+        return [f"/tmp/{imdb_id}.json" for _, imdb_id in titles]
+
+    for path in cache_files():
+        if os.path.exists(path):
+            os.remove(path)
+    try:
+        print(f"{len(titles)} titles from {args.cassette}, {args.clients} at once, latency {args.latency}")
+        print(f"{'':8} {'titles/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'titles/meta':>12}")
+        for label in ("cold", "cached"):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.clients) as pool:
+                runs = list(pool.map(resolve, titles))
+            elapsed = time.perf_counter() - start
+            times = [t for t, _ in runs]
+            print(
+                f"{label:8} {len(runs) / elapsed:9.1f} {statistics.median(times) * 1e3:9.2f} "
+                f"{percentile(times, 0.95) * 1e3:9.2f} {max(times) * 1e3:9.2f} "
+                f"{statistics.mean(n for _, n in runs):12.1f}"
+            )
+        print(f"cassette: {recorder.hits} replayed, {recorder.misses} missing")
+    finally:
+        for path in cache_files():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Throughput and time to first byte of the /load range proxy.
+
+Range requests are sent straight to a local fake Drive media server, then
+through the addon's /load route (served by werkzeug's threaded server),
+so the difference is the proxy's overhead. `--latency-ms` is added by the
+fake Drive before each response.
+
+    python -m benchmarks.bench_proxy [--clients 8] [--requests 64]
+        [--range-mb 8] [--latency-ms 20]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks._common import FakeGDrive
+from benchmarks.fake_drive import FakeDriveServer
+
+FILE_SIZE = 512 * 2**20
+
+
+def serve_addon():
+    from werkzeug.serving import make_server
+
+    from sgd import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run(url, args):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.clients))
+    range_size = args.range_mb * 2**20
+    rng = random.Random(0)
+    starts = [rng.randrange(0, FILE_SIZE - range_size) for _ in range(args.requests)]
+
+    def one(start):
+        begin = time.perf_counter()
+        headers = {"Range": f"bytes={start}-{start + range_size - 1}", "Authorization": "Bearer x"}
+        with session.get(url, headers=headers, stream=True) as resp:
+            assert resp.status_code == 206, resp.status_code
+            chunks = resp.iter_content(256 * 1024)
+            received = len(next(chunks))
+            first_byte = time.perf_counter() - begin
+            for chunk in chunks:
+                received += len(chunk)
+        assert received == range_size, received
+        return first_byte
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        ttfb = list(pool.map(one, starts))
+    elapsed = time.perf_counter() - begin
+    return args.requests * range_size / elapsed / 2**20, ttfb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent range requests")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--range-mb", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    import sgd.routes as routes
+    from sgd import proxy
+
+    os.environ["LOCAL_PROXY"] = "1"
+    routes.gdrive = FakeGDrive()
+    file_id = "fakefile0000"
+
+    with FakeDriveServer({file_id: FILE_SIZE}, latency=args.latency_ms / 1000) as drive:
+        proxy.DRIVE_MEDIA_URL = f"{drive.url}/drive/v3/files"
+        addon, addon_url = serve_addon()
+        try:
+            print(f"{args.requests} x {args.range_mb} MiB ranges, {args.clients} at once, "
+                  f"{args.latency_ms:.0f}ms fake Drive latency")
+            print(f"{'':16} {'MB/s':>9} {'TTFB p50 ms':>12} {'TTFB p95 ms':>12}")
+            for label, url in [
+                ("direct", f"{proxy.DRIVE_MEDIA_URL}/{file_id}?alt=media"),
+                ("via /load", f"{addon_url}/load/{file_id}/movie.mkv"),
+            ]:
+                mbps, ttfb = run(url, args)
+                ttfb.sort()
+                p95 = ttfb[min(len(ttfb) - 1, int(len(ttfb) * 0.95))]
+                print(f"{label:16} {mbps:9.1f} {statistics.median(ttfb) * 1e3:12.1f} {p95 * 1e3:12.1f}")
+        finally:
+            addon.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+"""A local stand-in for the Google Drive v3 API, for tests and benchmarks.
+
+Serves, from a ThreadingHTTPServer, the parts of Drive the addon uses:
+
+* ``GET /drive/v3/files`` (files.list): the ``q`` subset the addon
+  writes (``name contains``, ``mimeType contains`` / ``=``, ``trashed``,
+  ``'<id>' in parents``, ``and`` / ``or`` / ``not`` and parentheses),
+  ``pageSize`` / ``pageToken`` pagination, ``corpora`` and ``driveId``,
+  and the ``files(...)`` part of ``fields``.
+* ``GET /drive/v3/drives/<id>`` and ``GET /drive/v3/drives`` (drives.get
+  and drives.list).
+* ``POST /batch/drive/v3``: multipart batches of the above.
+* ``GET /drive/v3/files/<id>?alt=media``: single-range downloads. Every
+  file has the same repeating content, so any range can be checked with
+  `expected_bytes`.
+* ``POST /token`` and ``/oauth2/v4/token``: OAuth access tokens.
+
+Like Drive, ``name contains`` matches whole words of the name, the last one
+as a prefix (``'pira'`` matches "Pirates.of.the.Goolag", ``'rates'``
+doesn't). `latency` is added before every response and `error_rate` of the
+files.list calls are answered with `error_status` (a rate limit error by
+default), so slow and flaky Drives can be reproduced. Point the addon at
+it with DRIVE_API_URL:
+
+    with FakeDriveServer(synthetic_library(), latency=0.05) as server:
+        gd = GoogleDrive(token, api_url=server.url)
+
+    python -m benchmarks.fake_drive [--port 8765] [--movies 500]
+        [--episodes 2000] [--latency-ms 50] [--error-rate 0.01]
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import benchmarks._common  # noqa: F401 (sets a fake TOKEN before sgd is imported)
+from benchmarks import _corpus
+from sgd.proxy import parse_range
+
+# 1 MiB that every file repeats: fast to slice, and offsets are checkable.
+PATTERN = bytes(range(256)) * 4096
+WRITE_SIZE = 64 * 1024
+FOLDER = "application/vnd.google-apps.folder"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# What the files.list error answers say, by status.
+ERROR_REASONS = {403: "userRateLimitExceeded", 429: "rateLimitExceeded", 500: "backendError"}
+
+
+class FakeFile(NamedTuple):
+    id: str
+    name: str
+    size: int = 0
+    drive_id: Optional[str] = None
+    md5: Optional[str] = None
+    mime_type: str = "video/x-matroska"
+    parents: tuple = ()
+    trashed: bool = False
+
+    def api(self):
+        """The file as files.list returns it."""
+        item = {"kind": "drive#file", "id": self.id, "name": self.name, "mimeType": self.mime_type}
+        if self.mime_type != FOLDER:
+            item["size"] = str(self.size)
+        if self.drive_id:
+            item["driveId"] = self.drive_id
+        if self.md5:
+            item["md5Checksum"] = self.md5
+        if self.parents:
+            item["parents"] = list(self.parents)
+        item["trashed"] = self.trashed
+        return item
+
+
+def expected_bytes(start, end):
+    """The content of any fake file from `start` to `end` (inclusive)."""
+    out = bytearray()
+    while start <= end:
+        offset = start % len(PATTERN)
+        piece = PATTERN[offset : offset + end - start + 1]
+        out += piece
+        start += len(piece)
+    return bytes(out)
+
+
+def synthetic_library(movies=500, episodes=2000, drives=3, seed=0):
+    """``(files, drives)``: corpus releases spread over shared drives.
+
+    Episodes are filed as ``<show>/Season <n>/<release>`` folders, movies
+    at the root of their drive, and one in fifty files is in the trash.
+    """
+    rng = random.Random(seed)
+    drive_names = {f"0ADrive{d:04d}": f"Shared drive {d}" for d in range(drives)}
+    drive_ids = list(drive_names)
+    files = {}
+
+    def add(name, drive_id, mime_type="video/x-matroska", parents=(), size=0):
+        file_id = f"1fake{len(files):028d}"
+        files[file_id] = FakeFile(
+            file_id, name, size, drive_id,
+            f"{len(files):032x}" if mime_type != FOLDER else None,
+            mime_type, tuple(parents) or (drive_id,), rng.random() < 0.02,
+        )
+        return file_id
+
+    for name in _corpus.movie_names(movies, seed):
+        add(name, rng.choice(drive_ids), size=rng.randint(700, 60_000) * 2**20)
+
+    folders = {}
+    for name, title, se, _ in _corpus.episode_releases(episodes, seed):
+        # Every season of a show on the same drive.
+        drive_id = drive_ids[sum(map(ord, title)) % len(drive_ids)]
+        if (title, None) not in folders:
+            folders[title, None] = add(title, drive_id, FOLDER)
+        if (title, se) not in folders:
+            folders[title, se] = add(f"Season {se}", drive_id, FOLDER, [folders[title, None]])
+        add(name, drive_id, parents=[folders[title, se]], size=rng.randint(200, 4_000) * 2**20)
+    return files, drive_names
+
+
+# --- queries -------------------------------------------------------------
+
+TOKEN = re.compile(r"\s*(?:(\()|(\))|'((?:[^'\\]|\\.)*)'|(!=|=)|([A-Za-z]+))")
+WORD = re.compile(r"[^\W_]+")
+
+
+def tokenize(q):
+    tokens = []
+    pos = 0
+    q = q.strip()
+    while pos < len(q):
+        match = TOKEN.match(q, pos)
+        if not match:
+            raise ValueError(f"Invalid query at {q[pos:]!r}")
+        lparen, rparen, string, op, word = match.groups()
+        if string is not None:
+            tokens.append(("str", re.sub(r"\\(.)", r"\1", string)))
+        else:
+            tokens.append(("op", lparen or rparen or op or word))
+        pos = match.end()
+    return tokens
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+def name_contains(name, value):
+    """Drive's ``name contains``: whole words in order, the last as a prefix."""
+    wanted = words(value)
+    if not wanted:
+        return False
+    have = words(name)
+    *whole, prefix = wanted
+    for i in range(len(have) - len(wanted) + 1):
+        if have[i : i + len(whole)] == whole and have[i + len(whole)].startswith(prefix):
+            return True
+    return False
+
+
+class Query:
+    """A files.list ``q``, parsed into a predicate over FakeFiles."""
+
+    def __init__(self, q):
+        self.tokens = tokenize(q)
+        self.pos = 0
+        self.match = self.parse_or() if self.tokens else (lambda f: True)
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Unexpected {self.tokens[self.pos][1]!r} in query")
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1].lower() != value):
+            raise ValueError(f"Expected {value or kind}, got {token[1]!r}")
+        self.pos += 1
+        return token[1]
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.peek() == ("op", "or"):
+            self.take()
+            terms.append(self.parse_and())
+        return terms[0] if len(terms) == 1 else (lambda f: any(t(f) for t in terms))
+
+    def parse_and(self):
+        factors = [self.parse_not()]
+        while self.peek() == ("op", "and"):
+            self.take()
+            factors.append(self.parse_not())
+        return factors[0] if len(factors) == 1 else (lambda f: all(t(f) for t in factors))
+
+    def parse_not(self):
+        if self.peek() == ("op", "not"):
+            self.take()
+            inner = self.parse_not()
+            return lambda f: not inner(f)
+        if self.peek() == ("op", "("):
+            self.take()
+            inner = self.parse_or()
+            self.take("op", ")")
+            return inner
+        return self.parse_term()
+
+    def parse_term(self):
+        kind, value = self.peek()
+        if kind == "str":
+            self.take()
+            self.take("op", "in")
+            self.take("op", "parents")
+            return lambda f: value in f.parents
+
+        field = self.take("op")
+        op = self.take("op")
+        if field == "name" and op == "contains":
+            wanted = self.take("str")
+            return lambda f: name_contains(f.name, wanted)
+        if field == "mimeType" and op in ("contains", "=", "!="):
+            wanted = self.take("str")
+            if op == "contains":
+                return lambda f: wanted in f.mime_type
+            return lambda f: (f.mime_type == wanted) == (op == "=")
+        if field == "name" and op in ("=", "!="):
+            wanted = self.take("str")
+            return lambda f: (f.name == wanted) == (op == "=")
+        if field == "trashed" and op in ("=", "!="):
+            wanted = self.take("op").lower() == "true"
+            return lambda f: (f.trashed == wanted) == (op == "=")
+        raise ValueError(f"Unsupported query term: {field} {op}")
+
+
+def select_fields(item, fields, collection=None):
+    """`item` reduced to a `fields` mask (its ``<collection>(...)`` part)."""
+    if collection:
+        match = re.search(rf"{collection}\(([^)]*)\)", fields or "")
+        fields = match and match.group(1)
+    if not fields:
+        return item
+    wanted = {f.strip() for f in fields.split(",")}
+    return {k: v for k, v in item.items() if k in wanted}
+
+
+# --- server --------------------------------------------------------------
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        path = urlsplit(self.path).path
+
+        if method == "POST" and path in ("/token", "/oauth2/v4/token"):
+            return self.reply(*server.token())
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self.reply(*json_error(401, "authError", "Unauthorized"))
+        if method == "POST" and path == "/batch/drive/v3":
+            return self.reply(*server.batch(self.headers.get("Content-Type", ""), body))
+
+        match = re.match(r"^/drive/v3/files/([^/]+)$", path)
+        if method == "GET" and match and "alt=media" in self.path:
+            file = server.files.get(match.group(1))
+            if file is None or file.mime_type == FOLDER:
+                return self.reply(*json_error(404, "notFound", "File not found"))
+            return self.send_media(file.size)
+        self.reply(*server.route(method, self.path))
+
+    def send_media(self, size):
+        try:
+            byte_range = parse_range(self.headers.get("Range"), size)
+        except ValueError:
+            return self.reply(416, {"Content-Range": f"bytes */{size}"}, b"Range Not Satisfiable")
+
+        start, end = byte_range or (0, size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", "video/x-matroska")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        view = memoryview(PATTERN)
+        try:
+            while start <= end:
+                offset = start % len(PATTERN)
+                n = min(WRITE_SIZE, end - start + 1, len(PATTERN) - offset)
+                self.wfile.write(view[offset : offset + n])
+                start += n
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (a player seeking away): normal.
+            self.close_connection = True
+
+    def reply(self, status, headers, body):
+        self.send_response(status)
+        headers = {"Content-Type": "application/json; charset=UTF-8", **headers}
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def json_reply(obj, status=200):
+    return status, {}, json.dumps(obj).encode()
+
+
+def json_error(status, reason, message):
+    return json_reply({"error": {"code": status, "message": message, "errors": [
+        {"domain": "usageLimits" if "RateLimit" in reason else "global", "reason": reason, "message": message},
+    ]}}, status)
+
+
+class FakeDriveServer(ThreadingHTTPServer):
+    """The fake Drive, run on a background thread as a context manager.
+
+    `files` maps file ids to FakeFiles, or to a size for a bare media file
+    (only downloadable); `drives` maps shared drive ids to names. Any
+    ``(files, drives)`` pair from `synthetic_library` can be passed as is.
+    `latency` (seconds) is added before every response, and `error_rate`
+    of the files.list calls fail with `error_status`. `requests` counts
+    HTTP requests and `calls` the API calls in them (batched or not).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, files, drives=None, latency=0.0, error_rate=0.0, error_status=429,
+                 host="127.0.0.1", port=0, seed=0):
+        super().__init__((host, port), FakeDriveHandler)
+        if isinstance(files, tuple) and drives is None:
+            files, drives = files
+        self.files = {
+            file_id: f if isinstance(f, FakeFile) else FakeFile(file_id, f"{file_id}.mkv", f)
+            for file_id, f in files.items()
+        }
+        self.drives = dict(drives or {})
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.calls = 0
+        self.tokens_issued = 0
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    def token(self):
+        with self.lock:
+            self.tokens_issued += 1
+            n = self.tokens_issued
+        return json_reply({"access_token": f"fake-access-{n}", "expires_in": 3599, "token_type": "Bearer"})
+
+    def route(self, method, target):
+        """``(status, headers, body)`` of one API call."""
+        with self.lock:
+            self.calls += 1
+        url = urlsplit(target)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if method == "GET" and url.path == "/drive/v3/files":
+            return self.list_files(params)
+        if method == "GET" and url.path == "/drive/v3/drives":
+            return self.list_drives(params)
+        match = re.match(r"^/drive/v3/drives/([^/]+)$", url.path)
+        if method == "GET" and match:
+            drive_id = match.group(1)
+            if drive_id not in self.drives:
+                return json_error(404, "notFound", f"Shared drive not found: {drive_id}")
+            drive = {"kind": "drive#drive", "id": drive_id, "name": self.drives[drive_id]}
+            return json_reply(select_fields(drive, params.get("fields")))
+        return json_error(404, "notFound", f"Not found: {method} {url.path}")
+
+    def list_files(self, params):
+        with self.lock:
+            failed = self.error_rate and self.rng.random() < self.error_rate
+        if failed:
+            return json_error(self.error_status, ERROR_REASONS.get(self.error_status, "unknown"), "Injected error")
+        try:
+            match = Query(params.get("q", "")).match
+            page_size = min(int(params.get("pageSize", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            offset = int(params.get("pageToken", 0))
+        except ValueError as e:
+            return json_error(400, "invalid", str(e))
+
+        corpora = params.get("corpora", "user")
+        drive_id = params.get("driveId")
+        if corpora == "drive" and drive_id not in self.drives:
+            return json_error(404, "notFound", f"Shared drive not found: {drive_id}")
+        all_drives = params.get("includeItemsFromAllDrives") == "true"
+
+        def in_corpus(f):
+            if corpora == "drive":
+                return f.drive_id == drive_id
+            if corpora == "allDrives" and all_drives:
+                return True
+            return f.drive_id is None
+
+        hits = [f for f in self.files.values() if in_corpus(f) and match(f)]
+        page = hits[offset : offset + page_size]
+        out = {"kind": "drive#fileList", "incompleteSearch": False}
+        if offset + page_size < len(hits):
+            out["nextPageToken"] = str(offset + page_size)
+        out["files"] = [select_fields(f.api(), params.get("fields"), "files") for f in page]
+        return json_reply(out)
+
+    def list_drives(self, params):
+        page_size = min(int(params.get("pageSize", 10)), 100)
+        offset = int(params.get("pageToken", 0))
+        drives = list(self.drives.items())
+        out = {"kind": "drive#driveList", "drives": [
+            {"kind": "drive#drive", "id": d, "name": name} for d, name in drives[offset : offset + page_size]
+        ]}
+        if offset + page_size < len(drives):
+            out["nextPageToken"] = str(offset + page_size)
+        return json_reply(out)
+
+    def batch(self, content_type, body):
+        """Answer a multipart/mixed batch, one application/http part per call."""
+        message = BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        if not message.is_multipart():
+            return json_error(400, "badRequest", "Batch body isn't multipart/mixed")
+
+        boundary = f"batch_{self.rng.getrandbits(64):016x}"
+        out = []
+        for part in message.get_payload():
+            request_line = part.get_payload().split("\n", 1)[0]
+            method, target, _ = request_line.split(" ", 2)
+            status, headers, answer = self.route(method, target)
+            content_id = part["Content-ID"] or ""
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id.strip('<>')}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(answer)}\r\n\r\n"
+            )
+            out.append(answer.decode())
+            out.append("\r\n")
+        out.append(f"--{boundary}--\r\n")
+        return 200, {"Content-Type": f"multipart/mixed; boundary={boundary}"}, "".join(out).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--movies", type=int, default=500)
+    parser.add_argument("--episodes", type=int, default=2000)
+    parser.add_argument("--drives", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=429, choices=sorted(ERROR_REASONS))
+    args = parser.parse_args()
+
+    library = synthetic_library(args.movies, args.episodes, args.drives)
+    server = FakeDriveServer(
+        library, latency=args.latency_ms / 1000, error_rate=args.error_rate,
+        error_status=args.error_status, port=args.port,
+    )
+    print(f"Serving {len(server.files)} fake files in {len(server.drives)} drives on {server.url}")
+    print(f"Run the addon with DRIVE_API_URL={server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Request throughput of the ASGI app vs the Flask WSGI app.
+
+Both apps are driven in-process against a fake upstream: metadata and the
+Drive search just sleep for the configured latency, so the numbers reflect
+how many slow searches each app can keep in flight, not parsing speed.
+
+Both get the same thread budget. The WSGI app is run the way a threaded
+sync server runs it (each thread handles one request at a time, start to
+finish); the ASGI app gets every request at once, like an event-loop
+server would, and runs searches on its ASGI_WORKERS pool. Besides
+throughput, the peak number of requests in flight (accepted and being
+served) and of concurrent upstream searches are reported: the ASGI app
+holds far more requests open, but distinct searches are capped at the
+thread count in both.
+
+    python -m benchmarks.loadtest_asgi [--requests 400] [--distinct 400]
+        [--threads 32] [--latency-ms 300]
+
+Lower --distinct to simulate many users opening the same titles.
+"""
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks._common import FakeGDrive, movie_files, movie_meta
+
+
+class Peak:
+    """Counts concurrent entries into a `with` block, keeping the peak."""
+
+    def __init__(self):
+        self.current = self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.current -= 1
+
+
+class SlowGDrive(FakeGDrive):
+    def __init__(self, latency):
+        super().__init__(movie_files(20))
+        self.latency = latency
+        self.in_flight = Peak()
+
+    def search(self, stream_meta, deadline=None):
+        from sgd.gdrive import DriveSearch
+
+        with self.in_flight:
+            time.sleep(self.latency)
+        return DriveSearch([], self.results, len(self.results))
+
+
+def install_fake_upstream(latency):
+    import sgd.routes as routes
+
+    def slow_meta(stream_type, stream_id, deadline=None):
+        time.sleep(latency / 3)
+        return movie_meta(id=stream_id)
+
+    routes.gdrive = SlowGDrive(latency)
+    routes.Meta = slow_meta
+    os.environ.pop("CF_PROXY_URL", None)
+    return routes
+
+
+def run_wsgi(paths, threads, in_flight):
+    from sgd import app
+
+    def worker(path):
+        with in_flight:
+            resp = app.test_client().get(path)
+            assert resp.status_code == 200, resp.status_code
+            resp.get_data()  # runs the streamed search
+
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(worker, paths))
+
+
+def run_asgi(paths, in_flight):
+    from sgd.asgi import app
+
+    async def request(path):
+        status = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        with in_flight:
+            await app({"type": "http", "method": "GET", "path": path, "headers": []}, receive, send)
+        assert status == [200], status
+
+    async def burst():
+        await asyncio.gather(*(request(p) for p in paths))
+
+    asyncio.run(burst())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--distinct", type=int, default=400, help="distinct stream ids")
+    parser.add_argument("--threads", type=int, default=32,
+                        help="WSGI server threads, and ASGI_WORKERS for the ASGI app")
+    parser.add_argument("--latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    os.environ["ASGI_WORKERS"] = str(args.threads)
+    routes = install_fake_upstream(args.latency_ms / 1000)
+    paths = [
+        f"/stream/movie/tt{1000000 + i % args.distinct}.json" for i in range(args.requests)
+    ]
+
+    print(f"{args.requests} requests, {args.distinct} distinct ids, "
+          f"{args.latency_ms:.0f}ms fake upstream latency, {args.threads} threads")
+    print(f"{'':24} {'time':>8} {'req/s':>9} {'in flight':>10} {'searches':>9}")
+    for label, run in [
+        ("WSGI (threaded)", lambda peak: run_wsgi(paths, args.threads, peak)),
+        ("ASGI", lambda peak: run_asgi(paths, peak)),
+    ]:
+        routes.stream_cache.clear()
+        routes.gdrive.in_flight = Peak()
+        in_flight = Peak()
+        start = time.perf_counter()
+        run(in_flight)
+        elapsed = time.perf_counter() - start
+        print(f"{label:24} {elapsed:7.2f}s {args.requests / elapsed:9.1f} "
+              f"{in_flight.peak:10d} {routes.gdrive.in_flight.peak:9d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Generate the bundled metadata cassette, benchmarks/fixtures/meta.cassette.json.gz.
+
+The cassette holds the TMDB, Cinemeta, IMDb suggest and IMDb AKA page
+responses of a few hundred made-up titles (ids from tt9000001), shaped
+like the real ones, with latencies drawn per host. It's synthetic so it
+can be shipped and regenerated anywhere; a cassette of real traffic is
+recorded by running the addon with UPSTREAM_CASSETTE_MODE=record.
+
+    python -m benchmarks.make_meta_cassette [--titles 300] [--output FILE]
+"""
+
+import argparse
+import html
+import json
+import os
+import random
+
+import benchmarks._common  # noqa: F401 (sets a fake TOKEN before sgd is imported)
+from sgd.cassette import Cassette
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), "fixtures", "meta.cassette.json.gz")
+FIRST_ID = 9000001
+
+# The same made-up title in each language: (article, adjective, noun) words.
+WORDS = {
+    "en": (["The"], ["Silent", "Broken", "Hidden", "Last", "Golden", "Burning", "Frozen", "Lost"],
+           ["River", "Crown", "Harbor", "Promise", "Garden", "Signal", "Empire", "Station"]),
+    "pt": (["O"], ["Silencioso", "Partido", "Escondido", "Último", "Dourado", "Ardente", "Congelado", "Perdido"],
+           ["Rio", "Coroa", "Porto", "Juramento", "Jardim", "Sinal", "Império", "Estação"]),
+    "es": (["El"], ["Silencioso", "Roto", "Oculto", "Último", "Dorado", "Ardiente", "Helado", "Perdido"],
+           ["Río", "Corona", "Puerto", "Juramento", "Jardín", "Señal", "Imperio", "Estación"]),
+    "fr": (["Le"], ["Silencieux", "Brisé", "Caché", "Dernier", "Doré", "Brûlant", "Gelé", "Perdu"],
+           ["Fleuve", "Couronne", "Port", "Serment", "Jardin", "Signal", "Empire", "Gare"]),
+    "de": (["Der"], ["Stille", "Zerbrochene", "Verborgene", "Letzte", "Goldene", "Brennende", "Gefrorene", "Verlorene"],
+           ["Fluss", "Krone", "Hafen", "Schwur", "Garten", "Signal", "Imperium", "Bahnhof"]),
+}
+COUNTRIES = {"pt": ["Brazil", "Portugal"], "es": ["Spain", "Mexico", "Argentina"], "fr": ["France"], "de": ["Germany"]}
+SUFFIXES = ["", "", "", " II", " Returns", " of Night", " 1984"]
+# Median seconds of a request to each host (latencies are log-normal).
+LATENCY = {"tmdb": 0.12, "cinemeta": 0.15, "imdb_sg": 0.08, "imdb_html": 0.6}
+
+
+def title_in(lang, a, n, suffix):
+    article, adjectives, nouns = WORDS[lang]
+    words = [article[0], adjectives[a], nouns[n]] if lang == "en" else [article[0], nouns[n], adjectives[a]]
+    return " ".join(words) + suffix
+
+
+def latency(rng, host):
+    return round(LATENCY[host] * rng.lognormvariate(0, 0.5), 4)
+
+
+def imdb_releaseinfo(imdb_id, title, year, akas):
+    rows = "".join(
+        f"<tr><td>{html.escape(country)}</td><td>{html.escape(aka)}</td></tr>" for country, aka in akas
+    )
+    return (
+        "<!DOCTYPE html><html><head><title>Release info</title></head><body>"
+        '<div class="subpage_title_block__right-column">'
+        f'<h3 itemprop="name"><a href="/title/{imdb_id}/">{html.escape(title)}</a> '
+        f'<span class="nobr">({year})</span></h3></div>'
+        f'<table class="akas-table-test-only">{rows}</table></body></html>'
+    )
+
+
+def generate(cassette, titles, seed=0):
+    rng = random.Random(seed)
+    combos = [(a, n, s) for s in SUFFIXES for a in range(8) for n in range(8)]
+    rng.shuffle(combos)
+
+    for i, (a, n, suffix) in enumerate(combos[:titles]):
+        imdb_id = f"tt{FIRST_ID + i}"
+        stream_type = "series" if i % 3 == 2 else "movie"
+        name = title_in("en", a, n, suffix)
+        year = rng.randint(1970, 2024)
+        akas = [
+            (country, title_in(lang, a, n, suffix))
+            for lang, countries in COUNTRIES.items()
+            for country in rng.sample(countries, rng.randint(0, len(countries)))
+        ]
+        tmdb_id = 500000 + i
+        media_type = "movie" if stream_type == "movie" else "tv"
+
+        # TMDB: the find by IMDb id, then the pt-BR details.
+        if i % 10:
+            key = "title" if media_type == "movie" else "name"
+            date = "release_date" if media_type == "movie" else "first_air_date"
+            found = {"id": tmdb_id, key: name, f"original_{key}": name, date: f"{year}-0{rng.randint(1, 9)}-15"}
+            find = {f"{media_type}_results": [found]}
+            pt_title = next((aka for country, aka in akas if country == "Brazil"), name)
+            details = {"id": tmdb_id, key: pt_title}
+        else:
+            find, details = {f"{media_type}_results": []}, None
+        cassette.record(
+            f"api.themoviedb.org/3/find/{imdb_id}?api_key=x&external_source=imdb_id",
+            json.dumps(find), latency(rng, "tmdb"),
+        )
+        if details:
+            cassette.record(
+                f"api.themoviedb.org/3/{media_type}/{tmdb_id}?api_key=x&language=pt-BR",
+                json.dumps(details), latency(rng, "tmdb"),
+            )
+
+        # Cinemeta misses one title in seven; IMDb suggest has those.
+        if i % 7:
+            end = f"–{year + rng.randint(1, 6)}" if stream_type == "series" else ""
+            cinemeta = json.dumps({"meta": {"id": imdb_id, "type": stream_type, "name": name, "year": f"{year}{end}"}})
+        else:
+            cinemeta = json.dumps({})
+        cassette.record(f"v3-cinemeta.strem.io/meta/{stream_type}/{imdb_id}.json", cinemeta, latency(rng, "cinemeta"))
+        suggest = {"v": 1, "q": imdb_id, "d": [{"id": imdb_id, "l": name, "y": year, "q": "feature"}]}
+        cassette.record(
+            f"v2.sg.media-imdb.com/suggests/t/{imdb_id}.json",
+            f"imdb${imdb_id}({json.dumps(suggest)})", latency(rng, "imdb_sg"),
+        )
+        cassette.record(
+            f"imdb.com/title/{imdb_id}/releaseinfo?ref_=tt_dt_aka",
+            imdb_releaseinfo(imdb_id, name, year, akas), latency(rng, "imdb_html"),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--titles", type=int, default=300)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        os.remove(args.output)
+    cassette = Cassette(args.output, mode="record")
+    generate(cassette, args.titles)
+    cassette.save()
+    print(f"Wrote {len(cassette.entries)} responses for {args.titles} titles to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
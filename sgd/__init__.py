@@ -2,6 +2,7 @@ import os
 import json
 import logging
 from flask import Flask
+from sgd.drivepool import DrivePool
 from sgd.gdrive import GoogleDrive
 
 logging.basicConfig(
@@ -12,19 +13,41 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-token_from_env = os.environ.get("TOKEN")
-if not token_from_env:
-    raise RuntimeError(
-        "The TOKEN environment variable is not set. It must contain the "
-        "Google OAuth credentials JSON obtained during setup (see README.md)."
-    )
-try:
-    token = json.loads(token_from_env)
-except json.JSONDecodeError as e:
-    raise RuntimeError(
-        f"The TOKEN environment variable does not contain valid JSON: {e}"
-    ) from e
-
-gdrive = GoogleDrive(token)
+
+def load_tokens():
+    """The OAuth token(s) from TOKENS (a JSON array) or TOKEN (one object)."""
+    tokens_from_env = os.environ.get("TOKENS")
+    if tokens_from_env:
+        try:
+            tokens = json.loads(tokens_from_env)
+        except json.JSONDecodeError as e:
+            raise RuntimeError(
+                f"The TOKENS environment variable does not contain valid JSON: {e}"
+            ) from e
+        if not isinstance(tokens, list) or not tokens or not all(isinstance(t, dict) for t in tokens):
+            raise RuntimeError(
+                "The TOKENS environment variable must be a non-empty JSON array "
+                "of Google OAuth credentials objects (see README.md)."
+            )
+        return tokens
+
+    token_from_env = os.environ.get("TOKEN")
+    if not token_from_env:
+        raise RuntimeError(
+            "The TOKEN environment variable is not set. It must contain the "
+            "Google OAuth credentials JSON obtained during setup (see README.md)."
+        )
+    try:
+        return [json.loads(token_from_env)]
+    except json.JSONDecodeError as e:
+        raise RuntimeError(
+            f"The TOKEN environment variable does not contain valid JSON: {e}"
+        ) from e
+
+
+tokens = load_tokens()
+token = tokens[0]
+
+gdrive = DrivePool(GoogleDrive(t, account=i) for i, t in enumerate(tokens))
 
 from sgd import routes
@@ -0,0 +1,249 @@
+"""ASGI entry point, serving the same addon routes as the Flask app.
+
+Run it with any ASGI server, e.g. ``uvicorn sgd.asgi:app``.
+
+Under the WSGI app every in-flight stream request holds a worker for the
+whole search. Here a request waiting on a search is just a suspended
+coroutine: cache hits are answered on the event loop, identical in-flight
+searches share one future, and only the blocking pipeline (metadata, the
+Drive batch, scoring) runs on a bounded thread pool. Thousands of
+connections can wait in one process, but distinct searches are still
+capped at ASGI_WORKERS at a time, as they would be with a threaded WSGI
+server of that size.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from sgd import compression, httpcache, metrics, proxy, routes
+from sgd.meta import MetadataNotFound
+from sgd.popular import popular
+from sgd.singleflight import CALLS, COALESCED
+from sgd.streams import PlaybackUrls
+from sgd.utils import Deadline, normalize_stream_id
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("ASGI_WORKERS", 32)),
+    thread_name_prefix="sgd-asgi",
+)
+
+STREAM_PATH = re.compile(r"^/stream/([^/]+)/([^/]+)\.json$")
+LOAD_PATH = re.compile(r"^/load/([^/]+)/.+$")
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines: followers await the leader's future."""
+
+    def __init__(self, name):
+        self.name = name
+        self._futures = {}
+
+    async def do(self, key, fn, *args):
+        future = self._futures.get(key)
+        if future is not None:
+            COALESCED.inc(flight=self.name)
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = self._futures[key] = loop.run_in_executor(executor, fn, *args)
+        CALLS.inc(flight=self.name)
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._futures.pop(key, None)
+
+
+stream_flight = AsyncSingleFlight("asgi_streams")
+
+
+async def send_response(send, status, body=b"", content_type="text/plain; charset=utf-8", headers=None):
+    await send_start(send, status, content_type, headers)
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_start(send, status, content_type, headers=None):
+    all_headers = {**routes.COMMON_HEADERS, **(headers or {}), "Content-Type": content_type}
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode(), v.encode()) for k, v in all_headers.items()],
+    })
+
+
+def request_headers(scope):
+    return {k.decode().lower(): v.decode() for k, v in scope["headers"]}
+
+
+async def send_cacheable(send, scope, body, content_type, cache_control):
+    """A complete body, compressed if worth it, with an ETag (or a 304)."""
+    request = request_headers(scope)
+    encoding = compression.negotiate(request.get("accept-encoding"), len(body))
+    tag = httpcache.etag(body, encoding)
+    headers = {**compression.response_headers(encoding), "ETag": f'"{tag}"', "Cache-Control": cache_control}
+    if httpcache.not_modified(request.get("if-none-match"), tag):
+        return await send_response(send, 304, headers=headers, content_type=content_type)
+    await send_response(send, 200, compression.compress(body, encoding), content_type, headers)
+
+
+async def stream_response(send, scope, stream_type, stream_id):
+    loop = asyncio.get_running_loop()
+
+    cached = await loop.run_in_executor(executor, routes.cached_streams, stream_type, stream_id)
+    if cached is not None:
+        body, token_lifetime = cached
+        cache_control = httpcache.stream_cache_control(token_lifetime)
+        return await send_cacheable(send, scope, body, "application/json", cache_control)
+
+    # Send the head and the opening bytes straight away, like the WSGI
+    # route, so the client sees a live response while the search runs.
+    encoding = compression.negotiate(request_headers(scope).get("accept-encoding"))
+    compressor = compression.Compressor(encoding) if encoding else None
+
+    async def send_chunk(chunk, more_body=True, flush=False):
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+            if flush:
+                chunk += compressor.flush()
+            if not more_body:
+                chunk += compressor.finish()
+        if chunk or not more_body:
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    headers = {**compression.response_headers(encoding), "Cache-Control": httpcache.NO_STORE}
+    await send_start(send, 200, "application/json", headers)
+    await send_chunk(b'{"streams":', flush=True)
+
+    cache_key = (stream_type, normalize_stream_id(stream_id))
+    partial = False
+    metrics.cache_lookup("streams", False)
+
+    deadline = Deadline(routes.STREAM_TIME_BUDGET)
+    try:
+        candidates, partial = await stream_flight.do(
+            cache_key, routes.search_streams, stream_type, stream_id, deadline
+        )
+    except MetadataNotFound as e:
+        logger.info("%s", e)
+        candidates = ()
+
+    urls = await loop.run_in_executor(executor, PlaybackUrls, routes.gdrive, candidates)
+    for chunk in routes.stream_encoder.iter_encode(candidates, urls):
+        await send_chunk(chunk)
+
+    tail = b',"cacheMaxAge":0,"partial":true}' if partial else b"}"
+    await send_chunk(tail, more_body=False)
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def batch_response(send, receive):
+    try:
+        items = routes.parse_batch(json.loads(await read_body(receive)))
+    except ValueError:
+        items = None
+    if items is None:
+        return await send_response(send, 400, b"Bad Request")
+
+    loop = asyncio.get_running_loop()
+    await send_start(send, 200, "application/x-ndjson")
+    lines = [loop.run_in_executor(executor, routes.batch_line, *item) for item in items]
+    for line in asyncio.as_completed(lines):
+        await send({"type": "http.response.body", "body": await line, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def load_response(send, scope, file_id):
+    loop = asyncio.get_running_loop()
+    query = urllib.parse.parse_qs(scope.get("query_string", b"").decode())
+    headers = request_headers(scope)
+    try:
+        account = int(query.get("account", ["0"])[0])
+        acc_token = await loop.run_in_executor(executor, routes.gdrive.get_acc_token, account)
+    except (ValueError, IndexError):
+        return await send_response(send, 404, b"Not Found")
+
+    md5 = query.get("md5", [""])[0]
+    media = await loop.run_in_executor(
+        executor, proxy.fetch, file_id, acc_token, headers.get("range"),
+        md5 if proxy.VALID_MD5.match(md5) else None,
+    )
+    await send_start(send, media.status, media.headers.get("Content-Type", "application/octet-stream"), media.headers)
+    # Each read of the upstream body blocks, so it runs on the pool; a
+    # thread is only held while a chunk is being read, not for the whole
+    # download.
+    body = iter(media.body)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, body, None)
+            if chunk is None:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(body, "close"):
+            await loop.run_in_executor(executor, body.close)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    if path == "/streams/batch" and scope["method"] == "POST":
+        return await batch_response(send, receive)
+    if scope["method"] != "GET":
+        return await send_response(send, 405, b"Method Not Allowed")
+
+    if path == "/":
+        return await send_response(send, 200, "O addon está ativo.".encode())
+
+    if path in ("/favicon.png", "/favicon.ico"):
+        return await send_response(send, 302, headers={"Location": routes.MANIFEST["favicon"]})
+
+    if path == "/manifest.json":
+        body = json.dumps(routes.MANIFEST).encode()
+        return await send_cacheable(send, scope, body, "application/json", httpcache.MANIFEST_CACHE.header())
+
+    if path == "/metrics":
+        body = metrics.REGISTRY.render().encode()
+        return await send_response(send, 200, body, "text/plain; version=0.0.4")
+
+    match = LOAD_PATH.match(path)
+    if match and proxy.enabled() and proxy.VALID_FILE_ID.match(match.group(1)):
+        return await load_response(send, scope, match.group(1))
+
+    match = STREAM_PATH.match(path)
+    if match:
+        stream_type, stream_id = match.groups()
+        if stream_type in routes.MANIFEST["types"] and routes.is_valid_stream_id(stream_id):
+            popular.seen(stream_type, stream_id)
+            return await stream_response(send, scope, stream_type, stream_id)
+
+    await send_response(send, 404, b"Not Found")
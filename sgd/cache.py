@@ -1,6 +1,12 @@
 import json
 import logging
+import mmap
+import os
 import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
@@ -42,3 +48,155 @@ class Pickle(Cache):
 class Json(Cache):
     def __init__(self, filename):
         super().__init__(filename, json)
+
+
+class TTLCache:
+    """A thread-safe, in-memory LRU cache whose entries expire after `ttl` seconds.
+
+    Unlike the file-backed caches above this never touches disk, so it's
+    meant for hot, per-instance data that's cheap to lose on a cold start.
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= self.clock():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def purge(self, predicate):
+        """Drop every entry whose key matches `predicate`; returns how many."""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ChunkCache:
+    """A thread-safe on-disk LRU cache of fixed-size blocks of media files.
+
+    A file is keyed by ``(file id, md5)``, so a new revision of a file never
+    serves stale blocks, and block `index` holds bytes ``index * block_size``
+    onwards. Blocks are written atomically, read through mmap and evicted
+    least recently used first once they take more than `max_bytes`. The
+    size and content type of each file are kept in a small ``.json`` file
+    next to its blocks, so a warm directory is reused after a restart.
+    """
+
+    BLOCK_NAME = re.compile(r"^(.+)-([0-9a-f]{32})-(\d+)\.blk$")
+
+    def __init__(self, directory, max_bytes, block_size):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.bytes = 0
+        self._blocks = OrderedDict()
+        self._files = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key, index=None):
+        file_id, md5 = key
+        name = f"{file_id}-{md5}.json" if index is None else f"{file_id}-{md5}-{index}.blk"
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        for path in sorted(paths, key=os.path.getmtime):
+            name = os.path.basename(path)
+            match = self.BLOCK_NAME.match(name)
+            if match:
+                file_id, md5, index = match.groups()
+                self._blocks[((file_id, md5), int(index))] = os.path.getsize(path)
+                self.bytes += os.path.getsize(path)
+            elif name.endswith(".json"):
+                try:
+                    with open(path) as file_:
+                        info = json.load(file_)
+                    self._files[(info["id"], info["md5"])] = (info["size"], info["content_type"])
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning("Ignoring bad chunk cache entry %s: %s", path, e)
+        self._evict()
+
+    def file_info(self, key):
+        """``(size, content type)`` of a file seen before, or None."""
+        return self._files.get(key)
+
+    def set_file_info(self, key, size, content_type):
+        if self._files.get(key) == (size, content_type):
+            return
+        self._files[key] = (size, content_type)
+        file_id, md5 = key
+        info = {"id": file_id, "md5": md5, "size": size, "content_type": content_type}
+        self._write(self._path(key), json.dumps(info).encode())
+
+    def __contains__(self, block):
+        return block in self._blocks
+
+    def get(self, key, index):
+        """The block as a read-only mmap (close it when done), or None."""
+        with self._lock:
+            if (key, index) not in self._blocks:
+                return None
+            self._blocks.move_to_end((key, index))
+        try:
+            with open(self._path(key, index), "rb") as file_:
+                return mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Evicted meanwhile (or emptied): a miss.
+            return None
+
+    def put(self, key, index, data):
+        self._write(self._path(key, index), data)
+        with self._lock:
+            self.bytes += len(data) - self._blocks.get((key, index), 0)
+            self._blocks[(key, index)] = len(data)
+            self._blocks.move_to_end((key, index))
+            self._evict()
+
+    def _evict(self):
+        # Caller holds the lock (or is __init__).
+        while self.bytes > self.max_bytes and self._blocks:
+            (key, index), size = self._blocks.popitem(last=False)
+            self.bytes -= size
+            try:
+                # Readers that already mapped it keep their mapping.
+                os.remove(self._path(key, index))
+            except FileNotFoundError:
+                pass
+
+    def _write(self, path, data):
+        # Write then rename, so a reader never sees half a block.
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as file_:
+            file_.write(data)
+        os.replace(tmp, path)
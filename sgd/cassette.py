@@ -0,0 +1,120 @@
+"""Record and replay of the metadata requests made through req_wrapper.
+
+With UPSTREAM_CASSETTE set to a file, every TMDB, Cinemeta and IMDb
+response is kept there (UPSTREAM_CASSETTE_MODE=record) or served from it
+(the default, replay), so metadata resolution can be benchmarked and
+debugged repeatably and without a network. A cassette is one gzipped JSON
+document mapping each url (without its api_key) to the response body and
+how long it took; failed requests are recorded as an empty body, which is
+what req_wrapper returns for them.
+
+In replay, UPSTREAM_REPLAY_LATENCY adds latency: "recorded" sleeps as long
+as the recorded request took, a number sleeps that many seconds. Either
+way a response slower than the request's timeout is replayed as a timeout.
+A url missing from the cassette is answered like a failed request.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+API_KEY = re.compile(r"([?&])api_key=[^&]*&?")
+
+_active = None
+_active_lock = threading.Lock()
+
+
+class Cassette:
+    def __init__(self, path, mode="replay", latency=0):
+        if mode not in ("record", "replay"):
+            raise RuntimeError(f"UPSTREAM_CASSETTE_MODE must be record or replay, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        # "recorded", or a fixed number of seconds.
+        self.latency = latency
+        self.entries = {}
+        self.hits = self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file_:
+                self.entries = json.load(file_)["entries"]
+        except FileNotFoundError:
+            if mode == "replay":
+                logger.warning("Cassette %s doesn't exist: every request will fail", path)
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    @staticmethod
+    def key(url):
+        return API_KEY.sub(r"\1", url).rstrip("?&")
+
+    def record(self, url, body, elapsed):
+        with self._lock:
+            self.entries[self.key(url)] = {"body": body, "elapsed": round(elapsed, 4)}
+            self._dirty = True
+
+    def replay(self, url, time_out):
+        """The recorded body of `url`, or "" like a failed request."""
+        entry = self.entries.get(self.key(url))
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            logger.warning("No recorded response for %s", url)
+            return ""
+
+        delay = entry["elapsed"] if self.latency == "recorded" else float(self.latency)
+        if delay > time_out:
+            time.sleep(time_out)
+            logger.warning("Recorded request to %s took longer than its %ss timeout", url, time_out)
+            return ""
+        if delay:
+            time.sleep(delay)
+        return entry["body"]
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            document = json.dumps(
+                {"version": CASSETTE_VERSION, "entries": self.entries}, separators=(",", ":"), sort_keys=True,
+            )
+            tmp = f"{self.path}.tmp"
+            # No name or time in the gzip header: the same entries give the
+            # same bytes, so a re-recorded cassette only diffs if it changed.
+            with open(tmp, "wb") as raw, gzip.GzipFile("", "wb", fileobj=raw, mtime=0) as file_:
+                file_.write(document.encode())
+            os.replace(tmp, self.path)
+            self._dirty = False
+        logger.info("Saved %d recorded responses to %s", len(self.entries), self.path)
+
+
+def active():
+    """The cassette configured by UPSTREAM_CASSETTE, or None."""
+    global _active
+    path = os.environ.get("UPSTREAM_CASSETTE")
+    if not path:
+        return None
+    with _active_lock:
+        if _active is None or _active.path != path:
+            latency = os.environ.get("UPSTREAM_REPLAY_LATENCY", "0")
+            _active = Cassette(
+                path, os.environ.get("UPSTREAM_CASSETTE_MODE", "replay"),
+                latency if latency == "recorded" else float(latency),
+            )
+            if _active.mode == "record":
+                atexit.register(_active.save)
+        return _active
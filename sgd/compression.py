@@ -0,0 +1,101 @@
+"""Negotiated gzip / brotli compression of the manifest and stream responses.
+
+Stream responses repeat the same titles, release names, urls and
+behaviorHints across dozens of entries, so they shrink several times over.
+Brotli is offered if the ``brotli`` package is installed; gzip always is.
+
+A body known in full (the manifest, a cached stream list) is left as is
+under COMPRESS_MIN_BYTES, where the encoding would cost more than it
+saves. A streamed body (a stream search) is compressed whenever the client
+accepts it, since its size isn't known when the headers go out, and the
+opening chunk is flushed right away so the client still sees a live
+response while the search runs.
+"""
+
+import os
+import zlib
+
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION = os.environ.get("COMPRESSION", "1").lower() in ("1", "true", "yes")
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = 6
+# Brotli's higher qualities take several times longer for a few % less.
+BROTLI_QUALITY = 5
+
+
+def encodings():
+    """The encodings we can send, preferred first."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def negotiate(accept_encoding, size=None):
+    """The encoding to send a body of `size` bytes (None if unknown) with,
+    given the request's Accept-Encoding, or None to send it as is."""
+    if not COMPRESSION or not accept_encoding:
+        return None
+    if size is not None and size < COMPRESS_MIN_BYTES:
+        return None
+    return parse_accept_header(accept_encoding, Accept).best_match(encodings())
+
+
+class Compressor:
+    """Incremental compression of one response body."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """Compressed bytes of `data`, possibly none yet (they're buffered)."""
+        if self.encoding == "br":
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Everything buffered so far, decodable by the client as it is."""
+        if self.encoding == "br":
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(body, encoding):
+    """`body` compressed with `encoding` (as is if None)."""
+    if encoding is None:
+        return body
+    compressor = Compressor(encoding)
+    return compressor.compress(body) + compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    """Compress a streamed body, flushing its first chunk straight away."""
+    compressor = Compressor(encoding)
+    for i, chunk in enumerate(chunks):
+        data = compressor.compress(chunk)
+        if i == 0:
+            data += compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def response_headers(encoding):
+    """The headers of a response that was negotiated to `encoding`."""
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return headers
@@ -0,0 +1,108 @@
+"""Several Drive accounts behind the GoogleDrive search interface."""
+
+import contextvars
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sgd.gdrive import DriveSearch
+
+logger = logging.getLogger(__name__)
+
+# "fanout" searches every healthy account and merges the results (best
+# recall; each account may see different drives). "least_loaded" sends each
+# search to one account, spreading the quota instead (for accounts that
+# all see the same drives).
+POOL_MODES = ("fanout", "least_loaded")
+
+
+class DrivePool:
+    def __init__(self, accounts, mode=None):
+        self.accounts = list(accounts)
+        self.mode = mode or os.environ.get("DRIVE_POOL_MODE", "fanout")
+        if self.mode not in POOL_MODES:
+            raise RuntimeError(f"DRIVE_POOL_MODE must be one of {POOL_MODES}, not {self.mode!r}")
+
+        self._inflight = [0] * len(self.accounts)
+        self._lock = threading.Lock()
+        self._executor = None
+        if len(self.accounts) > 1 and self.mode == "fanout":
+            self._executor = ThreadPoolExecutor(
+                max_workers=4 * len(self.accounts), thread_name_prefix="sgd-drive"
+            )
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def healthy_accounts(self):
+        healthy = [gd for gd in self.accounts if gd.health.healthy]
+        # If every account is cooling down, trying one beats returning nothing.
+        return healthy or self.accounts
+
+    def least_loaded(self):
+        with self._lock:
+            gd = min(
+                self.healthy_accounts(),
+                key=lambda gd: (self._inflight[gd.account], -gd.limiter.tokens),
+            )
+            self._inflight[gd.account] += 1
+        return gd
+
+    def _search_one(self, gd, stream_meta, deadline):
+        try:
+            return gd.search(stream_meta, deadline)
+        except Exception as e:
+            logger.warning("Drive search with account %s failed: %s", gd.account, e)
+            gd.health.record(1, 1)
+            # Flagged partial so the empty result isn't cached.
+            return DriveSearch([], [], 0, True)
+
+    def search(self, stream_meta, deadline=None):
+        if self._executor is None:
+            gd = self.least_loaded()
+            try:
+                return self._search_one(gd, stream_meta, deadline)
+            finally:
+                with self._lock:
+                    self._inflight[gd.account] -= 1
+
+        # Each search runs in a copy of the caller's context, so settings
+        # like gdrive.shared_batches() carry over to the pool's threads.
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, self._search_one, gd, stream_meta, deadline)
+            for gd in self.healthy_accounts()
+        ]
+        return merge_searches([f.result() for f in futures])
+
+    def get_acc_token(self, account=0):
+        return self.accounts[account].get_acc_token()
+
+    def token_expires_in(self, account=0):
+        return self.accounts[account].token_expires_in()
+
+
+def merge_searches(searches):
+    """Merge per-account searches, keeping one copy of each file.
+
+    Copies are matched on md5Checksum (falling back to the file id), so a
+    file shared with several accounts is only listed once, with the first
+    account that found it.
+    """
+    seen = set()
+    results = []
+    for search in searches:
+        for item in search.results:
+            uid = item.md5 or item.id
+            if uid not in seen:
+                seen.add(uid)
+                results.append(item)
+    results.sort(key=lambda item: item.size, reverse=True)
+
+    query = list(dict.fromkeys(q for search in searches for q in search.query))
+    return DriveSearch(
+        query,
+        results,
+        sum(search.len_response for search in searches),
+        any(search.partial for search in searches),
+    )
@@ -0,0 +1,149 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+from json.encoder import c_encode_basestring, c_make_encoder
+from time import perf_counter
+
+from sgd import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def stream_object(candidate, urls):
+    """The Stremio stream object for a Candidate - and nothing else.
+
+    Internal bookkeeping (the PTN parse, sizes, drive ids) stays on the
+    Candidate; only fields from Stremio's stream schema are sent. The url
+    and proxy headers are stamped on from ``urls`` (a PlaybackUrls).
+    """
+    behavior_hints = dict(candidate.behavior_hints or {})
+    behavior_hints["proxyHeaders"] = urls.proxy_headers(candidate.file)
+    behavior_hints["filename"] = candidate.file.name
+    return {
+        "name": candidate.name,
+        "title": candidate.title,
+        "url": urls.stream_url(candidate.file),
+        "behaviorHints": behavior_hints,
+    }
+
+
+def _not_serializable(obj):
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# json.dumps() with non-default options builds a new encoder on every call,
+# which costs more than encoding one stream. Build the C encoder once
+# instead: compact separators, and raw UTF-8 rather than ensure_ascii so the
+# emoji in titles aren't sent as 12-byte surrogate escapes. Stream objects
+# are plain trees, so the circular-reference check (markers) is skipped.
+_c_encoder = c_make_encoder and c_make_encoder(
+    None, _not_serializable, c_encode_basestring, None, ":", ",", False, False, True
+)
+
+
+def dumps(obj):
+    """Compact UTF-8 JSON bytes, via orjson when it's installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    if _c_encoder is not None:
+        return "".join(_c_encoder(obj, 0)).encode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def dumps_each(objs):
+    """``[dumps(obj) for obj in objs]``, encoded in a single call.
+
+    Encoding a list at once is much cheaper than one call per object, so the
+    array is split back into its items at the top-level ``},{"`` boundaries.
+    A quote inside a string is always escaped, so that sequence can only
+    appear between two objects of the list - or inside an object holding a
+    list of objects, which stream objects don't; if the count doesn't add up
+    anyway, every object is encoded on its own.
+    """
+    if not objs:
+        return []
+    body = dumps(objs)
+    parts = body[3:-2].split(b'},{"')
+    if not body.startswith(b'[{"') or len(parts) != len(objs):
+        return [dumps(obj) for obj in objs]
+    return [b'{"' + part + b"}" for part in parts]
+
+
+class StreamEncoder:
+    """Encodes ranked Candidates into a Stremio "streams" JSON array.
+
+    The encoded bytes of each stream are cached by (file id, token epoch):
+    a stream's url and proxy headers only change when the access token
+    does, so repeat requests for the same title skip JSON encoding.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, candidate, urls):
+        return self._encode([candidate], urls)[0][0]
+
+    def _encode(self, candidates, urls):
+        """Returns ``(encoded, misses)``: the bytes of every stream, in order.
+
+        The cache is read and updated under one lock acquisition each, and
+        every miss is encoded in a single ``dumps`` call.
+        """
+        keys = [(c.file.id, urls.epoch(c.file)) for c in candidates]
+        encoded = []
+        missing = []
+        with self._lock:
+            for i, (key, candidate) in enumerate(zip(keys, candidates)):
+                cached = self._cache.get(key)
+                # The display title comes from the request's metadata, so
+                # double check it before trusting a cached entry.
+                if cached and cached[0] == candidate.title:
+                    self._cache.move_to_end(key)
+                    encoded.append(cached[1])
+                else:
+                    encoded.append(None)
+                    missing.append(i)
+            self.hits += len(candidates) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            fresh = dumps_each([stream_object(candidates[i], urls) for i in missing])
+            with self._lock:
+                for i, item in zip(missing, fresh):
+                    encoded[i] = item
+                    self._cache[keys[i]] = (candidates[i].title, item)
+                    self._cache.move_to_end(keys[i])
+                while len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return encoded, len(missing)
+
+    def iter_encode(self, candidates, urls):
+        """Yield the JSON array one stream at a time instead of building it whole."""
+        candidates = list(candidates)
+        # Only the encoding is timed, not the time the consumer takes to
+        # send each chunk; metrics are published once per response.
+        start = perf_counter()
+        encoded, misses = self._encode(candidates, urls)
+        metrics.STAGE_SECONDS.observe(perf_counter() - start, stage="serialize")
+        metrics.CACHE_REQUESTS.inc(len(candidates) - misses, cache="encoder", result="hit")
+        metrics.CACHE_REQUESTS.inc(misses, cache="encoder", result="miss")
+
+        sep = b"["
+        for item in encoded:
+            yield sep + item
+            sep = b","
+        yield b"[]" if sep == b"[" else b"]"
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -1,23 +1,430 @@
+import contextlib
+import contextvars
+import json
 import logging
+import os
+import random
+import re
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from sgd.cache import Pickle, Json
-from sgd.utils import STOP_WORDS
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
+from functools import cached_property
+from typing import NamedTuple, Optional
+from sgd import metrics
+from sgd.cache import Pickle, Json, TTLCache
+from sgd.ptn import parse_title
+from sgd.ratelimit import TokenBucket
+from sgd.singleflight import SingleFlight
+from sgd import querystats, rerank
+from sgd.utils import query_words
 
 logger = logging.getLogger(__name__)
 
+FILE_FIELDS = "id, name, size, driveId, md5Checksum, parents"
+
+# Where the Drive API, media downloads and the OAuth token endpoint are
+# reached. Overridden to point the addon at a stand-in server, e.g.
+# benchmarks/fake_drive.py, for load and latency tests.
+DEFAULT_API_URL = "https://www.googleapis.com"
+DRIVE_API_URL = os.environ.get("DRIVE_API_URL", DEFAULT_API_URL).rstrip("/")
+
+# A time-budgeted search only starts another stage (one Drive batch round
+# trip) if at least this much of the request budget is left.
+MIN_STAGE_SECONDS = 1.0
+# AKA-title queries are sent in batches of this many, so a budget can stop
+# the search between batches.
+AKA_STAGE_SIZE = 25
+# With STAGED_MIN_STREAMS set, a search runs in tiers, one batch each: the
+# id query, then the primary title (with the year, for movies), then the
+# rest of the titles. It stops after a tier once the files found so far hold
+# that many valid streams.
+STAGED_MIN_STREAMS = int(os.environ.get("STAGED_MIN_STREAMS", 0))
+# "strict" sends one query per title, with every word of it. "broad" sends
+# a few queries on the rarest word of each title and matches the files
+# found against the titles locally (see sgd/rerank.py).
+QUERY_MODE = os.environ.get("QUERY_MODE", "strict")
+# Socket timeout of Drive requests: what's left of the request budget,
+# within these bounds (the max also applies to requests without a budget).
+MIN_DRIVE_TIMEOUT = 0.5
+MAX_DRIVE_TIMEOUT = 30
+
+# Every sub-request of a batch counts against the Drive quota, so they're
+# all rate limited. Throttled (403 rate limit / 429) and 5xx sub-requests
+# are retried up to DRIVE_MAX_RETRIES times, with exponential backoff
+# starting at RETRY_BASE_DELAY seconds plus jitter.
+DRIVE_RATE_LIMIT = float(os.environ.get("DRIVE_RATE_LIMIT", 50))
+DRIVE_RATE_BURST = float(os.environ.get("DRIVE_RATE_BURST", 100))
+DRIVE_MAX_RETRIES = int(os.environ.get("DRIVE_MAX_RETRIES", 3))
+RETRY_BASE_DELAY = 0.5
+# Drive takes at most 100 sub-requests per batch.
+MAX_BATCH_SIZE = 100
+# Within `shared_batches()` (the batch stream route), a search's files.list
+# requests wait this long for those of concurrent searches, to go out in the
+# same batches.
+BATCH_LINGER = 0.02
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+# An account whose batches fail this many times in a row is benched for a
+# cool-down that doubles with every further failure, up to the max.
+FAILURES_BEFORE_COOLDOWN = 3
+COOLDOWN_SECONDS = 15
+MAX_COOLDOWN_SECONDS = 300
+
+# With SERIES_SEARCH=season, an episode request searches Drive for its
+# whole season (one query per title) and indexes the files by episode, so
+# the following episodes of a season are answered from memory. An index
+# older than SEASON_CACHE_FRESH seconds is still served but refreshed in
+# the background; after SEASON_CACHE_TTL it's dropped.
+SERIES_SEARCH = os.environ.get("SERIES_SEARCH", "episode")
+SEASON_CACHE_FRESH = int(os.environ.get("SEASON_CACHE_FRESH", 900))
+SEASON_CACHE_TTL = int(os.environ.get("SEASON_CACHE_TTL", 6 * 3600))
+SEASON_CACHE_SIZE = int(os.environ.get("SEASON_CACHE_SIZE", 500))
+# With FOLDER_SEARCH on, the folders a show's episodes were found in are
+# remembered (for FOLDER_CACHE_TTL seconds, up to FOLDER_LIMIT per show),
+# and its next episodes are first looked for by listing them.
+FOLDER_SEARCH = os.environ.get("FOLDER_SEARCH", "").lower() in ("1", "true", "yes")
+FOLDER_CACHE_TTL = int(os.environ.get("FOLDER_CACHE_TTL", 24 * 3600))
+FOLDER_CACHE_SIZE = int(os.environ.get("FOLDER_CACHE_SIZE", 2000))
+FOLDER_LIMIT = 10
+EPISODE_TAG = re.compile(r"s(\d+)\s*e(\d+)", re.IGNORECASE)
+
+RETRIES = metrics.counter(
+    "sgd_drive_retries_total", "Drive sub-requests retried after a throttled or 5xx response.", ["stage"]
+)
+ACCOUNT_REQUESTS = metrics.counter(
+    "sgd_drive_account_requests_total", "Drive sub-requests sent per account (quota usage).", ["account"]
+)
+ACCOUNT_FAILURES = metrics.counter(
+    "sgd_drive_account_failures_total", "Failed or throttled Drive sub-requests per account.", ["account"]
+)
+FOLDER_LISTINGS = metrics.counter(
+    "sgd_drive_folder_listings_total",
+    "Episode lookups in a show's known folders, by outcome (found, empty, too_broad).",
+    ["result"],
+)
+SEARCH_TIERS = metrics.counter(
+    "sgd_drive_search_tiers_total",
+    "Staged search tiers run, by whether they found enough streams to stop (short_circuit) or not (continued).",
+    ["tier", "result"],
+)
+ACCOUNT_HEALTHY = metrics.gauge(
+    "sgd_drive_account_healthy", "1 if the account is taking searches, 0 while it cools down.", ["account"]
+)
+
+
+_shared_batches = contextvars.ContextVar("sgd_shared_batches", default=False)
+
+
+@contextlib.contextmanager
+def shared_batches():
+    """Send the file searches made in this block in batches shared with
+    those of other threads in such a block (see SharedBatches)."""
+    token = _shared_batches.set(True)
+    try:
+        yield
+    finally:
+        _shared_batches.reset(token)
+
+
+def http_error_status(exception):
+    """``(status, reasons)`` of a googleapiclient HttpError, or ``(None, set())``."""
+    resp = getattr(exception, "resp", None)
+    status = getattr(resp, "status", None)
+    reasons = set()
+    try:
+        content = exception.content
+        if isinstance(content, bytes):
+            content = content.decode()
+        for error in json.loads(content)["error"].get("errors", []):
+            reasons.add(error.get("reason"))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        pass
+    return (int(status) if status else None), reasons
+
+
+def is_throttled(exception):
+    status, reasons = http_error_status(exception)
+    return status == 429 or (status == 403 and bool(reasons & RATE_LIMIT_REASONS))
+
+
+def is_retriable(exception):
+    status, _ = http_error_status(exception)
+    return is_throttled(exception) or (status is not None and status >= 500)
+
+
+class DriveFile(NamedTuple):
+    """A video file returned by a Drive files.list query.
+
+    Only the fields requested in FILE_FIELDS are kept, so a large response
+    doesn't keep every API dict (and its key strings) alive.
+    """
+
+    id: str = ""
+    name: str = ""
+    size: int = 0
+    drive_id: Optional[str] = None
+    md5: Optional[str] = None
+    # Index of the account (TOKENS entry) the file was found with; its
+    # token is the one that can play it.
+    account: int = 0
+    # The folder holding the file (Drive gives every file a single parent).
+    parent: Optional[str] = None
+
+    @classmethod
+    def from_api(cls, item, account=0):
+        return cls(
+            item.get("id", ""),
+            item.get("name", ""),
+            int(item.get("size") or 0),
+            item.get("driveId"),
+            item.get("md5Checksum"),
+            account,
+            (item.get("parents") or [None])[0],
+        )
+
+
+class DriveSearch(NamedTuple):
+    """The outcome of one GoogleDrive.search call."""
+
+    query: list
+    results: list
+    len_response: int = 0
+    # True when the time budget ran out before every stage could run.
+    partial: bool = False
+
+
+class SeasonIndex(NamedTuple):
+    """The files of one season search, by ``(season, episode)``."""
+
+    query: list
+    episodes: dict
+    len_response: int
+    partial: bool
+    fetched_at: float
+
+
+def episode_keys(name):
+    """Every ``(season, episode)`` a file name is for (several for "S01E01-E02")."""
+    parsed = parse_title(name)
+    seasons, episodes = parsed.season, parsed.episode
+    if seasons is None or episodes is None:
+        match = EPISODE_TAG.search(name)
+        if not match:
+            return []
+        seasons, episodes = match.groups()
+    seasons = seasons if isinstance(seasons, list) else [seasons]
+    episodes = episodes if isinstance(episodes, list) else [episodes]
+    try:
+        return [(int(se), int(ep)) for se in seasons for ep in episodes]
+    except (TypeError, ValueError):
+        return []
+
+
+def index_episodes(files):
+    """Group `files` by the ``(season, episode)`` keys of their names."""
+    episodes = {}
+    for item in files:
+        for key in episode_keys(item.name):
+            episodes.setdefault(key, []).append(item)
+    return episodes
+
+
+class SharedBatches:
+    """Packs the files.list requests of concurrent searches into shared batches.
+
+    The first search to submit waits BATCH_LINGER for others, then sends
+    everything pending (MAX_BATCH_SIZE sub-requests per batch) and keeps
+    going until nothing is left; the others wait for their answers.
+    """
+
+    def __init__(self, gd, linger=None):
+        self.gd = gd
+        self.linger = BATCH_LINGER if linger is None else linger
+        self._pending = []
+        self._flushing = False
+        self._lock = threading.Lock()
+
+    def execute(self, requests_, callback, deadline=None):
+        """Like `GoogleDrive.execute_batch` for the "drive_batch" stage."""
+        entry = [requests_, callback, threading.Event(), False]
+        with self._lock:
+            self._pending.append(entry)
+            lead = not self._flushing
+            self._flushing = True
+        if lead:
+            time.sleep(self.linger)
+            self._flush(deadline)
+        entry[2].wait()
+        return entry[3]
+
+    def _flush(self, deadline):
+        while True:
+            with self._lock:
+                entries, self._pending = self._pending, []
+                if not entries:
+                    self._flushing = False
+                    return
+
+            merged = {}
+            for n, (requests_, _, _, _) in enumerate(entries):
+                merged.update((f"{n}-{request_id}", make) for request_id, make in requests_.items())
+
+            def callb(request_id, response):
+                n, _, own_id = request_id.partition("-")
+                entries[int(n)][1](own_id, response)
+
+            partial = True
+            try:
+                partial = self.gd.execute_batch(merged, callb, "drive_batch", deadline)
+            finally:
+                for entry in entries:
+                    entry[3] = partial
+                    entry[2].set()
+
+
+class AccountHealth:
+    """Quota usage and recent failures of one Drive account."""
+
+    def __init__(self, account, clock=time.monotonic):
+        self.account = str(account)
+        self.clock = clock
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        ACCOUNT_HEALTHY.set(1, account=self.account)
+
+    @property
+    def healthy(self):
+        return self.clock() >= self.cooldown_until
+
+    def record(self, sent, failed, throttled=False):
+        """Record one batch round trip of `sent` sub-requests."""
+        self.requests += sent
+        self.failures += failed
+        ACCOUNT_REQUESTS.inc(sent, account=self.account)
+        ACCOUNT_FAILURES.inc(failed, account=self.account)
+
+        if not throttled and failed < sent:
+            self.consecutive_failures = 0
+            ACCOUNT_HEALTHY.set(1, account=self.account)
+            return
+
+        self.consecutive_failures += 1
+        benched = self.consecutive_failures - FAILURES_BEFORE_COOLDOWN
+        if benched >= 0:
+            cooldown = min(MAX_COOLDOWN_SECONDS, COOLDOWN_SECONDS * 2 ** benched)
+            self.cooldown_until = self.clock() + cooldown
+            ACCOUNT_HEALTHY.set(0, account=self.account)
+            logger.warning("Drive account %s benched for %ds after repeated failures", self.account, cooldown)
+
 
 class GoogleDrive:
-    def __init__(self, token):
+    # Identical files.list queries issued by concurrent requests (e.g. two
+    # users opening the same episode) share a single Drive call.
+    query_flight = SingleFlight("drive_query")
+    # Season indexes by (account, title id, season), see SERIES_SEARCH.
+    season_flight = SingleFlight("drive_season")
+    season_cache = TTLCache(SEASON_CACHE_SIZE, SEASON_CACHE_TTL)
+    _season_refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sgd-season")
+    _refreshing = set()
+    _refreshing_lock = threading.Lock()
+    # Folder ids by (account, title id), see FOLDER_SEARCH.
+    folder_cache = TTLCache(FOLDER_CACHE_SIZE, FOLDER_CACHE_TTL)
+
+    def __init__(self, token, account=0, api_url=None):
         self.token = token
+        self.account = account
+        self.api_url = (api_url or DRIVE_API_URL).rstrip("/")
         self.page_size = 1000
-        self.acc_token = Pickle("acctoken.pickle")
-        self.drive_names = Json("drivenames.json")
-
-        creds = Credentials.from_authorized_user_info(self.token)
-        self.drive_instance = build("drive", "v3", credentials=creds)
+        # The first account keeps the original file names.
+        suffix = f"-{account}" if account else ""
+        self.acc_token = Pickle(f"acctoken{suffix}.pickle")
+        self.drive_names = Json(f"drivenames{suffix}.json")
+        # Drive quotas are per account, and so are the limiter and health.
+        self.limiter = TokenBucket(f"drive{suffix}", DRIVE_RATE_LIMIT, DRIVE_RATE_BURST)
+        self.health = AccountHealth(account)
+        # httplib2.Http (under every googleapiclient service) isn't thread
+        # safe, and searches run on many threads: each one gets its own.
+        self._local = threading.local()
+        self._shared_service = None
+        self.shared_batches = SharedBatches(self)
+
+    @cached_property
+    def credentials(self):
+        from google.oauth2.credentials import Credentials
+
+        credentials = Credentials.from_authorized_user_info(self.token)
+        if self.api_url != DEFAULT_API_URL:
+            # A stand-in Drive hands out the access tokens too.
+            credentials = credentials.with_token_uri(f"{self.api_url}/token")
+        return credentials
+
+    @property
+    def drive_instance(self):
+        """This thread's Drive service, built on its first Drive call."""
+        if self._shared_service is not None:
+            return self._shared_service
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self.build_service()
+        return service
+
+    @drive_instance.setter
+    def drive_instance(self, service):
+        # A service set explicitly (e.g. a fake) is used by every thread.
+        self._shared_service = service
+
+    def build_service(self):
+        # googleapiclient and google-auth are a large share of the import
+        # time, and the manifest route never needs them: only load them, and
+        # build the service, when the first Drive call is made. The Drive v3
+        # discovery document bundled with googleapiclient is used, so this
+        # doesn't fetch it over the network either (and takes ~1ms per thread).
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build
+
+        self._local.http = httplib2.Http(timeout=MAX_DRIVE_TIMEOUT)
+        http = AuthorizedHttp(self.credentials, http=self._local.http)
+        if self.api_url != DEFAULT_API_URL:
+            return self.build_service_at(http)
+        return build("drive", "v3", http=http, static_discovery=True, cache_discovery=False)
+
+    def build_service_at(self, http):
+        """The Drive service with every url (batches included) under `api_url`.
+
+        ``client_options.api_endpoint`` would only move the API calls, not
+        the batch endpoint, so the bundled discovery document is edited.
+        """
+        from googleapiclient.discovery import build_from_document
+        from googleapiclient.discovery_cache import get_static_doc
+
+        document = json.loads(get_static_doc("drive", "v3"))
+        document["rootUrl"] = document["mtlsRootUrl"] = f"{self.api_url}/"
+        document["baseUrl"] = f"{self.api_url}/{document['servicePath']}"
+        return build_from_document(document, http=http)
+
+    def set_timeout(self, deadline):
+        """Cap this thread's Drive socket timeout at what's left of `deadline`.
+
+        The budget is otherwise only checked between stages, and a stalled
+        batch would hold the request well past it.
+        """
+        http = getattr(self._local, "http", None)
+        if http is None:
+            return
+        timeout = MAX_DRIVE_TIMEOUT
+        if deadline is not None:
+            timeout = max(MIN_DRIVE_TIMEOUT, min(timeout, deadline.remaining()))
+        # New connections take the Http's timeout, open ones their socket's.
+        http.timeout = timeout
+        for conn in http.connections.values():
+            conn.timeout = timeout
+            if getattr(conn, "sock", None) is not None:
+                conn.sock.settimeout(timeout)
 
     @staticmethod
     def qgen(string, chain="and", splitter=" ", method=None):
@@ -25,32 +432,7 @@ class GoogleDrive:
         # FIX: Forçamos buscar sempre no nome para evitar vazamento de pastas de outras temporadas
         get_method = lambda _: method if method else "name"
 
-        cleaned_string = string.replace(".", " ").replace("'", " ").replace(":", " ").replace("-", " ")
-        cleaned_string = " ".join(cleaned_string.split())
-
-        raw_words = [w for w in cleaned_string.split(splitter) if w]
-        # For very short titles, a single-letter word (e.g. the "D" in
-        # "Dia D") is often essential, not noise - dropping it turns a
-        # distinctive title into a much more common word and makes the
-        # Drive query match far too many unrelated files. Only drop
-        # 1-letter words when there's enough other content to stay
-        # specific.
-        if len(raw_words) <= 2:
-            all_words = raw_words
-        else:
-            all_words = [w for w in raw_words if len(w) > 1 or w.isdigit()]
-
-        strong_words = [w for w in all_words if w.lower() not in STOP_WORDS]
-
-        if len(strong_words) <= 1:
-            final_words = all_words 
-        else:
-            final_words = strong_words 
-
-        if not final_words:
-            final_words = all_words
-
-        for word in final_words:
+        for word in query_words(string, splitter):
             if out:
                 out += f" {chain} "
             out += f"{get_method(word)} contains '{word}'"
@@ -58,38 +440,68 @@ class GoogleDrive:
         return out
 
     def get_query(self, sm):
-        out = []
-
         logger.debug("Titles received: %s", sm.titles)
+        # With QUERY_PRUNING, titles from sources that never find anything
+        # are left out (the primary title never is), see sgd/querystats.py.
+        sources = getattr(sm, "title_sources", {})
+        titles = [
+            t for i, t in enumerate(sm.titles)
+            if i == 0 or querystats.stats.keep("source", sources.get(t))
+        ]
 
         if sm.stream_type == "series":
-            # Mudado o método para 'name' para garantir que procure as tags S01E01 no arquivo de vídeo
-            seep_q = self.qgen(
-                f"S{sm.se}E{sm.ep}, "
-                f"s{sm.se} e{sm.ep}, "
-                f"s{int(sm.se)} e{int(sm.ep)}, "
-                f"season {int(sm.se)} episode {int(sm.ep)}, "
-                f'"{int(sm.se)} x {int(sm.ep)}", '
-                f'"{int(sm.se)} x {sm.ep}"',
-                chain="or",
-                splitter=", ",
-                method="name",
-            )
-            for title in sm.titles:
-                query_part = self.qgen(title)
-                if not query_part: continue
+            return self.title_queries(titles, self.episode_query(sm))
+        return self.title_queries(titles)
+
+    def episode_query(self, sm):
+        """The spellings of episode `sm.se`x`sm.ep`, ORed."""
+        templates = [
+            t for t in querystats.EPISODE_MARKERS if querystats.stats.keep("clause", t)
+        ] or querystats.EPISODE_MARKERS
+        # Mudado o método para 'name' para garantir que procure as tags S01E01 no arquivo de vídeo
+        return self.qgen(
+            ", ".join(querystats.episode_marker(t, sm.se, sm.ep) for t in templates),
+            chain="or",
+            splitter=", ",
+            method="name",
+        )
 
-                if len(title.split()) == 1:
-                    clean_t = title.replace("'", " ")
-                    out.append(f"name contains '{clean_t}' and ({seep_q})")
-                else:
-                    out.append(f"{query_part} and ({seep_q})")
-        else:
-            for title in sm.titles:
-                q = self.qgen(title)
-                if q:
-                    out.append(q)
-        
+    def broad_queries(self, sm):
+        """A few queries, on the rarest word of each title (QUERY_MODE=broad)."""
+        tokens = rerank.rare_tokens(sm.titles)
+        markers = self.episode_query(sm) if sm.stream_type == "series" else None
+        out = []
+        for i in range(0, len(tokens), rerank.BROAD_QUERY_TOKENS):
+            q = " or ".join(f"name contains '{t}'" for t in tokens[i : i + rerank.BROAD_QUERY_TOKENS])
+            out.append(f"({q}) and ({markers})" if markers else q)
+        return out
+
+    def get_season_query(self, sm):
+        """Queries for every episode of season `sm.se`, one per title."""
+        se = int(sm.se)
+        # Drive matches the start of words, so "S01" also finds "S01E02".
+        season_q = self.qgen(
+            f"S{se:02d}, s{se}, season {se}, {se}x, T{se:02d}",
+            chain="or",
+            splitter=", ",
+            method="name",
+        )
+        return self.title_queries(sm.titles, season_q)
+
+    def title_queries(self, titles, markers=None):
+        """A query per title, ANDed with the `markers` query if given."""
+        out = []
+        for title in titles:
+            query_part = self.qgen(title)
+            if not query_part: continue
+
+            if markers is None:
+                out.append(query_part)
+            elif len(title.split()) == 1:
+                clean_t = title.replace("'", " ")
+                out.append(f"name contains '{clean_t}' and ({markers})")
+            else:
+                out.append(f"{query_part} and ({markers})")
         return out
 
     def get_id_query(self, sm):
@@ -116,60 +528,175 @@ class GoogleDrive:
 
         return f"name contains '{imdb_id}'"
 
-    def file_list(self, file_fields):
-        def callb(request_id, response, exception):
-            if response:
-                output.extend(response.get("files", []))
-            if exception:
-                logger.warning("Google Drive query failed: %s", exception)
-
-        output = []
-        if self.query:
-            files = self.drive_instance.files()
+    def execute_batch(self, requests_, callback, stage, deadline=None):
+        """Run `requests_` ({request_id: factory}) as rate-limited batches.
+
+        `callback(request_id, response)` gets every successful response.
+        Throttled and 5xx sub-requests are retried with exponential backoff
+        and jitter (while the deadline allows), and the limiter slows down
+        when Drive throttles us. Other failures are logged and dropped.
+        `stage` labels the timings, errors and retries in the metrics.
+
+        Returns True if some requests went unanswered for a reason that may
+        not last (a timeout, a network error, retries given up, or a rate
+        limit wait that wouldn't fit the deadline), so the results shouldn't
+        be cached as complete.
+        """
+        if len(requests_) > MAX_BATCH_SIZE:
+            items = list(requests_.items())
+            partial = False
+            for i in range(0, len(items), MAX_BATCH_SIZE):
+                chunk = dict(items[i : i + MAX_BATCH_SIZE])
+                partial = self.execute_batch(chunk, callback, stage, deadline) or partial
+            return partial
+
+        pending = dict(requests_)
+        attempt = 0
+
+        while pending:
+            retry = {}
+            throttled = False
+            failed = 0
+
+            def callb(request_id, response, exception):
+                nonlocal throttled, failed
+                if exception is None:
+                    callback(request_id, response)
+                elif is_retriable(exception):
+                    throttled = throttled or is_throttled(exception)
+                    retry[request_id] = pending[request_id]
+                else:
+                    logger.warning("Google Drive request (%s) failed: %s", stage, exception)
+                    metrics.UPSTREAM_ERRORS.inc(upstream=stage)
+                    failed += 1
+
+            # Don't sleep off a slowed-down limiter past the request budget.
+            max_wait = None
+            if deadline and deadline.timeout() is not None:
+                max_wait = deadline.remaining() - MIN_STAGE_SECONDS
+            with metrics.timed("drive_rate_wait"):
+                waited = self.limiter.acquire(len(pending), max_wait)
+            if waited is None:
+                logger.warning("Skipping %d Drive request(s) (%s): rate limited past the budget", len(pending), stage)
+                return True
+            self.set_timeout(deadline)
             batch = self.drive_instance.new_batch_http_request()
-
-            for q in self.query:
-                logger.debug("Drive query: %s", q)
-
-                batch_inst = files.list(
-                    q=f"({q}) and trashed=false and mimeType contains 'video/'",
-                    fields=f"files({file_fields})",
-                    pageSize=self.page_size,
-                    supportsAllDrives=True,
-                    includeItemsFromAllDrives=True,
-                    corpora="allDrives",
-                )
-                batch.add(batch_inst, callback=callb)
+            for request_id, make_request in pending.items():
+                batch.add(make_request(), callback=callb, request_id=request_id)
             try:
-                batch.execute()
+                with metrics.timed(stage):
+                    batch.execute()
             except Exception as e:
-                logger.warning("Google Drive batch request failed: %s", e)
+                if not is_retriable(e):
+                    logger.warning("Google Drive batch request (%s) failed: %s", stage, e)
+                    metrics.UPSTREAM_ERRORS.inc(upstream=stage)
+                    self.health.record(len(pending), len(pending))
+                    return True
+                throttled = throttled or is_throttled(e)
+                retry = dict(pending)
+
+            self.health.record(len(pending), failed + len(retry), throttled)
+            if throttled:
+                self.limiter.throttled()
+            else:
+                self.limiter.succeeded()
+            if not retry:
+                return False
+
+            attempt += 1
+            delay = RETRY_BASE_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            if attempt > DRIVE_MAX_RETRIES or (deadline and not deadline.allows(delay + MIN_STAGE_SECONDS)):
+                logger.warning("Giving up on %d throttled Drive request(s) (%s)", len(retry), stage)
+                metrics.UPSTREAM_ERRORS.inc(len(retry), upstream=stage)
+                return True
+            RETRIES.inc(len(retry), stage=stage)
+            time.sleep(delay)
+            pending = retry
+        return False
+
+    def file_list(self, file_fields, queries, deadline=None):
+        """Returns ``(files, partial)``.
+
+        A query another request already has in flight is waited on, for at
+        most what's left of `deadline`; `partial` is True if one wasn't
+        answered in time, or the batch was cut short (see `execute_batch`).
+        """
+        results = {}
+
+        def callb(request_id, response):
+            results[request_id] = [
+                DriveFile.from_api(item, self.account) for item in response.get("files", [])
+            ]
+
+        calls = []
+        leading = []
+        partial = False
+        for q in dict.fromkeys(queries):
+            call, is_leader = self.query_flight.acquire((self.account, q, file_fields))
+            calls.append(call)
+            if is_leader:
+                leading.append((q, call))
 
-            return output
-        return output
+        try:
+            if leading:
+                files = self.drive_instance.files()
+
+                def list_request(q):
+                    logger.debug("Drive query: %s", q)
+                    return lambda: files.list(
+                        q=f"({q}) and trashed=false and mimeType contains 'video/'",
+                        fields=f"files({file_fields})",
+                        pageSize=self.page_size,
+                        supportsAllDrives=True,
+                        includeItemsFromAllDrives=True,
+                        corpora="allDrives",
+                    )
+
+                requests_ = {str(i): list_request(q) for i, (q, _) in enumerate(leading)}
+                if _shared_batches.get():
+                    partial = self.shared_batches.execute(requests_, callb, deadline)
+                else:
+                    partial = self.execute_batch(requests_, callb, "drive_batch", deadline)
+                metrics.STAGE_RESULTS.inc(
+                    sum(map(len, results.values())), stage="drive_batch"
+                )
+        finally:
+            # Always hand our results (possibly empty) to anyone waiting on
+            # the queries we led, even if building the batch blew up.
+            for i, (q, call) in enumerate(leading):
+                self.query_flight.release((self.account, q, file_fields), call, results.get(str(i), []))
+
+        output = []
+        for call in calls:
+            try:
+                output.extend(call.wait(deadline.timeout() if deadline else None))
+            except TimeoutError:
+                logger.warning("Gave up waiting on an in-flight Drive query from another request")
+                partial = True
+        return output, partial
 
-    def get_drive_names(self):
-        def callb(request_id, response, exception):
-            if response:
-                self.drive_names.contents[response.get("id")] = response.get("name")
+    def get_drive_names(self, results, deadline=None):
+        def callb(request_id, response):
+            self.drive_names.contents[response.get("id")] = response.get("name")
 
-        batch = self.drive_instance.new_batch_http_request()
         drives = self.drive_instance.drives()
         
-        drive_ids = set(item.get("driveId") for item in self.results if item.get("driveId"))
+        drive_ids = set(item.drive_id for item in results if item.drive_id)
         
         if not drive_ids: return {}
 
+        requests_ = {}
         for drive_id in drive_ids:
             if not self.drive_names.contents.get(drive_id):
                 self.drive_names.contents[drive_id] = None
-                batch_inst = drives.get(driveId=drive_id, fields="name, id")
-                batch.add(batch_inst, callback=callb)
+                requests_[drive_id] = (
+                    lambda drive_id=drive_id: drives.get(driveId=drive_id, fields="name, id")
+                )
+        metrics.CACHE_REQUESTS.inc(len(drive_ids) - len(requests_), cache="drive_names", result="hit")
+        metrics.CACHE_REQUESTS.inc(len(requests_), cache="drive_names", result="miss")
 
-        try:
-            batch.execute()
-        except Exception as e:
-            logger.warning("Failed to fetch drive names: %s", e)
+        if requests_:
+            self.execute_batch(requests_, callb, "drive_names", deadline)
 
         self.drive_names.save()
         return self.drive_names.contents
@@ -178,9 +705,7 @@ class GoogleDrive:
         uids = set()
 
         def check_dupe(item):
-            driveId = item.get("driveId", "MyDrive")
-            md5Checksum = item.get("md5Checksum")
-            uid = driveId + (md5Checksum if md5Checksum else item.get("id"))
+            uid = (item.drive_id or "MyDrive") + (item.md5 or item.id)
 
             if uid in uids: return False
             uids.add(uid)
@@ -188,28 +713,252 @@ class GoogleDrive:
 
         return sorted(
             filter(check_dupe, response),
-            key=lambda item: int(item.get("size", 0)),
+            key=lambda item: item.size,
             reverse=True,
         )
 
-    def search(self, stream_meta):
-        self.results = []
-        self.query = self.get_query(stream_meta)
-
-        # Adiciona a pesquisa por ID direto no lote principal de queries
-        id_q = self.get_id_query(stream_meta)
-        if id_q and id_q not in self.query:
-            self.query.append(id_q)
+    def search_stages(self, sm):
+        """Split the Drive queries for `sm` into stages, most precise first.
+
+        The exact-id query and the primary title go first; every other
+        (AKA) title follows in batches of AKA_STAGE_SIZE.
+        """
+        return self.plan_stages(self.get_id_query(sm), self.get_query(sm))
+
+    def plan_stages(self, id_q, title_queries):
+        first = [q for q in [id_q] + title_queries[:1] if q]
+        rest = [q for q in title_queries[1:] if q not in first]
+
+        stages = [first] if first else []
+        for i in range(0, len(rest), AKA_STAGE_SIZE):
+            stages.append(rest[i : i + AKA_STAGE_SIZE])
+        return stages
+
+    def search_tiers(self, sm):
+        """``[(tier, queries)]`` of a staged search, most precise first.
+
+        The exact-id query, then the primary title, with the year for
+        movies, then the other titles in batches of AKA_STAGE_SIZE. A
+        movie's primary title is searched again without the year with
+        them, for files not named with it.
+        """
+        tiers = []
+        id_q = self.get_id_query(sm)
+        if id_q:
+            tiers.append(("id", [id_q]))
+
+        title_qs = self.get_query(sm)
+        year = getattr(sm, "year", None)
+        if title_qs and sm.stream_type == "movie" and year:
+            tiers.append(("title", [f"{title_qs[0]} and name contains '{year}'"]))
+        elif title_qs:
+            tiers.append(("title", title_qs[:1]))
+            title_qs = title_qs[1:]
+
+        for i in range(0, len(title_qs), AKA_STAGE_SIZE):
+            tiers.append(("aka", title_qs[i : i + AKA_STAGE_SIZE]))
+        return tiers
+
+    def run_tiers(self, sm, tiers, deadline=None):
+        """`run_stages` for `search_tiers`, stopping at STAGED_MIN_STREAMS."""
+        # Imported here: sgd.streams imports this module.
+        from sgd.streams import count_valid
+
+        query = []
+        response = []
+        partial = False
+        seen = set()
+        valid = 0
+
+        for i, (tier, stage) in enumerate(tiers):
+            if query and deadline and not deadline.allows(MIN_STAGE_SECONDS):
+                partial = True
+                break
+            files, cut_short = self.file_list(FILE_FIELDS, stage, deadline)
+            response += files
+            partial = partial or cut_short
+            query += stage
+            if i == len(tiers) - 1:
+                break
+
+            new = [item for item in files if item.id not in seen]
+            seen.update(item.id for item in new)
+            valid += count_valid(new, sm)
+            enough = valid >= STAGED_MIN_STREAMS
+            SEARCH_TIERS.inc(tier=tier, result="short_circuit" if enough else "continued")
+            if enough:
+                logger.info("%d valid stream(s) after the %s tier, skipping the rest", valid, tier)
+                break
+        return query, response, partial
+
+    def run_stages(self, stages, deadline=None):
+        """Returns ``(queries run, files, partial)``."""
+        query = []
+        response = []
+        partial = False
+
+        for stage in stages:
+            # The first stage always runs; later ones only while budget remains.
+            if query and deadline and not deadline.allows(MIN_STAGE_SECONDS):
+                partial = True
+                break
+            files, cut_short = self.file_list(FILE_FIELDS, stage, deadline)
+            response += files
+            partial = partial or cut_short
+            query += stage
+        return query, response, partial
+
+    def search(self, stream_meta, deadline=None):
+        series = stream_meta.stream_type == "series"
+        if series and FOLDER_SEARCH:
+            found = self.search_folders(stream_meta, deadline)
+            if found is not None:
+                return found
+
+        if series and SERIES_SEARCH == "season":
+            found = self.search_season(stream_meta, deadline)
+        elif QUERY_MODE == "broad":
+            with metrics.timed("query_plan"):
+                stages = self.plan_stages(self.get_id_query(stream_meta), self.broad_queries(stream_meta))
+            query, response, partial = self.run_stages(stages, deadline)
+            with metrics.timed("rerank"):
+                ranked = rerank.rerank(response, stream_meta)
+            found = self.finish_search(query, ranked, partial, deadline)._replace(len_response=len(response))
+        elif STAGED_MIN_STREAMS:
+            with metrics.timed("query_plan"):
+                tiers = self.search_tiers(stream_meta)
+            query, response, partial = self.run_tiers(stream_meta, tiers, deadline)
+            found = self.finish_search(query, response, partial, deadline)
+        else:
+            with metrics.timed("query_plan"):
+                stages = self.search_stages(stream_meta)
+            query, response, partial = self.run_stages(stages, deadline)
+            found = self.finish_search(query, response, partial, deadline)
+
+        if series and FOLDER_SEARCH:
+            self.learn_folders(stream_meta, found.results)
+        return found
+
+    def finish_search(self, query, response, partial, deadline):
+        results = self._dedupe_and_sort(response) if response else []
+        metrics.STAGE_RESULTS.inc(len(results), stage="drive_dedupe")
+
+        if not deadline or deadline.allows(MIN_STAGE_SECONDS):
+            self.get_drive_names(results, deadline)
+        return DriveSearch(query, results, len(response), partial)
+
+    def search_folders(self, sm, deadline=None):
+        """List the episode from the show's known folders, or None to search.
+
+        A single ``'<folder>' in parents`` query replaces the full-text
+        searches across every drive. None if no folder is known yet, or
+        none of them holds the episode (e.g. a new season's folder).
+        """
+        key = (self.account, sm.id)
+        folders = self.folder_cache.get(key)
+        metrics.cache_lookup("folders", folders is not None)
+        if not folders:
+            return None
 
-        response = self.file_list("id, name, size, driveId, md5Checksum")
-        self.len_response = 0
+        q = " or ".join(f"'{folder}' in parents" for folder in folders)
+        files, partial = self.file_list(FILE_FIELDS, [q], deadline)
+        if len(files) >= self.page_size:
+            # Not a show's folder, or too big to list in one page.
+            logger.info("Folders of %s hold %d+ files, searching instead", sm.id, len(files))
+            FOLDER_LISTINGS.inc(result="too_broad")
+            self.folder_cache.set(key, [])
+            return None
 
-        if response:
-            self.len_response = len(response)
-            self.results = self._dedupe_and_sort(response)
+        wanted = (int(sm.se), int(sm.ep))
+        episode = [item for item in files if wanted in episode_keys(item.name)]
+        FOLDER_LISTINGS.inc(result="found" if episode else "empty")
+        if not episode:
+            return None
+        search = self.finish_search([q], episode, partial, deadline)
+        return search._replace(len_response=len(files))
+
+    def learn_folders(self, sm, results):
+        """Remember the folders holding the episode `sm` among `results`."""
+        key = (self.account, sm.id)
+        known = self.folder_cache.get(key)
+        if known == []:
+            # Found to be too broad: leave it to expire.
+            return
+        wanted = (int(sm.se), int(sm.ep))
+        learned = [
+            item.parent for item in results
+            # A drive's root isn't a show folder.
+            if item.parent and item.parent != item.drive_id and wanted in episode_keys(item.name)
+        ]
+        if not learned:
+            return
+        folders = list(dict.fromkeys((known or []) + learned))[-FOLDER_LIMIT:]
+        if folders != known:
+            self.folder_cache.set(key, folders)
+
+    def search_season(self, sm, deadline=None):
+        """Answer an episode search from the index of its whole season."""
+        key = (self.account, sm.id, int(sm.se))
+        season = self.season_cache.get(key)
+        metrics.cache_lookup("season", season is not None)
+
+        if season is None:
+            call, is_leader = self.season_flight.acquire(key)
+            if is_leader:
+                try:
+                    season = self.fetch_season(key, sm, deadline)
+                except BaseException as e:
+                    self.season_flight.release(key, call, error=e)
+                    raise
+                self.season_flight.release(key, call, season)
+            else:
+                try:
+                    season = call.wait(deadline.timeout() if deadline else None)
+                except TimeoutError:
+                    logger.warning("Gave up waiting on an in-flight season search from another request")
+                    return DriveSearch([], [], 0, True)
+        elif time.monotonic() - season.fetched_at > SEASON_CACHE_FRESH:
+            self.refresh_season(key, sm)
+
+        files = season.episodes.get((int(sm.se), int(sm.ep)), [])
+        search = self.finish_search(season.query, files, season.partial, deadline)
+        return search._replace(len_response=season.len_response)
+
+    def fetch_season(self, key, sm, deadline=None):
+        with metrics.timed("query_plan"):
+            # Files named after the id are found by it whatever the episode.
+            stages = self.plan_stages(
+                f"name contains '{sm.id}'" if getattr(sm, "id", None) else None,
+                self.get_season_query(sm),
+            )
+        query, response, partial = self.run_stages(stages, deadline)
+        season = SeasonIndex(query, index_episodes(response), len(response), partial, time.monotonic())
+        logger.info(
+            "Indexed %d file(s) into %d episode(s) of %s season %s",
+            len(response), len(season.episodes), sm.id, sm.se,
+        )
+        # Like stream lists, a partial season isn't kept.
+        if not partial:
+            self.season_cache.set(key, season)
+        return season
+
+    def refresh_season(self, key, sm):
+        """Re-fetch a stale season index in the background, once at a time."""
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self.fetch_season(key, sm)
+            except Exception as e:
+                logger.warning("Refreshing season %s of %s failed: %s", sm.se, sm.id, e)
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
 
-        self.get_drive_names()
-        return self.results
+        self._season_refresher.submit(run)
 
     def get_acc_token(self):
         if not self.acc_token.contents: self.acc_token.contents = {}
@@ -223,6 +972,7 @@ class GoogleDrive:
             except (TypeError, ValueError) as e:
                 logger.warning("Couldn't parse cached token expiry (%r): %s", expires, e)
 
+        metrics.cache_lookup("token", not is_expired)
         if is_expired:
             body = {
                 "client_id": self.token["client_id"],
@@ -230,16 +980,27 @@ class GoogleDrive:
                 "refresh_token": self.token["refresh_token"],
                 "grant_type": "refresh_token",
             }
-            api_url = "https://www.googleapis.com/oauth2/v4/token"
             try:
-                oauth_resp = requests.post(api_url, json=body).json()
+                with metrics.timed("token_refresh"):
+                    oauth_resp = requests.post(f"{self.api_url}/oauth2/v4/token", json=body).json()
                 if "access_token" in oauth_resp:
                     oauth_resp["expires_in"] = timedelta(seconds=oauth_resp["expires_in"]) + datetime.now()
                     self.acc_token.contents = oauth_resp
                     self.acc_token.save()
                 else:
                     logger.error("OAuth token refresh failed: %s", oauth_resp)
+                    metrics.UPSTREAM_ERRORS.inc(upstream="oauth")
             except requests.exceptions.RequestException as e:
                 logger.error("OAuth token refresh request failed: %s", e)
+                metrics.UPSTREAM_ERRORS.inc(upstream="oauth")
 
         return self.acc_token.contents.get("access_token")
+
+    def token_expires_in(self):
+        """Seconds the cached access token has left (0 if unknown)."""
+        expires = (self.acc_token.contents or {}).get("expires_in")
+        try:
+            if isinstance(expires, str): expires = datetime.fromisoformat(expires)
+            return max(0.0, (expires - datetime.now()).total_seconds())
+        except (TypeError, ValueError):
+            return 0.0
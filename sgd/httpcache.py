@@ -0,0 +1,89 @@
+"""HTTP caching of the manifest and stream responses: ETags and Cache-Control.
+
+Responses carry a content-hash ETag, and a request whose If-None-Match
+holds it is answered 304 Not Modified. How long clients (max-age) and
+shared caches such as the Vercel edge (s-maxage, stale-while-revalidate)
+may keep a response is configured separately for the manifest and for
+stream responses, from MANIFEST_* and STREAM_* variables.
+
+A stream response embeds the access token of the account that found each
+file (unless CF_PROXY_URL is set), so it's cached for no longer than the
+tokens have left, minus STREAM_TOKEN_MARGIN seconds for the player to
+start. Only responses served from the stream cache get a policy: a fresh
+search streams its body before it knows whether it will be complete, so
+it's sent ``no-store``.
+"""
+
+import hashlib
+import os
+from typing import NamedTuple
+
+from werkzeug.http import parse_etags
+
+NO_STORE = "no-store"
+
+# Seconds a cached stream response must still leave its tokens, so a player
+# that gets it from a cache can start playing.
+STREAM_TOKEN_MARGIN = int(os.environ.get("STREAM_TOKEN_MARGIN", 600))
+
+
+class CachePolicy(NamedTuple):
+    max_age: int
+    s_maxage: int
+    stale_while_revalidate: int
+
+    @classmethod
+    def from_env(cls, prefix, max_age, s_maxage, stale_while_revalidate):
+        """A policy from `prefix`_MAX_AGE, _S_MAXAGE and _STALE_WHILE_REVALIDATE."""
+        return cls(
+            int(os.environ.get(f"{prefix}_MAX_AGE", max_age)),
+            int(os.environ.get(f"{prefix}_S_MAXAGE", s_maxage)),
+            int(os.environ.get(f"{prefix}_STALE_WHILE_REVALIDATE", stale_while_revalidate)),
+        )
+
+    def header(self, lifetime=None):
+        """The Cache-Control value, for a body valid `lifetime` more seconds.
+
+        A shared cache may serve a response up to s-maxage plus
+        stale-while-revalidate seconds after it was fetched, so both
+        together stay within `lifetime`.
+        """
+        max_age, s_maxage, stale = self
+        if lifetime is not None:
+            lifetime = int(lifetime)
+            max_age = min(max_age, lifetime)
+            s_maxage = min(s_maxage, lifetime)
+            stale = min(stale, lifetime - s_maxage)
+        if max_age <= 0 and s_maxage <= 0:
+            return NO_STORE
+        value = f"public, max-age={max(max_age, 0)}, s-maxage={max(s_maxage, 0)}"
+        if stale > 0:
+            value += f", stale-while-revalidate={stale}"
+        return value
+
+
+MANIFEST_CACHE = CachePolicy.from_env("MANIFEST", 3600, 86400, 86400)
+STREAM_CACHE = CachePolicy.from_env("STREAM", 300, 900, 600)
+
+
+def stream_cache_control(token_lifetime):
+    """Cache-Control of a stream response whose tokens expire in `token_lifetime`
+    seconds (None if it embeds none)."""
+    if token_lifetime is None:
+        return STREAM_CACHE.header()
+    return STREAM_CACHE.header(token_lifetime - STREAM_TOKEN_MARGIN)
+
+
+def etag(body, encoding=None):
+    """A strong ETag (unquoted) for `body`, a hash of its content.
+
+    Each content encoding of a body is a representation of its own, with
+    its own ETag.
+    """
+    tag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return f"{tag}-{encoding}" if encoding else tag
+
+
+def not_modified(if_none_match, tag):
+    """Whether an If-None-Match header value matches the ETag `tag`."""
+    return bool(if_none_match) and parse_etags(if_none_match).contains_weak(tag)
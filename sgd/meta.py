@@ -1,11 +1,10 @@
 import os
+import copy
 import json
 import logging
-import lxml
-import cchardet
 import sgd.utils as ut
+from sgd import metrics
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
 from sgd.cache import Json
 
 logger = logging.getLogger(__name__)
@@ -15,10 +14,45 @@ logger = logging.getLogger(__name__)
 # response) would stick forever.
 METADATA_CACHE_TTL = timedelta(days=7)
 
+# Under a request time budget, metadata requests get at most half of what's
+# left (the rest is kept for the Drive search), and none gets less than this.
+MIN_SOURCE_TIMEOUT = 0.5
+
 
 class MetadataNotFound(Exception):
     pass
 
+
+def title_id(stream_id):
+    """The title part of a stream id: "tt123" or "tmdb:123", without se/ep."""
+    parts = ut.split_stream_id(ut.normalize_stream_id(stream_id))
+    return ":".join(parts[:2]) if parts[0] == "tmdb" else parts[0]
+
+
+def season_episode(stream_type, id_split):
+    """``(se, ep)`` from the last two parts of a series id, zero padded."""
+    se = ep = 0
+    if stream_type == "series":
+        try:
+            ep = str(id_split[-1]).zfill(2)
+            se = str(id_split[-2]).zfill(2)
+        except IndexError:
+            pass
+    return se, ep
+
+
+def for_episode(stream_meta, stream_id):
+    """A copy of `stream_meta` (for any episode of a title) for `stream_id`.
+
+    Everything but the season and episode is per title, so concurrent
+    requests for different episodes can share one metadata lookup.
+    """
+    stream_meta = copy.copy(stream_meta)
+    stream_meta.se, stream_meta.ep = season_episode(
+        stream_meta.stream_type, ut.split_stream_id(stream_id)
+    )
+    return stream_meta
+
 class IMDb:
     def __init__(self):
         self.imdb_sg_url = f"v2.sg.media-imdb.com/suggests/t/{self.id}.json"
@@ -26,24 +60,36 @@ class IMDb:
         self.imdb_html_url = f"imdb.com/title/{self.id}/releaseinfo?ref_=tt_dt_aka"
 
         self.fetch_dest = "None"
+        # The source of each title, in order, for the query stats.
+        sources = []
+        credit = lambda source: sources.extend([source] * (len(self.titles) - len(sources)))
         
-        if self.get_meta_from_tmdb():
-            self.fetch_dest = "TMDB_API"
+        with metrics.timed("meta_tmdb"):
+            if self.get_meta_from_tmdb():
+                self.fetch_dest = "TMDB_API"
+        credit("tmdb")
             
-        if self.get_meta_from_cinemeta():
-            if self.fetch_dest == "None":
-                self.fetch_dest = "CINEMETA"
+        with metrics.timed("meta_cinemeta"):
+            if self.get_meta_from_cinemeta():
+                if self.fetch_dest == "None":
+                    self.fetch_dest = "CINEMETA"
+        credit("cinemeta")
         
-        if not self.titles and self.get_meta_from_imdb_sg():
-            if self.fetch_dest == "None":
-                self.fetch_dest = "IMDB_SG_API"
+        if not self.titles:
+            with metrics.timed("meta_imdb_sg"):
+                if self.get_meta_from_imdb_sg():
+                    if self.fetch_dest == "None":
+                        self.fetch_dest = "IMDB_SG_API"
+            credit("imdb_sg")
 
         try:
-            self.get_meta_from_imdb_html()
+            with metrics.timed("meta_imdb_html"):
+                self.get_meta_from_imdb_html()
             if self.fetch_dest == "None" and self.titles:
                 self.fetch_dest = "IMDB_HTML"
         except Exception as e:
             logger.warning("Failed to read IMDb HTML page for %s: %s", self.id, e)
+        credit("imdb_html")
 
         if not self.titles:
             self.fetch_dest = "NULL"
@@ -52,7 +98,7 @@ class IMDb:
             )
             
         cleaned_titles = []
-        for t in self.titles:
+        for t, source in zip(self.titles, sources):
             if t and isinstance(t, str) and len(t) > 1:
                 clean_t = t.lower().strip()
                 unaccented_t = ut.strip_accents(clean_t)
@@ -62,9 +108,19 @@ class IMDb:
                     
                 if unaccented_t not in cleaned_titles and unaccented_t != clean_t:
                     cleaned_titles.append(unaccented_t)
+
+                # A title several sources agree on is the first one's.
+                self.title_sources.setdefault(clean_t, source)
+                self.title_sources.setdefault(unaccented_t, source)
                     
         self.titles = cleaned_titles
 
+    def source_timeout(self, default):
+        """Timeout for one metadata request, given the request's time budget."""
+        if self.deadline is None:
+            return default
+        return max(MIN_SOURCE_TIMEOUT, min(default, self.deadline.remaining() / 2))
+
     def get_meta_from_tmdb(self):
         tmdb_key = os.environ.get("TMDB_API_KEY")
         if not tmdb_key:
@@ -72,7 +128,7 @@ class IMDb:
             
         try:
             find_url = f"api.themoviedb.org/3/find/{self.id}?api_key={tmdb_key}&external_source=imdb_id"
-            find_resp = ut.req_wrapper(find_url)
+            find_resp = ut.req_wrapper(find_url, time_out=self.source_timeout(3))
             if not find_resp: return False
             
             find_data = json.loads(find_resp)
@@ -98,7 +154,7 @@ class IMDb:
                 self.year = date_str[:4]
 
             pt_url = f"api.themoviedb.org/3/{media_type}/{tmdb_id}?api_key={tmdb_key}&language=pt-BR"
-            pt_resp = ut.req_wrapper(pt_url)
+            pt_resp = ut.req_wrapper(pt_url, time_out=self.source_timeout(3))
             if pt_resp:
                 pt_data = json.loads(pt_resp)
                 pt_title = pt_data.get("title") or pt_data.get("name")
@@ -111,13 +167,25 @@ class IMDb:
 
         except Exception as e:
             logger.warning("TMDB lookup failed for %s: %s", self.id, e)
+            metrics.UPSTREAM_ERRORS.inc(upstream="api.themoviedb.org")
             return False
 
     def get_meta_from_imdb_html(self):
+        # The AKA titles scraped from here only broaden the search, so under
+        # a tight budget they're skipped and the metadata marked partial.
+        if self.deadline is not None and not self.deadline.allows(2 * MIN_SOURCE_TIMEOUT):
+            self.partial = True
+            return False
+
         try:
-            imdb_html = ut.req_wrapper(self.imdb_html_url, time_out=5)
+            imdb_html = ut.req_wrapper(self.imdb_html_url, time_out=self.source_timeout(5))
             if not imdb_html: return False
-            
+
+            # Imported here rather than at module level to keep cold starts
+            # fast: only this scraper needs bs4 (with lxml as its parser and
+            # cchardet, which bs4 picks up on its own, for encoding sniffing).
+            from bs4 import BeautifulSoup
+
             soup = BeautifulSoup(imdb_html, "lxml")
             table = soup.find("table", attrs={"class": "akas-table-test-only"})
             r_title_block = soup.find(
@@ -179,26 +247,29 @@ class IMDb:
             return True
         except Exception as e:
             logger.warning("Failed to parse IMDb HTML page for %s: %s", self.id, e)
+            metrics.UPSTREAM_ERRORS.inc(upstream="imdb.com")
             return False
 
     def get_meta_from_imdb_sg(self):
         try:
-            meta = ut.req_api(self.imdb_sg_url, key="d")
+            meta = ut.req_api(self.imdb_sg_url, key="d", time_out=self.source_timeout(3))
             if meta:
                 self.set_meta(meta[0], year="y", title="l")
                 return True
         except Exception as e:
             logger.warning("IMDb suggest lookup failed for %s: %s", self.id, e)
+            metrics.UPSTREAM_ERRORS.inc(upstream="v2.sg.media-imdb.com")
         return False
 
     def get_meta_from_cinemeta(self):
         try:
-            meta = ut.req_api(self.cinemeta_url)
+            meta = ut.req_api(self.cinemeta_url, time_out=self.source_timeout(3))
             if meta:
                 self.set_meta(meta)
                 return True
         except Exception as e:
             logger.warning("Cinemeta lookup failed for %s: %s", self.id, e)
+            metrics.UPSTREAM_ERRORS.inc(upstream="v3-cinemeta.strem.io")
         return False
 
     def set_meta(self, meta, year="year", title="name"):
@@ -215,8 +286,16 @@ class IMDb:
 
 
 class Meta(IMDb):
-    def __init__(self, stream_type, stream_id):
+    # Per-request attributes that are never written to the metadata cache.
+    UNCACHED = ("deadline", "partial")
+
+    def __init__(self, stream_type, stream_id, deadline=None):
+        self.deadline = deadline
+        self.partial = False
         self.titles = []
+        # title -> the source it came from ("tmdb", "cinemeta", "imdb_sg" or
+        # "imdb_html"); empty for metadata cached before it was recorded.
+        self.title_sources = {}
         self.name = None
         self.original_title = None
         self.year = None
@@ -242,12 +321,7 @@ class Meta(IMDb):
 
         self.id = self.id_split[0]
 
-        if stream_type == "series":
-            try:
-                self.ep = str(self.id_split[-1]).zfill(2)
-                self.se = str(self.id_split[-2]).zfill(2)
-            except IndexError:
-                pass
+        self.se, self.ep = season_episode(stream_type, self.id_split)
 
         cached = Json(f"{self.id}.json")
         cached_at = cached.contents.get("cached_at")
@@ -258,11 +332,17 @@ class Meta(IMDb):
             except ValueError:
                 is_stale = True
 
+        metrics.cache_lookup("meta", bool(cached.contents) and not is_stale)
         if not cached.contents or is_stale:
             IMDb.__init__(self)
-            cached.contents.update(self.__dict__)
-            cached.contents["cached_at"] = datetime.now().isoformat()
-            cached.save()
+            # Partial metadata (a source skipped for lack of time) would
+            # otherwise pin a narrower title list for the whole cache TTL.
+            if not self.partial:
+                cached.contents.update(
+                    (k, v) for k, v in self.__dict__.items() if k not in self.UNCACHED
+                )
+                cached.contents["cached_at"] = datetime.now().isoformat()
+                cached.save()
         else:
             cached.contents["se"] = self.se
             cached.contents["ep"] = self.ep
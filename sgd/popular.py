@@ -0,0 +1,64 @@
+"""How many times each stream id has been requested.
+
+Counted by the stream routes and kept in /tmp/popular.json, so prewarming
+(see sgd.prewarm) can warm the most requested ids after a deploy or a cold
+start.
+"""
+
+import atexit
+import threading
+import time
+from collections import Counter
+
+from sgd.cache import Json
+from sgd.utils import normalize_stream_id
+
+# Ids whose request counts are kept; past it, the least requested half goes.
+MAX_TRACKED_IDS = 5000
+# The counts are written out at most this often (seconds).
+SAVE_INTERVAL = 60
+
+
+class PopularIds:
+    """Request counts per stream id, written out at most every SAVE_INTERVAL."""
+
+    def __init__(self, filename="popular.json", clock=time.monotonic):
+        self.filename = filename
+        self.clock = clock
+        self._cache = None
+        self._saved_at = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def counts(self):
+        """``{"<type>/<id>": requests}``, loaded on first use."""
+        if self._cache is None:
+            self._cache = Json(self.filename)
+        return self._cache.contents
+
+    def seen(self, stream_type, stream_id):
+        key = f"{stream_type}/{normalize_stream_id(stream_id)}"
+        with self._lock:
+            counts = self.counts
+            counts[key] = counts.get(key, 0) + 1
+            if len(counts) > MAX_TRACKED_IDS:
+                keep = Counter(counts).most_common(MAX_TRACKED_IDS // 2)
+                counts.clear()
+                counts.update(keep)
+            if self.clock() - self._saved_at >= SAVE_INTERVAL:
+                self.save()
+
+    def top(self, n):
+        """The `n` most requested ``(stream_type, stream_id)``."""
+        with self._lock:
+            ranked = Counter(self.counts).most_common(n)
+        return [tuple(key.split("/", 1)) for key, _ in ranked]
+
+    def save(self):
+        if self._cache is not None:
+            self._cache.save()
+        self._saved_at = self.clock()
+
+
+popular = PopularIds()
+atexit.register(popular.save)
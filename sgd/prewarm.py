@@ -0,0 +1,153 @@
+"""Cache prewarming: run the stream pipeline for a list of ids ahead of users.
+
+After a deploy or a cold start, the first request for each title pays for
+the metadata lookup, the Drive search and the parsing. `warm` does that
+for a list of ids, PREWARM_CONCURRENCY at a time and at most PREWARM_RATE
+ids a second, which fills every cache along the way: the access tokens,
+the metadata files, the drive names, the season and folder indexes, and
+the stream cache itself.
+
+The ids come from a file (one per line), from request logs (any line
+holding a ``/stream/<type>/<id>.json`` path), or from the ids requested
+most (counted by sgd.popular). Run it in the serving process through the
+``/admin/prewarm`` route (e.g. from a cron), or with
+``python -m sgd.prewarm``, which warms this host's on-disk caches, or a
+running instance's with ``--url``.
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from sgd import metrics
+from sgd.meta import MetadataNotFound
+from sgd.popular import popular
+from sgd.ratelimit import TokenBucket
+from sgd.utils import Deadline, normalize_stream_id
+
+logger = logging.getLogger(__name__)
+
+PREWARM_CONCURRENCY = int(os.environ.get("PREWARM_CONCURRENCY", 4))
+PREWARM_RATE = float(os.environ.get("PREWARM_RATE", 2))
+# Ids the cron trigger warms when it isn't given a list, and the seconds it
+# may spend starting them (keep it below the platform's function timeout;
+# 0 for no limit).
+PREWARM_POPULAR = int(os.environ.get("PREWARM_POPULAR", 50))
+PREWARM_TIME_BUDGET = float(os.environ.get("PREWARM_TIME_BUDGET", 0))
+PREWARMED = metrics.counter(
+    "sgd_prewarm_ids_total",
+    "Ids run through the stream pipeline by prewarming, by outcome.",
+    ["result"],
+)
+
+STREAM_PATH = re.compile(r"/stream/(movie|series)/([^/\s?]+)\.json")
+ID_LINE = re.compile(r"^(?:(movie|series)[\s/]+)?(\S+)$")
+
+
+def parse_ids(lines):
+    """``[(stream_type, stream_id)]`` of id list or request log `lines`, deduplicated.
+
+    A line is a stream path (as in an access log), ``<type> <id>``,
+    ``<type>/<id>``, or a bare id (a series episode if it has a season and
+    episode). Blank lines and ``#`` comments are skipped.
+    """
+    items = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        match = STREAM_PATH.search(line) or ID_LINE.match(line)
+        if not match:
+            continue
+        stream_type, stream_id = match.groups()
+        stream_id = normalize_stream_id(stream_id)
+        stream_type = stream_type or ("series" if stream_id.count(":") >= 2 else "movie")
+        items[stream_type, stream_id] = True
+    return list(items)
+
+
+def warm(items, concurrency=None, rate=None, deadline=None):
+    """Run the stream pipeline for `items` (see parse_ids). Returns the outcome
+    counts: ``cached`` (already were), ``warmed``, ``partial`` (not cached:
+    out of time), ``not_found``, ``failed``, ``invalid``, and ``skipped``
+    (not started before the `deadline`)."""
+    from sgd import routes
+    from sgd.gdrive import shared_batches
+
+    concurrency = concurrency or PREWARM_CONCURRENCY
+    limiter = TokenBucket("prewarm", rate or PREWARM_RATE, 1)
+    deadline = deadline or Deadline(None)
+
+    # One refresh per account up front, rather than one per worker.
+    for account in range(len(routes.gdrive)):
+        routes.gdrive.get_acc_token(account)
+
+    def warm_one(item):
+        stream_type, stream_id = item
+        if stream_type not in routes.MANIFEST["types"] or not routes.is_valid_stream_id(stream_id):
+            return "invalid"
+        if routes.stream_cache.get((stream_type, normalize_stream_id(stream_id))) is not None:
+            return "cached"
+        if limiter.acquire(1, deadline.timeout()) is None or not deadline.allows(0.001):
+            return "skipped"
+        try:
+            with shared_batches():
+                _, partial = routes.find_streams(stream_type, stream_id)
+        except MetadataNotFound:
+            return "not_found"
+        except Exception as e:
+            logger.warning("Prewarming %s failed: %s", stream_id, e)
+            return "failed"
+        return "partial" if partial else "warmed"
+
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="sgd-prewarm") as pool:
+        outcomes = Counter(pool.map(warm_one, items))
+    for result, n in outcomes.items():
+        PREWARMED.inc(n, result=result)
+    logger.info("Prewarmed %d id(s): %s", len(items), dict(outcomes))
+    return dict(outcomes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ids", metavar="FILE", action="append", default=[],
+                        help="a file of ids, one per line ('-' for stdin)")
+    parser.add_argument("--log", metavar="FILE", action="append", default=[],
+                        help="a request log to take the stream paths of")
+    parser.add_argument("--popular", type=int, default=0, metavar="N",
+                        help="also the N ids requested most on this host")
+    parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=PREWARM_RATE, help="ids per second")
+    parser.add_argument("--url", help="have the instance at this url (with ADMIN_SECRET) warm its own "
+                                      "caches instead, at its PREWARM_* settings")
+    args = parser.parse_args(argv)
+
+    lines = []
+    for path in args.ids + args.log:
+        with (sys.stdin if path == "-" else open(path)) as file_:
+            lines.extend(file_)
+    items = parse_ids(lines)
+    items += [item for item in popular.top(args.popular) if item not in items]
+    if not items:
+        parser.error("no ids to warm: pass --ids, --log or --popular")
+
+    if args.url:
+        import requests
+
+        resp = requests.post(
+            f"{args.url.rstrip('/')}/admin/prewarm",
+            data="\n".join(f"{t}/{i}" for t, i in items),
+            headers={"X-Admin-Secret": os.environ.get("ADMIN_SECRET", "")},
+        )
+        resp.raise_for_status()
+        print(resp.text)
+    else:
+        print(warm(items, args.concurrency, args.rate))
+
+
+if __name__ == "__main__":
+    main()
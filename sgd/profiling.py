@@ -0,0 +1,206 @@
+"""Opt-in per-request profiling of stream requests.
+
+A sampled request runs under cProfile and tracemalloc, and three files are
+written to PROFILE_DIR (default ``/tmp/sgd-profiles``):
+
+* ``<tag>.prof``: pstats data (``python -m pstats``, snakeviz...)
+* ``<tag>.collapsed``: folded stacks for flamegraph.pl / speedscope
+* ``<tag>.json``: the stream id, wall time, per-stage timings and the top
+  allocation sites
+
+Profiling is off unless PROFILE_SAMPLE_RATE (0-1) is set, or PROFILE_SECRET
+is set and the request sends it in an ``X-Profile`` header. Only the newest
+PROFILE_KEEP (default 20) profiles are kept.
+"""
+
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+from sgd import metrics
+
+logger = logging.getLogger(__name__)
+
+# Stage timings of the request being profiled on this thread, if any.
+_local = threading.local()
+# cProfile (sys.monitoring since 3.12) and tracemalloc are process-wide, and
+# a second profiler can't be enabled while one is active: profile one
+# request at a time, and serve the others unprofiled meanwhile.
+_profile_lock = threading.Lock()
+
+
+def _record_stage(seconds, labels):
+    stages = getattr(_local, "stages", None)
+    if stages is not None:
+        stages[labels.get("stage", "")] += seconds
+
+
+metrics.STAGE_SECONDS.listeners.append(_record_stage)
+
+
+def should_profile(headers):
+    secret = os.environ.get("PROFILE_SECRET")
+    if secret and hmac.compare_digest(headers.get("X-Profile", ""), secret):
+        return True
+    rate = float(os.environ.get("PROFILE_SAMPLE_RATE", 0) or 0)
+    return rate > 0 and random.random() < rate
+
+
+def profile_stream(stream_type, stream_id, chunks):
+    """Yield from the `chunks` generator, profiling only the time spent in it.
+
+    The profiler is switched on around each step of the generator, so the
+    time the server spends writing chunks to the client isn't counted -
+    though other threads running meanwhile are. Profiling never fails the
+    request: if another profile is running, or the profiler can't be
+    enabled, the chunks are just passed through.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        logger.debug("Another request is being profiled, not profiling %s", stream_id)
+        yield from chunks
+        return
+
+    profile = cProfile.Profile()
+    stages = defaultdict(float)
+    tracing = not tracemalloc.is_tracing()
+    start = time.perf_counter()
+    error = None
+    try:
+        # Leave tracemalloc alone if something else (PYTHONTRACEMALLOC) started it.
+        if tracing:
+            tracemalloc.start()
+        snapshot_before = tracemalloc.take_snapshot()
+    except Exception as e:
+        logger.warning("Couldn't trace allocations for %s: %s", stream_id, e)
+        snapshot_before = None
+
+    try:
+        while True:
+            _local.stages = stages
+            try:
+                if profile is not None:
+                    profile.enable()
+            except ValueError as e:
+                # "Another profiling tool is already active".
+                logger.warning("Couldn't profile %s: %s", stream_id, e)
+                profile = None
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            except Exception as e:
+                error = repr(e)
+                raise
+            finally:
+                if profile is not None:
+                    profile.disable()
+                _local.stages = None
+            yield chunk
+    finally:
+        try:
+            if profile is not None:
+                allocations = []
+                if snapshot_before is not None:
+                    allocations = tracemalloc.take_snapshot().compare_to(snapshot_before, "lineno")[:10]
+                write_profile(
+                    profile, stream_type, stream_id, time.perf_counter() - start, stages,
+                    allocations, error,
+                )
+        except Exception as e:
+            logger.warning("Couldn't write profile for %s: %s", stream_id, e)
+        finally:
+            if tracing and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            _profile_lock.release()
+
+
+def write_profile(profile, stream_type, stream_id, wall, stages, allocations, error=None):
+    directory = os.environ.get("PROFILE_DIR", "/tmp/sgd-profiles")
+    os.makedirs(directory, exist_ok=True)
+
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", stream_id)
+    tag = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{stream_type}-{safe_id}"
+    base = os.path.join(directory, tag)
+
+    stats = pstats.Stats(profile)
+    stats.dump_stats(f"{base}.prof")
+    with open(f"{base}.collapsed", "w") as file_:
+        for stack, micros in collapsed_stacks(stats):
+            file_.write(f"{stack} {micros}\n")
+    with open(f"{base}.json", "w") as file_:
+        json.dump({
+            "stream_type": stream_type,
+            "stream_id": stream_id,
+            "wall_seconds": round(wall, 6),
+            "stages": {stage: round(seconds, 6) for stage, seconds in sorted(stages.items())},
+            "top_allocations": [
+                {"where": str(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in allocations
+            ],
+            "error": error,
+        }, file_, indent=2)
+
+    logger.info("Wrote profile %s (%.3fs)", base, wall)
+    prune(directory, int(os.environ.get("PROFILE_KEEP", 20)))
+    return base
+
+
+def prune(directory, keep):
+    """Delete all but the newest `keep` profiles (every file of a profile)."""
+    tags = sorted({name.rsplit(".", 1)[0] for name in os.listdir(directory)}, reverse=True)
+    for tag in tags[keep:]:
+        for ext in ("prof", "collapsed", "json"):
+            try:
+                os.remove(os.path.join(directory, f"{tag}.{ext}"))
+            except FileNotFoundError:
+                pass
+
+
+def collapsed_stacks(stats, max_depth=64):
+    """Folded ``a;b;c <microseconds>`` lines from cProfile's call graph.
+
+    cProfile only records caller -> callee edges, not whole stacks, so each
+    function's own time is split between its call paths in proportion to
+    the time each caller spent calling it - the usual approximation.
+    """
+    callees = defaultdict(dict)
+    # A function's time not attributed to any recorded caller makes it a
+    # root: e.g. the generator step the profiler was switched on around.
+    roots = {}
+    for func, (_, _, _, total, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller][func] = cumulative
+        unattributed = total - sum(edge[3] for edge in callers.values())
+        if unattributed > 1e-6:
+            roots[func] = unattributed
+
+    def label(func):
+        filename, line, name = func
+        return f"{name} ({os.path.basename(filename)}:{line})" if line else name
+
+    out = defaultdict(int)
+
+    def walk(func, share, path, seen):
+        _, _, own, cumulative, _ = stats.stats[func]
+        fraction = share / cumulative if cumulative else 0
+        micros = int(own * fraction * 1e6)
+        if micros:
+            out[";".join(path)] += micros
+        if len(path) >= max_depth:
+            return
+        for callee, edge_time in callees[func].items():
+            if callee not in seen and edge_time * fraction > 1e-6:
+                walk(callee, edge_time * fraction, path + [label(callee)], seen | {callee})
+
+    for root, share in roots.items():
+        walk(root, share, [label(root)], {root})
+    return sorted(out.items())
@@ -0,0 +1,324 @@
+"""The /load range proxy: plays Drive files through the addon itself.
+
+A local alternative to cf_proxy.js. Range requests are forwarded to Drive
+over a pool of keep-alive connections, with the token of the account that
+found the file (from the same in-process token cache as the streams), and
+the media is relayed chunk by chunk as it arrives. Each request gets its
+own upstream connection, so a player can have several ranges of one file
+in flight at once.
+
+With MEDIA_CACHE_MB set, files whose md5 is known (it's in the playback
+url) also go through a ChunkCache: blocks relayed from Drive are kept on
+disk, the blocks following a requested range are read ahead in the
+background, and a range whose first block is cached is served from disk
+until the first missing block, then from Drive.
+"""
+
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Iterable, NamedTuple
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from sgd import metrics
+from sgd.cache import ChunkCache
+from sgd.gdrive import DRIVE_API_URL
+
+logger = logging.getLogger(__name__)
+
+DRIVE_MEDIA_URL = f"{DRIVE_API_URL}/drive/v3/files"
+# Largest chunk relayed at once; a chunk is sent as soon as it's read.
+CHUNK_SIZE = 256 * 1024
+# (connect, read) timeouts of upstream requests. Only the wait for each
+# chunk is bounded, not the whole (possibly hour-long) download.
+UPSTREAM_TIMEOUT = (5, 30)
+VALID_FILE_ID = re.compile(r"^[A-Za-z0-9_-]{10,100}$")
+VALID_MD5 = re.compile(r"^[0-9a-f]{32}$")
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+# Media cache blocks, and how many of them are read ahead after a range.
+BLOCK_SIZE = 4 * 2**20
+READ_AHEAD_BLOCKS = int(os.environ.get("MEDIA_READ_AHEAD", 2))
+# Upstream headers a player needs to seek; anything else is dropped.
+PASSTHROUGH_HEADERS = (
+    "Content-Type", "Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified",
+)
+
+PROXY_REQUESTS = metrics.counter(
+    "sgd_proxy_requests_total", "Range requests served by the /load proxy, by upstream status.", ["status"]
+)
+PROXY_BYTES = metrics.counter("sgd_proxy_bytes_total", "Media bytes relayed by the /load proxy.")
+MEDIA_CACHE_HIT_RATIO = metrics.gauge(
+    "sgd_media_cache_hit_ratio", "Share of media blocks served from the chunk cache since start."
+)
+MEDIA_CACHE_BYTES = metrics.gauge("sgd_media_cache_bytes", "Bytes of media blocks on disk.")
+
+_session = None
+_cache = None
+_cache_lock = threading.Lock()
+_read_ahead = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sgd-readahead")
+_reading_ahead = set()
+# Media blocks served from the cache and from Drive, for the hit ratio.
+_block_counts = [0, 0]
+
+
+class MediaResponse(NamedTuple):
+    status: int
+    headers: dict
+    # Closing it (as WSGI/ASGI servers do) releases the upstream connection.
+    body: Iterable[bytes]
+
+
+def enabled():
+    return os.environ.get("LOCAL_PROXY", "").lower() in ("1", "true", "yes")
+
+
+def session():
+    global _session
+    if _session is None:
+        pool_size = int(os.environ.get("LOCAL_PROXY_CONNECTIONS", 64))
+        _session = requests.Session()
+        _session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+        _session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+    return _session
+
+
+def media_cache():
+    """The process' ChunkCache, or None unless MEDIA_CACHE_MB is set."""
+    global _cache
+    max_mb = float(os.environ.get("MEDIA_CACHE_MB", 0) or 0)
+    if max_mb <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            directory = os.environ.get("MEDIA_CACHE_DIR", "/tmp/sgd-media")
+            _cache = ChunkCache(directory, int(max_mb * 2**20), BLOCK_SIZE)
+        return _cache
+
+
+def parse_range(header, size):
+    """``(start, end)`` of a single-range header, None for the whole file.
+
+    Raises ValueError if the range can't be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        raise ValueError(header)
+    first, last = match.groups()
+    if first == "":
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def fetch(file_id, acc_token, range_header=None, md5=None):
+    """Open `range_header` of a Drive file, returning a MediaResponse."""
+    cache = media_cache() if md5 else None
+    if cache is None:
+        return fetch_upstream(file_id, acc_token, range_header)
+
+    key = (file_id, md5)
+    info = cache.file_info(key)
+    if info is None:
+        # Never seen: Drive's answer tells us its size.
+        count_blocks(hits=0, misses=1)
+        return fetch_upstream(file_id, acc_token, range_header, cache, key)
+
+    size, content_type = info
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return MediaResponse(416, {"Content-Range": f"bytes */{size}"}, [b""])
+    start, end = byte_range or (0, size - 1)
+
+    if range_header and end < size - 1:
+        read_ahead(cache, key, acc_token, end // BLOCK_SIZE + 1)
+    if (key, start // BLOCK_SIZE) not in cache:
+        count_blocks(hits=0, misses=1)
+        return fetch_upstream(file_id, acc_token, range_header, cache, key)
+
+    headers = {
+        "Content-Type": content_type,
+        "Content-Length": str(end - start + 1),
+        "Accept-Ranges": "bytes",
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    PROXY_REQUESTS.inc(status="cache")
+    return MediaResponse(206 if byte_range else 200, headers, serve_cached(cache, key, acc_token, start, end))
+
+
+def fetch_upstream(file_id, acc_token, range_header=None, cache=None, key=None):
+    """Forward the request to Drive; with a `cache`, keep what passes by."""
+    headers = {"Authorization": f"Bearer {acc_token}"}
+    if range_header:
+        headers["Range"] = range_header
+
+    start = perf_counter()
+    try:
+        upstream = session().get(
+            f"{DRIVE_MEDIA_URL}/{file_id}",
+            params={"alt": "media", "supportsAllDrives": "true"},
+            headers=headers, stream=True, timeout=UPSTREAM_TIMEOUT,
+        )
+    except requests.exceptions.RequestException as e:
+        logger.warning("Drive media request for %s failed: %s", file_id, e)
+        metrics.UPSTREAM_ERRORS.inc(upstream="drive_media")
+        PROXY_REQUESTS.inc(status="error")
+        return MediaResponse(502, {"Content-Type": "text/plain"}, [b"Bad Gateway"])
+    metrics.STAGE_SECONDS.observe(perf_counter() - start, stage="proxy_first_byte")
+    PROXY_REQUESTS.inc(status=str(upstream.status_code))
+
+    if upstream.status_code >= 400:
+        logger.warning("Drive answered %d for media %s", upstream.status_code, file_id)
+    body = relay(upstream)
+    if cache is not None and upstream.status_code in (200, 206):
+        offset, size = body_extent(upstream)
+        if size is not None:
+            cache.set_file_info(key, size, upstream.headers.get("Content-Type", "application/octet-stream"))
+            body = store_blocks(body, cache, key, offset, size)
+    return MediaResponse(
+        upstream.status_code,
+        {k: upstream.headers[k] for k in PASSTHROUGH_HEADERS if k in upstream.headers},
+        body,
+    )
+
+
+def body_extent(upstream):
+    """``(offset of the body, file size)`` from a 200/206 response's headers."""
+    if upstream.status_code == 206:
+        match = CONTENT_RANGE.match(upstream.headers.get("Content-Range", ""))
+        if match:
+            return int(match.group(1)), int(match.group(3))
+        return 0, None
+    length = upstream.headers.get("Content-Length")
+    return 0, (int(length) if length and length.isdigit() else None)
+
+
+def relay(upstream):
+    """Yield the upstream body as it arrives, byte for byte."""
+    try:
+        # read1 returns whatever has arrived (up to CHUNK_SIZE) instead of
+        # waiting to fill a buffer, and doesn't decode, so Content-Length
+        # stays right.
+        while True:
+            chunk = upstream.raw.read1(CHUNK_SIZE, decode_content=False)
+            if not chunk:
+                break
+            PROXY_BYTES.inc(len(chunk))
+            yield chunk
+    except (OSError, urllib3.exceptions.HTTPError) as e:
+        # Too late for an error status: the client sees a short body.
+        logger.warning("Drive media stream broke off: %s", e)
+        metrics.UPSTREAM_ERRORS.inc(upstream="drive_media")
+    finally:
+        upstream.close()
+
+
+def store_blocks(chunks, cache, key, offset, size):
+    """Pass `chunks` (file bytes from `offset`) through, caching whole blocks.
+
+    Only blocks seen from their first byte are kept: a body starting mid
+    block skips that block. The chunks aren't held back - a block is saved
+    once its last byte has been passed on.
+    """
+    pos = offset
+    index = offset // BLOCK_SIZE if offset % BLOCK_SIZE == 0 else None
+    block = bytearray()
+    for chunk in chunks:
+        yield chunk
+        view = memoryview(chunk)
+        while view:
+            current = pos // BLOCK_SIZE
+            take = min(len(view), (current + 1) * BLOCK_SIZE - pos)
+            if index == current:
+                block += view[:take]
+            pos += take
+            view = view[take:]
+            if pos % BLOCK_SIZE == 0 or pos == size:
+                if index == current:
+                    cache.put(key, index, bytes(block))
+                    MEDIA_CACHE_BYTES.set(cache.bytes)
+                block = bytearray()
+                index = current + 1
+
+
+def serve_cached(cache, key, acc_token, start, end):
+    """Yield bytes `start`-`end` from cached blocks, then from Drive at the first miss."""
+    hits = misses = 0
+    pos = start
+    try:
+        while pos <= end:
+            index = pos // BLOCK_SIZE
+            block = cache.get(key, index)
+            if block is None:
+                misses += 1
+                media = fetch_upstream(key[0], acc_token, f"bytes={pos}-{end}", cache, key)
+                if media.status == 206:
+                    yield from media.body
+                else:
+                    media.body.close()
+                return
+            hits += 1
+            with block:
+                block_end = min(len(block), end - index * BLOCK_SIZE + 1)
+                offset = pos - index * BLOCK_SIZE
+                while offset < block_end:
+                    chunk = block[offset : min(block_end, offset + CHUNK_SIZE)]
+                    offset += len(chunk)
+                    yield chunk
+            pos = index * BLOCK_SIZE + block_end
+    finally:
+        count_blocks(hits, misses)
+
+
+def read_ahead(cache, key, acc_token, first):
+    """Fetch up to READ_AHEAD_BLOCKS blocks from block `first` in the background."""
+    size = cache.file_info(key)[0]
+    last = min(first + READ_AHEAD_BLOCKS, -(-size // BLOCK_SIZE)) - 1
+    while first <= last and (key, first) in cache:
+        first += 1
+    while last >= first and (key, last) in cache:
+        last -= 1
+    if first > last:
+        return
+    with _cache_lock:
+        if (key, first) in _reading_ahead:
+            return
+        _reading_ahead.add((key, first))
+
+    def run():
+        try:
+            range_header = f"bytes={first * BLOCK_SIZE}-{min((last + 1) * BLOCK_SIZE, size) - 1}"
+            media = fetch_upstream(key[0], acc_token, range_header, cache, key)
+            for _ in media.body:
+                pass
+        except Exception as e:
+            logger.warning("Read-ahead of %s failed: %s", key[0], e)
+        finally:
+            with _cache_lock:
+                _reading_ahead.discard((key, first))
+
+    _read_ahead.submit(run)
+
+
+def count_blocks(hits, misses):
+    metrics.CACHE_REQUESTS.inc(hits, cache="media", result="hit")
+    metrics.CACHE_REQUESTS.inc(misses, cache="media", result="miss")
+    with _cache_lock:
+        _block_counts[0] += hits
+        _block_counts[1] += misses
+        total = sum(_block_counts)
+        if total:
+            MEDIA_CACHE_HIT_RATIO.set(_block_counts[0] / total)
@@ -1,30 +1,58 @@
-import PTN
-
-
-class parse_title:
-    def __init__(self, name):
-        ptn_dict = PTN.parse(name)
-        key_list = [
-            "resolution",
-            "codec",
-            "season",
-            "episode",
-            "bitDepth",
-            "audio",
-            "quality",
-            "encoder",
-            "title",
-            "year",
-            "remux",
-        ]
-
-        for key in key_list:
-            setattr(self, key, ptn_dict.get(key))
-
-        # Write REMUX instead of Blu-Ray
-        self.quality = "REMUX" if self.remux else self.quality
-
-        self.sortkeys = {
+import threading
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+# PTN.parse() goes through one module-level parser that keeps its working
+# state on the instance, so concurrent parses corrupt each other. Give each
+# thread its own parser instead.
+_local = threading.local()
+
+
+def _ptn_parse(name):
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        # Imported on first use: PTN compiles its patterns at import time.
+        import PTN
+
+        parser = _local.parser = PTN.PTN()
+    return parser.parse(name, standardise=True, coherent_types=False)
+
+
+class ParsedRelease(NamedTuple):
+    """The fields we care about from a PTN parse of a release name.
+
+    A plain tuple: one of these is kept per Drive hit, so it stays compact
+    and never grows a per-instance __dict__.
+    """
+
+    title: Optional[str] = None
+    year: Optional[int] = None
+    season: Optional[int] = None
+    episode: Optional[int] = None
+    resolution: Optional[str] = None
+    codec: Optional[str] = None
+    quality: Optional[str] = None
+    audio: Optional[str] = None
+    encoder: Optional[str] = None
+    bitDepth: Optional[int] = None
+    remux: Optional[bool] = None
+
+    @property
+    def se(self):
+        return self.season
+
+    @property
+    def ep(self):
+        return self.episode
+
+    @property
+    def res(self):
+        return self.resolution
+
+    @property
+    def sortkeys(self):
+        """The legacy sort-key view, built on demand rather than stored."""
+        return {
             "se": self.season,
             "ep": self.episode,
             "res": self.resolution,
@@ -47,11 +75,25 @@ class parse_title:
         return formatted
 
     def get_str(self, format):
-        self.formatted = ""
+        formatted = ""
 
         for segment in format.split():
             if len(segment.split(";")) > 1:
-                self.formatted += self.get_val(segment, ";")
+                formatted += self.get_val(segment, ";")
             else:
-                self.formatted += self.get_val(segment, " ")
-        return self.formatted
+                formatted += self.get_val(segment, " ")
+        return formatted
+
+
+# PTN runs a few hundred regexes per name, and the same release is often
+# present on several drives, so identical names are only parsed once.
+@lru_cache(maxsize=4096)
+def parse_title(name):
+    ptn_dict = _ptn_parse(name)
+    fields = {key: ptn_dict.get(key) for key in ParsedRelease._fields}
+
+    # Write REMUX instead of Blu-Ray
+    if fields["remux"]:
+        fields["quality"] = "REMUX"
+
+    return ParsedRelease(**fields)
@@ -0,0 +1,148 @@
+"""How often each part of a Drive search query turns up a stream.
+
+Series queries OR together several spellings of the episode (the clause
+templates in EPISODE_MARKERS), and every query is repeated for each title
+of the metadata, which come from TMDB, Cinemeta, IMDb suggest and the IMDb
+AKA page. After a search that validated at least one stream, each clause
+template and each title source is counted as searched, and as a hit if a
+validated file name matches it (the way Drive's ``name contains`` would).
+The counts are kept in /tmp/querystats.json and exported as metrics.
+
+With QUERY_PRUNING on, get_query leaves out the clauses and title sources
+seen in at least QUERY_PRUNE_MIN_SAMPLES searches whose hit rate is below
+QUERY_PRUNE_THRESHOLD. The primary title and at least one clause are
+always kept. Pruned parts are still counted, from what the rest of the
+query found, so one that starts matching again comes back.
+"""
+
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+
+from sgd import metrics
+from sgd.cache import Json
+from sgd.utils import query_words, strip_accents
+
+logger = logging.getLogger(__name__)
+
+# Spellings of season `se` / episode `ep` (zero padded) and `s` / `e`
+# (unpadded) searched for in series file names, in query order.
+EPISODE_MARKERS = (
+    "S{se}E{ep}",
+    "s{se} e{ep}",
+    "s{s} e{e}",
+    "season {s} episode {e}",
+    '"{s} x {e}"',
+    '"{s} x {ep}"',
+)
+
+QUERY_PRUNING = os.environ.get("QUERY_PRUNING", "").lower() in ("1", "true", "yes")
+QUERY_PRUNE_THRESHOLD = float(os.environ.get("QUERY_PRUNE_THRESHOLD", 0.02))
+QUERY_PRUNE_MIN_SAMPLES = int(os.environ.get("QUERY_PRUNE_MIN_SAMPLES", 100))
+# The counts are written out at most this often (seconds).
+SAVE_INTERVAL = 60
+
+QUERY_PART_SEARCHES = metrics.counter(
+    "sgd_query_part_searches_total",
+    "Successful searches by query clause template or title source, and whether it matched a stream.",
+    ["kind", "name", "result"],
+)
+
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def episode_marker(template, se, ep):
+    return template.format(se=se, ep=ep, s=int(se), e=int(ep))
+
+
+def name_words(name):
+    return WORD.findall(strip_accents(name.lower()))
+
+
+def contains(words, phrase):
+    """Whether ``name contains '<phrase>'`` matches a name of `words`.
+
+    Like Drive: the phrase's words in a row, the last one as a prefix.
+    """
+    terms = name_words(phrase)
+    if not terms:
+        return False
+    *head, last = terms
+    for i in range(len(words) - len(head)):
+        if words[i : i + len(head)] == head and words[i + len(head)].startswith(last):
+            return True
+    return False
+
+
+def matches_title(words, terms):
+    """Whether a title query for `terms` (see query_words) matches `words`."""
+    return bool(terms) and all(contains(words, term) for term in terms)
+
+
+class QueryStats:
+    def __init__(self, filename="querystats.json", clock=time.monotonic):
+        self.filename = filename
+        self.clock = clock
+        self._cache = None
+        self._saved_at = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def counts(self):
+        """``{kind: {name: [searches, hits]}}``, loaded on first use."""
+        if self._cache is None:
+            self._cache = Json(self.filename)
+            self._cache.contents.setdefault("clause", {})
+            self._cache.contents.setdefault("source", {})
+        return self._cache.contents
+
+    def add(self, kind, name, hit):
+        entry = self.counts[kind].setdefault(name, [0, 0])
+        entry[0] += 1
+        entry[1] += int(hit)
+        QUERY_PART_SEARCHES.inc(kind=kind, name=name, result="hit" if hit else "miss")
+
+    def rate(self, kind, name):
+        """``(searches, hit rate)`` of a clause template or title source."""
+        searches, hits = self.counts[kind].get(name, (0, 0))
+        return searches, (hits / searches if searches else 0.0)
+
+    def keep(self, kind, name):
+        """Whether get_query should still search for this part."""
+        if not QUERY_PRUNING or name is None:
+            return True
+        searches, rate = self.rate(kind, name)
+        return searches < QUERY_PRUNE_MIN_SAMPLES or rate >= QUERY_PRUNE_THRESHOLD
+
+    def record(self, stream_meta, candidates):
+        """Count the query parts the validated `candidates` of a search match."""
+        if not candidates:
+            return
+        names = [name_words(c.file.name) for c in candidates]
+        sources = {}
+        for title, source in getattr(stream_meta, "title_sources", {}).items():
+            sources.setdefault(source, []).append(query_words(title))
+
+        with self._lock:
+            if stream_meta.stream_type == "series":
+                for template in EPISODE_MARKERS:
+                    marker = episode_marker(template, stream_meta.se, stream_meta.ep)
+                    self.add("clause", template, any(contains(words, marker) for words in names))
+            for source, titles in sources.items():
+                hit = any(matches_title(words, terms) for words in names for terms in titles)
+                self.add("source", source, hit)
+
+            if self.clock() - self._saved_at >= SAVE_INTERVAL:
+                self.save()
+
+    def save(self):
+        if self._cache is not None:
+            self._cache.save()
+        self._saved_at = self.clock()
+
+
+stats = QueryStats()
+atexit.register(stats.save)
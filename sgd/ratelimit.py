@@ -0,0 +1,84 @@
+"""Client-side rate limiting for Drive API calls."""
+
+import threading
+import time
+
+from sgd import metrics
+
+RATE = metrics.gauge(
+    "sgd_rate_limit_per_second", "Current rate allowed by each rate limiter.", ["limiter"]
+)
+THROTTLED = metrics.counter(
+    "sgd_rate_limit_throttled_total", "Times upstream throttling lowered a limiter's rate.", ["limiter"]
+)
+SKIPPED = metrics.counter(
+    "sgd_rate_limit_skipped_total", "Acquires given up because the wait was longer than allowed.", ["limiter"]
+)
+
+
+class TokenBucket:
+    """A thread-safe token bucket whose rate adapts to upstream throttling.
+
+    ``rate`` tokens per second are added up to ``burst``. ``acquire(n)``
+    reserves n tokens at once, possibly going into debt, and sleeps until
+    the debt is paid, so a batch larger than the burst still goes through
+    and callers are served in order.
+
+    The rate backs off multiplicatively when the upstream throttles us and
+    recovers additively on success (AIMD), never going past ``rate`` or
+    below ``min_rate``.
+    """
+
+    def __init__(self, name, rate, burst, min_rate=None, clock=time.monotonic, sleep=time.sleep):
+        self.name = name
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate or max(rate / 20, 0.5))
+        self.rate = self.max_rate
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.clock = clock
+        self.sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+        RATE.set(self.rate, limiter=name)
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, n=1, max_wait=None):
+        """Take `n` tokens, sleeping until they're available. Returns the wait.
+
+        If that would take longer than `max_wait` seconds, no tokens are
+        taken and None is returned instead.
+        """
+        with self._lock:
+            self._refill()
+            wait = (n - self.tokens) / self.rate if self.tokens < n else 0.0
+            allowed = max_wait is None or wait <= max_wait
+            if allowed:
+                self.tokens -= n
+        if not allowed:
+            SKIPPED.inc(limiter=self.name)
+            return None
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    def throttled(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drop any saved-up burst: the upstream just told us to slow down.
+            self.tokens = min(self.tokens, 0.0)
+        THROTTLED.inc(limiter=self.name)
+        RATE.set(self.rate, limiter=self.name)
+
+    def succeeded(self):
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+        RATE.set(self.rate, limiter=self.name)
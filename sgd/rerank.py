@@ -0,0 +1,131 @@
+"""Broad Drive queries re-ranked locally (QUERY_MODE=broad).
+
+The usual search sends one strict query per title, every word of it
+required, so a title with dozens of AKAs costs dozens of Drive queries. In
+broad mode each title is instead covered by its rarest word, the words of
+all titles are ORed into a few queries, and the precise matching is done
+here: every file found is scored against all the titles at once with a
+trigram index, and the best ones go on to Streams' validation.
+
+How rare a word is comes from the file names of earlier broad searches
+(words seen in fewer names first), and from its length until then.
+"""
+
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+from sgd import metrics
+from sgd.utils import STOP_WORDS, strip_accents
+
+# Words ORed into one broad query, and files kept for validation.
+BROAD_QUERY_TOKENS = int(os.environ.get("BROAD_QUERY_TOKENS", 8))
+BROAD_MAX_RESULTS = int(os.environ.get("BROAD_MAX_RESULTS", 1000))
+# Share of a title's trigrams a file name must hold to be kept.
+BROAD_MIN_SCORE = float(os.environ.get("BROAD_MIN_SCORE", 0.8))
+# Distinct words whose name counts are kept (about 100 bytes each).
+MAX_TRACKED_WORDS = 200_000
+
+WORD = re.compile(r"[^\W_]+")
+
+# word -> number of broad search results whose name had it.
+word_counts = Counter()
+_word_counts_lock = threading.Lock()
+
+
+def words(string):
+    """Lowercased words of `string`, accents kept (Drive matches them as is)."""
+    return WORD.findall(string.lower())
+
+
+def title_words(title):
+    strong = [w for w in words(title) if w not in STOP_WORDS and (len(w) > 2 or w.isdigit())]
+    return strong or words(title)
+
+
+def rare_tokens(titles):
+    """A word of every title, the rarest one, skipping titles already covered.
+
+    A file named after any of the titles has one of these words, so
+    ``name contains`` queries on them find them all.
+    """
+    chosen = []
+    with _word_counts_lock:
+        for title in titles:
+            terms = title_words(title)
+            if not terms or any(t in chosen for t in terms):
+                continue
+            chosen.append(min(terms, key=lambda t: (word_counts[t], -len(t))))
+    return chosen
+
+
+def trigrams(string, strong=False):
+    """The trigrams of the words of `string`, space padded.
+
+    With `strong`, stop words are left out (unless there's nothing else).
+    """
+    terms = [strip_accents(w) for w in words(string)]
+    if strong:
+        terms = [w for w in terms if w not in STOP_WORDS] or terms
+    grams = set()
+    for w in terms:
+        padded = f" {w} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """An inverted trigram index over file names."""
+
+    def __init__(self, files):
+        self.files = files
+        self.postings = defaultdict(list)
+        for i, item in enumerate(files):
+            for gram in trigrams(item.name):
+                self.postings[gram].append(i)
+
+    def scores(self, titles):
+        """Per file, the best share of any title's trigrams its name holds."""
+        best = [0.0] * len(self.files)
+        for title in titles:
+            grams = trigrams(title, strong=True)
+            if not grams:
+                continue
+            hits = Counter()
+            for gram in grams:
+                hits.update(self.postings.get(gram, ()))
+            for i, n in hits.items():
+                best[i] = max(best[i], n / len(grams))
+        return best
+
+
+def rerank(files, stream_meta):
+    """The files of a broad search that are likely of `stream_meta`, best first."""
+    learn(files)
+    scores = TrigramIndex(files).scores(stream_meta.titles)
+    imdb_id = str(getattr(stream_meta, "id", "") or "").lower()
+
+    scored = []
+    for item, score in zip(files, scores):
+        # Streams accepts any file named with the id.
+        if imdb_id and imdb_id in item.name.lower():
+            score = 1.0
+        if score >= BROAD_MIN_SCORE:
+            scored.append((score, item))
+    scored.sort(key=lambda pair: (pair[0], pair[1].size), reverse=True)
+
+    kept = [item for _, item in scored[:BROAD_MAX_RESULTS]]
+    metrics.STAGE_RESULTS.inc(len(kept), stage="rerank")
+    return kept
+
+
+def learn(files):
+    """Count the words of `files`' names, to tell rare words from common ones."""
+    seen = Counter()
+    for item in files:
+        seen.update(set(words(item.name)))
+    with _word_counts_lock:
+        for word, n in seen.items():
+            if word in word_counts or len(word_counts) < MAX_TRACKED_WORDS:
+                word_counts[word] += n
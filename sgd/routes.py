@@ -1,11 +1,19 @@
+import os
 import re
+import hmac
+import json
 import logging
-from sgd import app, gdrive
-from sgd.meta import MetadataNotFound, Meta
-from sgd.streams import Streams
-from sgd.utils import split_stream_id
-from json import dumps
-from flask import jsonify, abort, Response, redirect
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sgd import app, compression, gdrive, httpcache, metrics, profiling, proxy, querystats
+from sgd.cache import TTLCache
+from sgd.encoder import StreamEncoder
+from sgd.gdrive import shared_batches
+from sgd.meta import MetadataNotFound, Meta, for_episode, title_id
+from sgd.popular import popular
+from sgd.singleflight import SingleFlight
+from sgd.streams import PlaybackUrls, Streams
+from sgd.utils import Deadline, normalize_stream_id, split_stream_id
+from flask import jsonify, abort, request, Response, redirect
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -15,6 +23,35 @@ logger = logging.getLogger(__name__)
 VALID_IMDB_ID = re.compile(r"^tt\d{5,10}$", re.IGNORECASE)
 VALID_SEASON_EPISODE = re.compile(r"^\d+$")
 
+stream_encoder = StreamEncoder()
+
+# Ranked candidates (no token-bearing urls) per (stream_type, stream id), so
+# re-opening a title skips metadata resolution, the Drive search and scoring.
+stream_cache = TTLCache(
+    maxsize=int(os.environ.get("STREAM_CACHE_SIZE", 1000)),
+    ttl=int(os.environ.get("STREAM_CACHE_TTL", 1800)),
+)
+
+# Stremio clients often fire the same stream request several times in a row,
+# and several users may open a new episode at once: identical in-flight
+# searches are run once and shared. Metadata is per title, so it's also
+# shared between requests for different episodes of a series.
+stream_flight = SingleFlight("streams")
+meta_flight = SingleFlight("meta")
+
+# Seconds a stream search may take before whatever has been validated so far
+# is returned as a partial response. Keep it below the client's addon
+# request timeout; 0 disables the budget.
+STREAM_TIME_BUDGET = float(os.environ.get("STREAM_TIME_BUDGET", 10))
+
+
+# POST /streams/batch: at most BATCH_MAX_IDS stream ids per request,
+# resolved BATCH_WORKERS at a time (per instance).
+BATCH_MAX_IDS = int(os.environ.get("BATCH_MAX_IDS", 50))
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BATCH_WORKERS", 16)), thread_name_prefix="sgd-batch"
+)
+
 
 def is_valid_stream_id(stream_id):
     parts = split_stream_id(stream_id)
@@ -59,7 +96,12 @@ def favicon():
 
 @app.route("/manifest.json")
 def addon_manifest():
-    return common_headers(jsonify(MANIFEST))
+    return cacheable_response(jsonify(MANIFEST).get_data(), httpcache.MANIFEST_CACHE.header())
+
+
+@app.route("/metrics")
+def addon_metrics():
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/stream/<stream_type>/<stream_id>.json")
@@ -70,43 +112,251 @@ def addon_stream(stream_type, stream_id):
 
     if invalid_stream_type or invalid_id:
         abort(404)
+    popular.seen(stream_type, stream_id)
     try:
-        resp = Response(
-            response=get_streams(stream_type, stream_id),
-            mimetype="application/json",
-        )
+        profile = profiling.should_profile(request.headers)
+        cached = None if profile else cached_streams(stream_type, stream_id)
+        if cached is not None:
+            # Known in full up front: cacheable, and answerable with a 304.
+            body, token_lifetime = cached
+            return cacheable_response(body, httpcache.stream_cache_control(token_lifetime))
+
+        chunks = get_streams(stream_type, stream_id)
+        if profile:
+            chunks = profiling.profile_stream(stream_type, stream_id, chunks)
+        encoding = compression.negotiate(request.headers.get("Accept-Encoding"))
+        if encoding:
+            chunks = compression.compress_stream(chunks, encoding)
+        resp = Response(response=chunks, mimetype="application/json")
+        resp.headers.update(compression.response_headers(encoding))
+        resp.headers["Cache-Control"] = httpcache.NO_STORE
         return common_headers(resp)
     except MetadataNotFound as e:
         logger.info("%s", e)
         abort(404)
 
 
+@app.route("/streams/batch", methods=["POST"])
+def addon_stream_batch():
+    items = parse_batch(request.get_json(silent=True))
+    if items is None:
+        abort(400)
+    resp = Response(response=batch_streams(items), mimetype="application/x-ndjson")
+    return common_headers(resp)
+
+
+@app.route("/load/<file_id>/<path:file_name>")
+def load_media(file_id, file_name):
+    # Off unless enabled: it plays any file the accounts can read.
+    if not proxy.enabled() or not proxy.VALID_FILE_ID.match(file_id):
+        abort(404)
+    try:
+        acc_token = gdrive.get_acc_token(request.args.get("account", 0, type=int))
+    except IndexError:
+        abort(404)
+
+    md5 = request.args.get("md5", "")
+    media = proxy.fetch(
+        file_id, acc_token, request.headers.get("Range"),
+        md5 if proxy.VALID_MD5.match(md5) else None,
+    )
+    resp = Response(media.body, status=media.status, headers=media.headers, direct_passthrough=True)
+    return common_headers(resp)
+
+
+@app.route("/admin/cache/purge", methods=["POST"])
+@app.route("/admin/cache/purge/<stream_id>", methods=["POST"])
+def admin_cache_purge(stream_id=None):
+    require_admin()
+
+    if stream_id is None:
+        purged = len(stream_cache)
+        stream_cache.clear()
+    else:
+        # Purging a bare id also drops every cached episode of that series.
+        norm_id = normalize_stream_id(stream_id)
+        purged = stream_cache.purge(
+            lambda key: key[1] == norm_id or key[1].startswith(f"{norm_id}:")
+        )
+
+    logger.info("Purged %d cached stream response(s) for %s", purged, stream_id or "*")
+    return jsonify({"purged": purged})
+
+
+@app.route("/admin/prewarm", methods=["GET", "POST"])
+def admin_prewarm():
+    """Warm the caches for the ids in the body (see prewarm.parse_ids), or
+    for the PREWARM_POPULAR most requested ones (e.g. from a cron's GET)."""
+    # Imported here: `python -m sgd.prewarm` runs it as __main__.
+    from sgd import prewarm
+
+    require_admin()
+
+    items = prewarm.parse_ids(request.get_data(as_text=True).splitlines())
+    if not items:
+        items = popular.top(request.args.get("popular", prewarm.PREWARM_POPULAR, type=int))
+    return jsonify(prewarm.warm(items, deadline=Deadline(prewarm.PREWARM_TIME_BUDGET)))
+
+
+def require_admin():
+    # Admin routes are disabled unless a secret is configured.
+    secret = os.environ.get("ADMIN_SECRET")
+    if not secret:
+        abort(404)
+    # Cron jobs (e.g. Vercel's) send it as a bearer token.
+    given = request.headers.get("X-Admin-Secret") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(given, secret):
+        abort(403)
+
+
+COMMON_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*",
+    "X-Robots-Tag": "noindex",
+}
+
+
 def common_headers(resp_obj):
-    resp_obj.headers["Access-Control-Allow-Origin"] = "*"
-    resp_obj.headers["Access-Control-Allow-Headers"] = "*"
-    resp_obj.headers["X-Robots-Tag"] = "noindex"
+    resp_obj.headers.update(COMMON_HEADERS)
     return resp_obj
 
 
+def cacheable_response(body, cache_control):
+    """A complete JSON body, compressed if worth it, with an ETag (or a 304)."""
+    encoding = compression.negotiate(request.headers.get("Accept-Encoding"), len(body))
+    resp = Response(response=compression.compress(body, encoding), mimetype="application/json")
+    resp.headers.update(compression.response_headers(encoding))
+    resp.set_etag(httpcache.etag(body, encoding))
+    resp.headers["Cache-Control"] = cache_control
+    return common_headers(resp.make_conditional(request))
+
+
 def get_streams(stream_type, stream_id):
     # Stream the response body so the connection stays open (and doesn't hit
     # a request timeout) while we search Drive and score the results.
-    yield '{"streams":'
+    yield b'{"streams":'
+
+    candidates, partial = find_streams(stream_type, stream_id)
+
+    yield from stream_encoder.iter_encode(candidates, PlaybackUrls(gdrive))
+    if partial:
+        # Tell the client not to hold on to an incomplete list.
+        yield b',"cacheMaxAge":0,"partial":true'
+    yield b"}"
+
+
+def cached_streams(stream_type, stream_id):
+    """``(body, token lifetime)`` of a stream response from the cache, or None.
+
+    The token lifetime is PlaybackUrls.token_lifetime() of the body.
+    """
+    candidates = stream_cache.get((stream_type, normalize_stream_id(stream_id)))
+    if candidates is None:
+        # find_streams counts the miss.
+        return None
+    metrics.cache_lookup("streams", True)
+    logger.info("Serving %d cached stream(s) for %s", len(candidates), stream_id)
+
+    urls = PlaybackUrls(gdrive)
+    body = b'{"streams":' + b"".join(stream_encoder.iter_encode(candidates, urls)) + b"}"
+    return body, urls.token_lifetime()
+
+
+def find_streams(stream_type, stream_id):
+    """``(candidates, partial)`` of a stream id, cached or searched for."""
+    cache_key = (stream_type, normalize_stream_id(stream_id))
+    candidates = stream_cache.get(cache_key)
+    metrics.cache_lookup("streams", candidates is not None)
+
+    if candidates is None:
+        deadline = Deadline(STREAM_TIME_BUDGET)
+        return stream_flight.do(cache_key, search_streams, stream_type, stream_id, deadline)
+    logger.info("Serving %d cached stream(s) for %s", len(candidates), stream_id)
+    return candidates, False
 
+
+def parse_batch(body):
+    """``[(stream_type, stream_id)]`` of a batch request body, or None.
+
+    The body is ``{"ids": [{"type": "series", "id": "tt0944947:1:2"}, ...]}``.
+    """
+    ids = body.get("ids") if isinstance(body, dict) else None
+    if not isinstance(ids, list) or not ids or len(ids) > BATCH_MAX_IDS:
+        return None
+    items = []
+    for item in ids:
+        if not isinstance(item, dict) or not all(isinstance(item.get(k), str) for k in ("type", "id")):
+            return None
+        items.append((item["type"], item["id"]))
+    # A repeated id is answered once.
+    return list(dict.fromkeys(items))
+
+
+def batch_streams(items):
+    """A batch response: one NDJSON line per stream id, as each completes."""
+    futures = [batch_executor.submit(batch_line, stream_type, stream_id) for stream_type, stream_id in items]
+    for future in as_completed(futures):
+        yield future.result()
+
+
+def batch_line(stream_type, stream_id):
+    """The NDJSON line of one id of a batch request.
+
+    Like a stream response, with the id's "type" and "id", or an "error"
+    for an invalid or unknown id. Concurrent ids share Drive batches.
+    """
+    head = json.dumps({"type": stream_type, "id": stream_id})[:-1].encode()
+    if stream_type not in MANIFEST["types"] or not is_valid_stream_id(stream_id):
+        return head + b',"error":"invalid id"}\n'
+    try:
+        with shared_batches():
+            candidates, partial = find_streams(stream_type, stream_id)
+    except MetadataNotFound as e:
+        logger.info("%s", e)
+        return head + b',"streams":[],"error":"not found"}\n'
+    except Exception as e:
+        logger.warning("Batch stream search for %s failed: %s", stream_id, e)
+        return head + b',"streams":[],"error":"failed"}\n'
+
+    streams = b"".join(stream_encoder.iter_encode(candidates, PlaybackUrls(gdrive)))
+    tail = b',"partial":true}\n' if partial else b"}\n"
+    return head + b',"streams":' + streams + tail
+
+
+def search_streams(stream_type, stream_id, deadline=None):
+    """Resolve metadata, search Drive and cache the ranked candidates.
+
+    Returns ``(candidates, partial)``; `partial` is True when the time
+    budget cut the metadata lookup or the Drive search short.
+    """
     start_time = datetime.now()
     time_taken = lambda st: f"{(datetime.now() - st).total_seconds():.3f}s"
+    cache_key = (stream_type, normalize_stream_id(stream_id))
 
-    stream_meta = Meta(stream_type, stream_id)
-    gdrive.search(stream_meta)
+    with metrics.timed("meta"):
+        stream_meta = meta_flight.do(
+            (stream_type, title_id(stream_id)), Meta, stream_type, stream_id, deadline
+        )
+    # The leader's lookup was for its own episode.
+    stream_meta = for_episode(stream_meta, stream_id)
+    with metrics.timed("drive_search"):
+        search = gdrive.search(stream_meta, deadline)
     logger.info(
         "Got %d/%d unique results from gdrive after deduping in %s. Scoring results...",
-        len(gdrive.results), gdrive.len_response, time_taken(start_time),
+        len(search.results), search.len_response, time_taken(start_time),
     )
-    streams = Streams(gdrive, stream_meta)
+    streams = Streams(search, stream_meta)
+    partial = search.partial or getattr(stream_meta, "partial", False)
     logger.info(
-        "Fetched %d/%d valid stream(s) in %s for %s -> %s",
-        len(streams.results), len(gdrive.results), time_taken(start_time),
-        stream_id, gdrive.query,
+        "Fetched %d/%d valid stream(s)%s in %s for %s -> %s",
+        len(streams.results), len(search.results), " (partial)" if partial else "",
+        time_taken(start_time), stream_id, search.query,
     )
 
-    yield f"{dumps(streams.results)}}}"
+    candidates = tuple(streams.results)
+    querystats.stats.record(stream_meta, candidates)
+    # Don't pin an empty or partial result: it may just be a transient Drive
+    # error or a slow upstream.
+    if candidates and not partial:
+        stream_cache.set(cache_key, candidates)
+    return candidates, partial
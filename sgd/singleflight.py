@@ -0,0 +1,77 @@
+import threading
+
+from sgd import metrics
+
+CALLS = metrics.counter(
+    "sgd_singleflight_calls_total",
+    "Computations actually run, per flight.",
+    ["flight"],
+)
+COALESCED = metrics.counter(
+    "sgd_singleflight_coalesced_total",
+    "Callers that waited on an identical in-flight computation instead of running it.",
+    ["flight"],
+)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError("the in-flight call didn't finish in time")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one computation.
+
+    The first caller for a key (the leader) runs it; callers arriving while
+    it's in flight block and get the leader's result, or its exception.
+    Nothing is remembered once the call completes - that's what the caches
+    are for.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Return ``(call, is_leader)``; a leader must later `release` the call."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                COALESCED.inc(flight=self.name)
+                return call, False
+            call = self._calls[key] = _Call()
+        CALLS.inc(flight=self.name)
+        return call, True
+
+    def release(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.error = error
+        call.done.set()
+
+    def do(self, key, fn, *args, **kwargs):
+        call, is_leader = self.acquire(key)
+        if not is_leader:
+            return call.wait()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.release(key, call, error=e)
+            raise
+        self.release(key, call, result)
+        return result
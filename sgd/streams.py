@@ -2,68 +2,169 @@ import os
 import logging
 import urllib
 import re
-from sgd.ptn import parse_title
+from time import perf_counter
+from typing import NamedTuple, Optional
+from sgd import metrics
+from sgd.gdrive import DRIVE_API_URL, DriveFile
+from sgd.ptn import ParsedRelease, parse_title
 from sgd.utils import hr_size, strip_accents, STOP_WORDS
 
 logger = logging.getLogger(__name__)
 
 
+class Candidate(NamedTuple):
+    """A validated Drive file together with its Stremio stream fields.
+
+    Candidates never hold the playback url: it embeds a short-lived access
+    token, so PlaybackUrls stamps it on when the response is encoded. That
+    keeps ranked candidates safe to cache and reuse across requests.
+    """
+
+    file: DriveFile
+    parsed: ParsedRelease
+    name: str = ""
+    title: str = ""
+    behavior_hints: Optional[dict] = None
+
+
+class PlaybackUrls:
+    """Playback url and proxy headers for the files of one response.
+
+    Each file is played with the access token of the account it was found
+    with. Tokens for the accounts of `candidates` are fetched up front (so
+    an async caller can do it off the event loop), any other on first use.
+    """
+
+    def __init__(self, gdrive, candidates=()):
+        self.gdrive = gdrive
+        self.proxy_url = os.environ.get("CF_PROXY_URL")
+        # account -> (epoch, proxy headers), shared by its files
+        self._accounts = {}
+        # account -> seconds its token has left
+        self._expires_in = {}
+
+        if self.proxy_url:
+            self.stream_url = self.get_proxy_url
+        else:
+            self.stream_url = self.get_gapi_url
+
+        for account in {c.file.account for c in candidates}:
+            self._account(account)
+
+    def _account(self, account):
+        entry = self._accounts.get(account)
+        if entry is None:
+            if self.proxy_url:
+                entry = (self.proxy_url, {"request": {"Server": "Stremio"}})
+            else:
+                acc_token = self.gdrive.get_acc_token(account)
+                self._expires_in[account] = self.gdrive.token_expires_in(account)
+                # Encoded streams stay valid for as long as the token does.
+                entry = (acc_token, {"request": {"Authorization": f"Bearer {acc_token}"}})
+            self._accounts[account] = entry
+        return entry
+
+    def token_lifetime(self):
+        """Seconds until the first token used so far expires, or None if none was."""
+        return min(self._expires_in.values(), default=None)
+
+    def epoch(self, file):
+        return self._account(file.account)[0]
+
+    def proxy_headers(self, file):
+        return self._account(file.account)[1]
+
+    def get_proxy_url(self, file):
+        file_name = urllib.parse.quote(file.name) or "file_name.vid"
+        # The addon's own /load route plays other accounts' files with their
+        # token, and keys its media cache on the md5; cf_proxy.js ignores
+        # the query string.
+        query = {}
+        if file.account:
+            query["account"] = file.account
+        if file.md5:
+            query["md5"] = file.md5
+        query = f"?{urllib.parse.urlencode(query)}" if query else ""
+        return f"{self.proxy_url}/load/{file.id}/{file_name}{query}"
+
+    def get_gapi_url(self, file):
+        file_name = urllib.parse.quote(file.name) or "file_name.vid"
+        return f"{DRIVE_API_URL}/drive/v3/files/{file.id}?alt=media&file_name={file_name}"
+
+
+def count_valid(files, stream_meta):
+    """How many of `files` Streams would keep for `stream_meta`.
+
+    Only validates: no stream is built and no metric recorded, so a search
+    can check its progress between stages.
+    """
+    checker = Streams.__new__(Streams)
+    checker.strm_meta = stream_meta
+    count = 0
+    for item in files:
+        try:
+            checker.item = item
+            count += checker.is_match(parse_title(item.name))
+        except Exception as e:
+            logger.warning("Failed to validate drive item %r: %s", getattr(item, "name", item), e)
+    return count
+
+
 class Streams:
     def __init__(self, gdrive, stream_meta):
         self.results = []
         self.gdrive = gdrive
         self.strm_meta = stream_meta
-        self.get_url = self.get_proxy_url
-        self.proxy_url = os.environ.get("CF_PROXY_URL")
 
-        if not self.proxy_url:
-            self.get_url = self.get_gapi_url
-            self.acc_token = gdrive.get_acc_token()
+        # Per-item stage times are summed and recorded once per request, so
+        # the metrics cost a few clock reads per item, not a histogram update.
+        parse_time = match_time = format_time = 0.0
 
         for item in getattr(gdrive, 'results', []):
             try:
                 self.item = item
-                if not isinstance(self.item, dict):
+                start = perf_counter()
+                self.parsed = parse_title(item.name)
+                parsed_at = perf_counter()
+                parse_time += parsed_at - start
+
+                is_match = self.is_match(self.parsed)
+                matched_at = perf_counter()
+                match_time += matched_at - parsed_at
+                if not is_match:
                     continue
-                    
-                self.parsed = parse_title(str(self.item.get("name", "")))
-                
-                # Hardening: Previne quebra se o parse_title falhar
-                if self.parsed is None:
-                    class DummyParsed: pass
-                    self.parsed = DummyParsed()
-                
-                if not hasattr(self.parsed, 'sortkeys') or not isinstance(getattr(self.parsed, 'sortkeys', None), dict):
-                    self.parsed.sortkeys = {}
 
-                self.construct_stream()
-                
-                # --- FILTRO INTELIGENTE ---
-                if self.is_semi_valid_title(self.constructed):
-                    strm_type = getattr(self.strm_meta, 'type', '')
-                    if strm_type == "movie":
-                        if self.is_valid_year(self.constructed):
-                            self.results.append(self.constructed)
-                    elif strm_type == "series":
-                        # VERIFICAÇÃO CRUCIAL: Bloqueia vazamentos de outras temporadas/episódios
-                        if self.is_valid_episode(self.constructed):
-                            self.results.append(self.constructed)
-                    else:
-                        self.results.append(self.constructed)
-                    
+                self.results.append(self.construct_stream())
+                format_time += perf_counter() - matched_at
+
             except Exception as e:
-                logger.warning("Failed to process drive item %r: %s", item.get("name"), e)
+                logger.warning("Failed to process drive item %r: %s", getattr(item, "name", item), e)
                 continue
 
         # Ordenação inteligente
-        self.results.sort(key=self.best_res, reverse=True)
+        with metrics.timed("rank"):
+            self.results.sort(key=self.best_res, reverse=True)
 
-    def is_valid_year(self, movie):
-        sortkeys = movie.get("sortkeys", {})
-        if not isinstance(sortkeys, dict): 
-            sortkeys = {}
-            
-        file_year_str = str(sortkeys.get("year", "0"))
+        metrics.STAGE_SECONDS.observe(parse_time, stage="parse")
+        metrics.STAGE_SECONDS.observe(match_time, stage="match")
+        metrics.STAGE_SECONDS.observe(format_time, stage="format")
+        metrics.STAGE_RESULTS.inc(len(self.results), stage="match")
+
+    def is_match(self, parsed):
+        # --- FILTRO INTELIGENTE ---
+        if not self.is_semi_valid_title(parsed):
+            return False
+
+        strm_type = getattr(self.strm_meta, 'type', '')
+        if strm_type == "movie":
+            return self.is_valid_year(parsed)
+        if strm_type == "series":
+            # VERIFICAÇÃO CRUCIAL: Bloqueia vazamentos de outras temporadas/episódios
+            return self.is_valid_episode(parsed)
+        return True
+
+    def is_valid_year(self, parsed):
+        file_year_str = str(parsed.year or "0")
         meta_year_str = str(getattr(self.strm_meta, 'year', '0'))
 
         if file_year_str == "0" or not file_year_str.isdigit():
@@ -76,16 +177,12 @@ class Streams:
         except (TypeError, ValueError):
             return True
 
-    def is_valid_episode(self, item):
-        sortkeys = item.get("sortkeys", {})
-        if not isinstance(sortkeys, dict): 
-            sortkeys = {}
-            
-        file_se = sortkeys.get("se")
-        file_ep = sortkeys.get("ep")
-        
+    def is_valid_episode(self, parsed):
+        file_se = parsed.season
+        file_ep = parsed.episode
+
         if file_se is None or file_ep is None:
-            file_name = str(self.item.get("name", "")).lower()
+            file_name = self.item.name.lower()
             match = re.search(r's(\d+)\s*e(\d+)', file_name)
             if match:
                 file_se, file_ep = match.groups()
@@ -97,8 +194,8 @@ class Streams:
         except (ValueError, TypeError, AttributeError):
             return False
 
-    def is_semi_valid_title(self, item):
-        file_name_raw = str(self.item.get("name", ""))
+    def is_semi_valid_title(self, parsed):
+        file_name_raw = self.item.name
 
         imdb_id = getattr(self.strm_meta, "id", None)
         if imdb_id and str(imdb_id).lower() in file_name_raw.lower():
@@ -132,10 +229,7 @@ class Streams:
                 # else: single-letter noise - drop it.
             return " ".join(result)
 
-        sortkeys = item.get("sortkeys", {})
-        if not isinstance(sortkeys, dict):
-            sortkeys = {}
-        ptn_title = sortkeys.get("title", "")
+        ptn_title = parsed.title or ""
 
         ALLOWED_EXTRAS = {
             "filme", "movie", "series", "serie", "temporada", "season",
@@ -225,22 +319,15 @@ class Streams:
         return False
 
     def get_title(self, res_raw):
-        file_name = str(self.item.get("name", "Unknown"))
+        file_name = self.item.name or "Unknown"
         name_upper = file_name.upper()
-        
-        try:
-            file_size_raw = self.item.get("size", 0)
-            file_size = hr_size(int(file_size_raw)) if file_size_raw else "0B"
-        except Exception:
-            file_size = "0B"
+        file_size = hr_size(self.item.size) if self.item.size else "0B"
 
         # Codec
         if any(x in name_upper for x in ["AV1", "AV01"]): codec = "AV1"
         elif any(x in name_upper for x in ["HEVC", "X265", "H265", "H.265"]): codec = "H.265"
         elif any(x in name_upper for x in ["AVC", "X264", "H264", "H.264"]): codec = "H.264"
-        else: 
-            sortkeys = getattr(self.parsed, 'sortkeys', {})
-            codec = sortkeys.get("codec", "CODEC?") if isinstance(sortkeys, dict) else "CODEC?"
+        else: codec = "CODEC?"
 
         # --- NOVO: Captura o serviço de Streaming ---
         streaming = ""
@@ -323,9 +410,7 @@ class Streams:
         else: res_display = "SD"
 
         # Nome Limpo (Fallback via PTN)
-        keys = getattr(self.parsed, 'sortkeys', {})
-        if not isinstance(keys, dict): keys = {}
-        title_clean = keys.get("title") or "Titulo"
+        title_clean = self.parsed.title or "Titulo"
 
         # 1. Título PT-BR vem do nome principal do metadado (IMDb/TMDB).
         # Só cai pro título extraído do nome do arquivo se a metadata não
@@ -352,12 +437,12 @@ class Streams:
             else:
                 titulo_original = titulo_pt # Último recurso: repete o título PT
 
-        ano_meta = getattr(self.strm_meta, 'year', keys.get("year", ""))
+        ano_meta = getattr(self.strm_meta, 'year', self.parsed.year or "")
 
         if getattr(self.strm_meta, 'type', '') == "series":
             try:
-                s = int(keys.get("season", keys.get("se", 0)))
-                e = int(keys.get("episode", keys.get("ep", 0)))
+                s = int(self.parsed.season or 0)
+                e = int(self.parsed.episode or 0)
                 sufixo = f"– S{s:02}E{e:02}"
             except (TypeError, ValueError):
                 sufixo = ""
@@ -376,35 +461,8 @@ class Streams:
 
         return f"{line3}\n{line1}\n{line2}"
 
-    def get_proxy_url(self):
-        file_id = str(self.item.get("id", ""))
-        file_name = urllib.parse.quote(str(self.item.get("name", ""))) or "file_name.vid"
-        if "behaviorHints" not in self.constructed:
-             self.constructed["behaviorHints"] = {}
-        self.constructed["behaviorHints"]["proxyHeaders"] = {
-            "request": {"Server": "Stremio"}
-        }
-        return f"{self.proxy_url}/load/{file_id}/{file_name}"
-
-    def get_gapi_url(self):
-        file_id = str(self.item.get("id", ""))
-        file_name = urllib.parse.quote(str(self.item.get("name", ""))) or "file_name.vid"
-        if "behaviorHints" not in self.constructed:
-             self.constructed["behaviorHints"] = {}
-        self.constructed["behaviorHints"]["proxyHeaders"] = {
-            "request": {"Authorization": f"Bearer {getattr(self, 'acc_token', '')}"}
-        }
-        return f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media&file_name={file_name}"
-
     def construct_stream(self):
-        self.constructed = {}
-        self.constructed["behaviorHints"] = {}
-        self.constructed["behaviorHints"]["notWebReady"] = True
-        
-        keys = getattr(self.parsed, 'sortkeys', {})
-        if not isinstance(keys, dict): keys = {}
-        res_raw = str(keys.get("res", ""))
-        self.constructed["behaviorHints"]["bingeGroup"] = f"gdrive-{res_raw}"
+        res_raw = str(self.parsed.resolution or "")
 
         res_lower = res_raw.lower()
         if "2160" in res_lower: res_nome_topo = "[4k]"
@@ -412,23 +470,25 @@ class Streams:
         elif "720" in res_lower: res_nome_topo = "[HD]"
         else: res_nome_topo = res_raw or "[SD]"
 
-        self.constructed["filename"] = str(self.item.get("name", ""))
-        self.constructed["url"] = self.get_url()
-        self.constructed["name"] = f"▶️ Stream Helium {res_nome_topo} 🇧🇷"
-        self.constructed["title"] = self.get_title(res_raw)
-        self.constructed["sortkeys"] = keys
-
+        self.constructed = Candidate(
+            file=self.item,
+            parsed=self.parsed,
+            name=f"▶️ Stream Helium {res_nome_topo} 🇧🇷",
+            title=self.get_title(res_raw),
+            behavior_hints={
+                "notWebReady": True,
+                "bingeGroup": f"gdrive-{res_raw}",
+            },
+        )
         return self.constructed
 
     def best_res(self, item):
         try:
             score = 0
-            file_name = str(item.get("filename", "")).upper()
-            sortkeys = item.get("sortkeys", {})
-            if not isinstance(sortkeys, dict): sortkeys = {}
+            file_name = item.file.name.upper()
 
             # 1. Resolução
-            res_raw = str(sortkeys.get("res", "")).upper()
+            res_raw = str(item.parsed.resolution or "").upper()
             if "2160" in res_raw or "4K" in res_raw or "2160P" in file_name or "4K" in file_name: score += 1000000000
             elif "1080" in res_raw or "FHD" in res_raw or "1080P" in file_name: score += 800000000
             elif "720" in res_raw or "HD" in res_raw or "720P" in file_name: score += 600000000
@@ -1,7 +1,9 @@
 import json
 import logging
+import time
 import unicodedata
 import requests
+from sgd import cassette, metrics
 from sgd.cache import Pickle
 
 logger = logging.getLogger(__name__)
@@ -16,6 +18,30 @@ STOP_WORDS = {
 }
 
 
+class Deadline:
+    """A time budget shared by every stage of one request.
+
+    `seconds` of None or 0 means no budget: nothing ever runs out.
+    """
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.expires = clock() + seconds if seconds else None
+
+    def remaining(self):
+        if self.expires is None:
+            return float("inf")
+        return max(0.0, self.expires - self.clock())
+
+    def allows(self, seconds):
+        """Whether at least `seconds` of the budget are left."""
+        return self.remaining() >= seconds
+
+    def timeout(self):
+        """`remaining()` as a timeout argument: None when there's no budget."""
+        return None if self.expires is None else self.remaining()
+
+
 def split_stream_id(stream_id):
     """Split a Stremio stream id ("tt1234567:1:2") into its parts.
 
@@ -28,6 +54,46 @@ def split_stream_id(stream_id):
     return stream_id.split(":")
 
 
+def normalize_stream_id(stream_id):
+    """Canonical form of a stream id, for use as a cache key.
+
+    "TT1234567%3A01%3A2" and "tt1234567:1:2" name the same episode.
+    """
+    parts = split_stream_id(stream_id)
+    return ":".join(
+        str(int(part)) if part.isdigit() else part.lower() for part in parts
+    )
+
+
+def query_words(string, splitter=" "):
+    """The words of `string` a Drive query searches for (see GoogleDrive.qgen)."""
+    cleaned_string = string.replace(".", " ").replace("'", " ").replace(":", " ").replace("-", " ")
+    cleaned_string = " ".join(cleaned_string.split())
+
+    raw_words = [w for w in cleaned_string.split(splitter) if w]
+    # For very short titles, a single-letter word (e.g. the "D" in
+    # "Dia D") is often essential, not noise - dropping it turns a
+    # distinctive title into a much more common word and makes the
+    # Drive query match far too many unrelated files. Only drop
+    # 1-letter words when there's enough other content to stay
+    # specific.
+    if len(raw_words) <= 2:
+        all_words = raw_words
+    else:
+        all_words = [w for w in raw_words if len(w) > 1 or w.isdigit()]
+
+    strong_words = [w for w in all_words if w.lower() not in STOP_WORDS]
+
+    if len(strong_words) <= 1:
+        final_words = all_words
+    else:
+        final_words = strong_words
+
+    if not final_words:
+        final_words = all_words
+    return final_words
+
+
 def strip_accents(string):
     """Remove diacritics, e.g. 'ação' -> 'acao'."""
     return "".join(
@@ -75,6 +141,10 @@ def sanitize(string, valid_chars=". ", lower=True):
 
 
 def req_wrapper(url, time_out=3):
+    recorder = cassette.active()
+    if recorder is not None and recorder.replaying:
+        return recorder.replay(url, time_out)
+
     timeout = requests.exceptions.Timeout
     conn_err = requests.exceptions.ConnectionError
 
@@ -89,18 +159,22 @@ def req_wrapper(url, time_out=3):
             "(KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36"
         }
 
+    start = time.perf_counter()
     try:
         result = req_session.get(f"https://{url}", timeout=time_out).text
         cached_session.contents = req_session
         cached_session.save()
-        return result
     except (timeout, conn_err) as e:
         logger.warning("Request to %s failed: %s", url, e)
-        return ""
+        metrics.UPSTREAM_ERRORS.inc(upstream=url.split("/")[0])
+        result = ""
+    if recorder is not None:
+        recorder.record(url, result, time.perf_counter() - start)
+    return result
 
 
-def req_api(url, key="meta"):
-    r = req_wrapper(url)
+def req_api(url, key="meta", time_out=3):
+    r = req_wrapper(url, time_out=time_out)
     if not r:
         return dict()
     try:
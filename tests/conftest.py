@@ -1,10 +1,11 @@
 import os
 
-# sgd/__init__.py builds a GoogleDrive client at import time and requires a
+# sgd/__init__.py creates a GoogleDrive client at import time and requires a
 # valid-looking TOKEN env var to do so. Set a fake one before any `sgd.*`
-# module is imported by the test suite. This doesn't hit the network:
-# `Credentials.from_authorized_user_info` and the Drive `build()` call only
-# need well-formed fields, not real credentials.
+# module is imported by the test suite. This doesn't hit the network: the
+# Drive service is only built on first use, and even then
+# `Credentials.from_authorized_user_info` and `build()` only need
+# well-formed fields, not real credentials.
 os.environ.setdefault(
     "TOKEN",
     '{"token": "fake", "refresh_token": "fake", '
@@ -12,3 +13,127 @@ os.environ.setdefault(
     '"client_id": "fake.apps.googleusercontent.com", "client_secret": "fake", '
     '"scopes": ["https://www.googleapis.com/auth/drive"]}',
 )
+
+
+# Imported only after TOKEN is set above.
+import threading  # noqa: E402
+from types import SimpleNamespace  # noqa: E402
+
+import pytest  # noqa: E402
+
+import sgd.routes as routes  # noqa: E402
+from sgd import token  # noqa: E402
+from sgd.gdrive import DriveFile, DriveSearch, GoogleDrive  # noqa: E402
+from sgd.ratelimit import TokenBucket  # noqa: E402
+from sgd.singleflight import SingleFlight  # noqa: E402
+
+
+class FakeGDrive:
+    """Stands in for the module-level GoogleDrive used by the routes."""
+
+    def __init__(self):
+        self.searches = 0
+        self.partial = False
+        self.token_lifetime = 3600
+
+    def search(self, stream_meta, deadline=None):
+        self.searches += 1
+        results = [DriveFile(
+            id="file1", name="Pirates.of.the.Goolag.2016.1080p.WEB-DL.mkv", size=1024,
+        )]
+        return DriveSearch(["query"], results, len(results), self.partial)
+
+    def get_acc_token(self, account=0):
+        return f"token-{self.searches}"
+
+    def token_expires_in(self, account=0):
+        return self.token_lifetime
+
+    def __len__(self):
+        return 1
+
+
+def fake_meta(stream_type, stream_id, deadline=None):
+    return SimpleNamespace(
+        type=stream_type, stream_type=stream_type, id="tt1234567",
+        titles=["pirates of the goolag"], name="Pirates of the Goolag",
+        year="2016", se=0, ep=0,
+    )
+
+
+@pytest.fixture
+def gdrive(monkeypatch):
+    """Point the stream routes at a FakeGDrive and fake metadata."""
+    fake = FakeGDrive()
+    monkeypatch.setattr(routes, "gdrive", fake)
+    monkeypatch.setattr(routes, "Meta", fake_meta)
+    monkeypatch.delenv("CF_PROXY_URL", raising=False)
+    routes.stream_cache.clear()
+    yield fake
+    routes.stream_cache.clear()
+
+
+class FakeBatch:
+    def __init__(self, drive):
+        self.drive = drive
+        self.requests = []
+
+    def add(self, request, callback, request_id):
+        self.requests.append((request, callback, request_id))
+
+    def execute(self):
+        self.drive.batches.append([request_id for _, _, request_id in self.requests])
+        self.drive.queries.append(sorted(r["q"].split(")")[0][1:] for r, _, _ in self.requests))
+        self.drive.release.wait(2)
+        if self.drive.batch_error:
+            raise self.drive.batch_error
+        for request, callback, request_id in self.requests:
+            errors = self.drive.errors.get(request_id)
+            if errors:
+                callback(request_id, None, errors.pop(0))
+            else:
+                callback(request_id, {"files": [{"id": request["q"], "name": "x"}]}, None)
+
+
+class FakeDriveService:
+    """A Drive v3 service answering every files.list query with one file.
+
+    `errors` maps a batch request id to the exceptions its next attempts
+    get; `batch_error` fails whole batches. A `blocked` service holds every
+    batch until `release` is set.
+    """
+
+    def __init__(self, errors=None, batch_error=None, blocked=False):
+        self.errors = errors or {}
+        self.batch_error = batch_error
+        self.batches = []
+        self.queries = []
+        self.release = threading.Event()
+        if not blocked:
+            self.release.set()
+
+    def files(self):
+        return self
+
+    def list(self, **kwargs):
+        return kwargs
+
+    def new_batch_http_request(self):
+        return FakeBatch(self)
+
+
+@pytest.fixture
+def fake_drive(request):
+    """Build GoogleDrive clients backed by a FakeDriveService.
+
+    Each gets its own query flight and limiter, so tests don't share state.
+    """
+    def make(**service_options):
+        gd = GoogleDrive(token)
+        gd.page_size = 10
+        gd.query_flight = SingleFlight(f"test_{request.node.name}")
+        gd.limiter = TokenBucket(f"test_{request.node.name}", 100, 100)
+        gd.drive_instance = FakeDriveService(**service_options)
+        return gd
+
+    return make
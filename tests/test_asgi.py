@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from benchmarks.fake_drive import FakeDriveServer, expected_bytes
+from sgd import proxy
+from sgd.asgi import app
+
+
+async def call(path, method="GET", headers=(), query_string=b""):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": query_string,
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+    }
+    await app(scope, receive, send)
+
+    start = messages[0]
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    return start["status"], dict(start["headers"]), body
+
+
+def get(path):
+    return asyncio.run(call(path))
+
+
+def test_manifest():
+    status, headers, body = get("/manifest.json")
+    assert status == 200
+    assert headers[b"access-control-allow-origin"] == b"*"
+    assert json.loads(body)["types"] == ["movie", "series"]
+
+
+def test_invalid_stream_id_is_404(gdrive):
+    assert get("/stream/movie/garbage.json")[0] == 404
+    assert get("/stream/anime/tt1234567.json")[0] == 404
+
+
+def test_stream_matches_wsgi_response(gdrive):
+    status, headers, body = get("/stream/movie/tt1234567.json")
+    assert status == 200
+    assert headers[b"content-type"] == b"application/json"
+    streams = json.loads(body)["streams"]
+    assert [s["behaviorHints"]["filename"] for s in streams] == [
+        "Pirates.of.the.Goolag.2016.1080p.WEB-DL.mkv"
+    ]
+
+
+def test_concurrent_identical_requests_share_one_search(gdrive):
+    async def burst():
+        return await asyncio.gather(*(call("/stream/movie/tt1234567.json") for _ in range(20)))
+
+    responses = asyncio.run(burst())
+    assert all(status == 200 for status, _, _ in responses)
+    assert gdrive.searches == 1
+
+
+def test_load_relays_a_range(gdrive, monkeypatch):
+    monkeypatch.setenv("LOCAL_PROXY", "1")
+    with FakeDriveServer({"fakefile0000": 2**20}) as server:
+        monkeypatch.setattr(proxy, "DRIVE_MEDIA_URL", f"{server.url}/drive/v3/files")
+        status, headers, body = asyncio.run(
+            call("/load/fakefile0000/x.mkv", headers=[("Range", "bytes=10-99999")])
+        )
+
+    assert status == 206
+    assert headers[b"content-range"] == b"bytes 10-99999/1048576"
+    assert body == expected_bytes(10, 99999)
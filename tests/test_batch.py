@@ -0,0 +1,117 @@
+import asyncio
+import json
+import sys
+import threading
+
+from benchmarks.fake_drive import FakeDriveServer, FakeFile
+from sgd import token
+from sgd.asgi import app as asgi_app
+from sgd.cache import Json
+from sgd.gdrive import GoogleDrive, SharedBatches, shared_batches
+from sgd.ratelimit import TokenBucket
+from sgd.routes import app
+
+gdrive_mod = sys.modules["sgd.gdrive"]
+
+IDS = {"ids": [
+    {"type": "movie", "id": "tt1234567"},
+    {"type": "movie", "id": "garbage"},
+    {"type": "anime", "id": "tt1234567"},
+]}
+
+
+def lines(body):
+    return {(line["type"], line["id"]): line for line in map(json.loads, body.splitlines())}
+
+
+def test_batch_streams_one_line_per_id(gdrive):
+    resp = app.test_client().post("/streams/batch", json=IDS)
+
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    by_id = lines(resp.get_data())
+    assert by_id["movie", "garbage"] == {"type": "movie", "id": "garbage", "error": "invalid id"}
+    assert by_id["anime", "tt1234567"]["error"] == "invalid id"
+    streams = by_id["movie", "tt1234567"]["streams"]
+    assert [s["behaviorHints"]["filename"] for s in streams] == ["Pirates.of.the.Goolag.2016.1080p.WEB-DL.mkv"]
+
+
+def test_batch_rejects_malformed_bodies(gdrive, monkeypatch):
+    client = app.test_client()
+    assert client.post("/streams/batch", data="nope").status_code == 400
+    assert client.post("/streams/batch", json={"ids": []}).status_code == 400
+    assert client.post("/streams/batch", json={"ids": ["tt1234567"]}).status_code == 400
+    monkeypatch.setattr("sgd.routes.BATCH_MAX_IDS", 2)
+    assert client.post("/streams/batch", json=IDS).status_code == 400
+
+
+def test_asgi_batch_matches_wsgi(gdrive):
+    async def call(body):
+        messages = []
+        chunks = [body[:10], body[10:]]
+
+        async def receive():
+            return {"type": "http.request", "body": chunks.pop(0), "more_body": bool(chunks)}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": "/streams/batch", "query_string": b"", "headers": []}
+        await asgi_app(scope, receive, send)
+        return messages[0]["status"], b"".join(m.get("body", b"") for m in messages[1:])
+
+    status, body = asyncio.run(call(json.dumps(IDS).encode()))
+    assert status == 200
+    assert lines(body) == lines(app.test_client().post("/streams/batch", json=IDS).get_data())
+    assert asyncio.run(call(b"{"))[0] == 400
+
+
+TITLES = ["goolag", "pirates", "caribbean", "treasure"]
+
+
+def movie(i):
+    return type("Meta", (), dict(
+        type="movie", stream_type="movie", id=f"tt100000{i}", titles=[TITLES[i]], year="2016",
+    ))()
+
+
+def test_concurrent_searches_share_drive_batches(request):
+    files = {f"f{i}": FakeFile(f"f{i}", f"{TITLES[i].title()}.2016.1080p.mkv", 10, "0A") for i in range(4)}
+    with FakeDriveServer(files, {"0A": "Movies"}) as server:
+        gd = GoogleDrive(token, api_url=server.url)
+        gd.limiter = TokenBucket(f"test_{request.node.name}", 1000, 1000)
+        gd.drive_names = Json(f"test-drivenames-{request.node.name}.json")
+        gd.drive_names.contents = {"0A": "Movies"}
+        gd.shared_batches = SharedBatches(gd, linger=0.2)
+
+        alone = gd.search(movie(0))
+        alone_requests = server.requests
+
+        found = {}
+
+        def search(i):
+            with shared_batches():
+                found[i] = gd.search(movie(i))
+
+        threads = [threading.Thread(target=search, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    assert [f.id for f in alone.results] == ["f0"]
+    assert {i: [f.id for f in s.results] for i, s in found.items()} == {i: [f"f{i}"] for i in range(4)}
+    # Four searches in the round trips of one.
+    assert server.requests - alone_requests == alone_requests
+
+
+def test_large_batches_are_split(fake_drive):
+    gd = fake_drive()
+    answered = []
+    requests_ = {str(i): (lambda i=i: {"q": f"({i})"}) for i in range(250)}
+
+    partial = gd.execute_batch(requests_, lambda request_id, response: answered.append(request_id), "drive_batch")
+
+    assert not partial
+    assert [len(b) for b in gd.drive_instance.batches] == [100, 100, 50]
+    assert sorted(answered, key=int) == [str(i) for i in range(250)]
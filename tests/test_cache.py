@@ -0,0 +1,85 @@
+import os
+
+from sgd.cache import ChunkCache, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_returns_value_until_ttl_expires():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=60, clock=clock)
+    cache.set("k", "v")
+
+    clock.now = 59
+    assert cache.get("k") == "v"
+    clock.now = 60
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_per_entry_ttl_overrides_default():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=60, clock=clock)
+    cache.set("k", "v", ttl=5)
+    clock.now = 5
+    assert cache.get("k", "missing") == "missing"
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_purge_by_predicate():
+    cache = TTLCache(maxsize=10, ttl=60)
+    for key in ["tt1:1:1", "tt1:1:2", "tt2"]:
+        cache.set(key, key)
+
+    assert cache.purge(lambda key: key.startswith("tt1:")) == 2
+    assert cache.get("tt2") == "tt2"
+
+
+MD5 = "0123456789abcdef0123456789abcdef"
+
+
+def test_chunk_cache_round_trips_blocks_through_mmap(tmp_path):
+    cache = ChunkCache(str(tmp_path), max_bytes=100, block_size=10)
+    cache.put(("file-a", MD5), 0, b"0123456789")
+
+    with cache.get(("file-a", MD5), 0) as block:
+        assert block[2:5] == b"234"
+    assert cache.get(("file-a", MD5), 1) is None
+    assert cache.get(("file-a", "f" * 32), 0) is None
+
+
+def test_chunk_cache_evicts_least_recently_used_blocks_by_bytes(tmp_path):
+    cache = ChunkCache(str(tmp_path), max_bytes=25, block_size=10)
+    key = ("file-a", MD5)
+    for index in range(3):
+        cache.put(key, index, b"x" * 10)
+
+    assert (key, 0) not in cache and cache.bytes == 20
+    assert len([n for n in os.listdir(tmp_path) if n.endswith(".blk")]) == 2
+
+
+def test_chunk_cache_is_reloaded_from_disk(tmp_path):
+    cache = ChunkCache(str(tmp_path), max_bytes=100, block_size=10)
+    cache.put(("file-a", MD5), 3, b"abc")
+    cache.set_file_info(("file-a", MD5), 33, "video/mp4")
+
+    reloaded = ChunkCache(str(tmp_path), max_bytes=100, block_size=10)
+    assert (("file-a", MD5), 3) in reloaded and reloaded.bytes == 3
+    assert reloaded.file_info(("file-a", MD5)) == (33, "video/mp4")
@@ -0,0 +1,92 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from benchmarks.make_meta_cassette import DEFAULT_OUTPUT
+from sgd import cassette
+from sgd.cassette import Cassette
+from sgd.meta import Meta
+from sgd.utils import req_api, req_wrapper
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Fake responses for req_wrapper's session, by url."""
+    responses = {}
+
+    def get(session, url, timeout):
+        if url not in responses:
+            raise requests.exceptions.ConnectionError(f"no network in tests: {url}")
+        return SimpleNamespace(text=responses[url])
+
+    monkeypatch.setattr(requests.Session, "get", get)
+    monkeypatch.setattr(cassette, "_active", None)
+    return responses
+
+
+def use_cassette(monkeypatch, path, mode, latency="0"):
+    monkeypatch.setenv("UPSTREAM_CASSETTE", str(path))
+    monkeypatch.setenv("UPSTREAM_CASSETTE_MODE", mode)
+    monkeypatch.setenv("UPSTREAM_REPLAY_LATENCY", latency)
+    monkeypatch.setattr(cassette, "_active", None)
+
+
+def test_recorded_responses_are_replayed_without_the_network(upstream, monkeypatch, tmp_path):
+    path = tmp_path / "upstream.cassette.json.gz"
+    upstream["https://api.example/find/tt1?api_key=secret&x=1"] = '{"found": 1}'
+    use_cassette(monkeypatch, path, "record")
+
+    assert req_wrapper("api.example/find/tt1?api_key=secret&x=1") == '{"found": 1}'
+    # Failures are recorded too, as the empty body req_wrapper returns.
+    assert req_wrapper("api.example/missing") == ""
+    cassette.active().save()
+    assert set(Cassette(str(path)).entries) == {"api.example/find/tt1?x=1", "api.example/missing"}
+
+    upstream.clear()
+    use_cassette(monkeypatch, path, "replay")
+    # Keys aren't part of the recording: any other one replays it.
+    assert req_wrapper("api.example/find/tt1?api_key=other&x=1") == '{"found": 1}'
+    assert req_wrapper("api.example/missing") == ""
+    assert req_wrapper("api.example/never-recorded") == ""
+    assert (cassette.active().hits, cassette.active().misses) == (2, 1)
+
+
+def test_replay_sleeps_the_recorded_latency_up_to_the_timeout(monkeypatch, tmp_path):
+    sleeps = []
+    monkeypatch.setattr(cassette.time, "sleep", sleeps.append)
+    recorder = Cassette(str(tmp_path / "c.json.gz"), "record")
+    recorder.record("fast.example", "fast", 0.2)
+    recorder.record("slow.example", "slow", 5.0)
+    recorder.mode = "replay"
+
+    recorder.latency = "recorded"
+    assert recorder.replay("fast.example", time_out=3) == "fast"
+    assert recorder.replay("slow.example", time_out=3) == ""
+    recorder.latency = 0.05
+    assert recorder.replay("slow.example", time_out=3) == "slow"
+
+    assert sleeps == [0.2, 3, 0.05]
+
+
+def test_bundled_cassette_resolves_metadata_offline(upstream, monkeypatch):
+    use_cassette(monkeypatch, DEFAULT_OUTPUT, "replay")
+    monkeypatch.setenv("TMDB_API_KEY", "replay")
+    for imdb_id in ("tt9000001", "tt9000002", "tt9000003"):
+        if os.path.exists(f"/tmp/{imdb_id}.json"):
+            os.remove(f"/tmp/{imdb_id}.json")
+
+    movie = Meta("movie", "tt9000002")
+    # Neither on TMDB nor on Cinemeta: found through IMDb suggest.
+    obscure = Meta("movie", "tt9000001")
+    series = Meta("series", "tt9000003:1:2")
+
+    assert movie.fetch_dest == "TMDB_API" and movie.year and len(movie.titles) > 1
+    assert movie.title_sources[movie.titles[0]] == "tmdb"
+    assert set(movie.title_sources) == set(movie.titles)
+    assert set(obscure.title_sources.values()) <= {"imdb_sg", "imdb_html"}
+    assert obscure.fetch_dest == "IMDB_SG_API" and obscure.titles
+    assert (series.se, series.ep) == ("01", "02") and series.titles
+    assert req_api("v3-cinemeta.strem.io/meta/series/tt9000003.json")["type"] == "series"
+    assert cassette.active().misses == 0
@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+LAZY_MODULES = ["googleapiclient.discovery", "google.oauth2.credentials", "bs4", "lxml", "PTN"]
+
+
+def test_importing_the_app_and_serving_the_manifest_skips_heavy_modules():
+    probe = (
+        "import sys, sgd\n"
+        "assert sgd.app.test_client().get('/manifest.json').status_code == 200\n"
+        f"print([m for m in {LAZY_MODULES!r} if m in sys.modules])\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", probe], env=os.environ, check=True,
+        capture_output=True, text=True,
+    ).stdout
+    assert out.strip() == "[]"
+
+
+def test_drive_service_is_built_on_first_use_without_network():
+    from sgd import token
+    from sgd.gdrive import GoogleDrive
+
+    gd = GoogleDrive(token)
+    assert "credentials" not in vars(gd)
+
+    # static_discovery: the bundled Drive v3 document, no discovery fetch.
+    service = gd.drive_instance
+    assert hasattr(service, "files") and hasattr(service, "new_batch_http_request")
+    assert gd.drive_instance is service
+
+
+def test_each_thread_gets_its_own_drive_service_and_http():
+    from sgd import token
+    from sgd.gdrive import GoogleDrive
+
+    gd = GoogleDrive(token)
+    with ThreadPoolExecutor(1) as pool:
+        other = pool.submit(lambda: gd.drive_instance).result()
+    service = gd.drive_instance
+
+    assert service is not other
+    assert service._http is not other._http
+    assert service._http.http is not other._http.http
+
+
+def test_a_service_set_explicitly_is_shared_by_every_thread():
+    from sgd import token
+    from sgd.gdrive import GoogleDrive
+
+    gd = GoogleDrive(token)
+    fake = object()
+    gd.drive_instance = fake
+    with ThreadPoolExecutor(1) as pool:
+        assert pool.submit(lambda: gd.drive_instance).result() is fake
+
+
+def test_drive_socket_timeout_follows_the_request_budget():
+    from sgd import token
+    from sgd.gdrive import MAX_DRIVE_TIMEOUT, MIN_DRIVE_TIMEOUT, GoogleDrive
+    from sgd.utils import Deadline
+
+    gd = GoogleDrive(token)
+    http = gd.drive_instance._http.http
+    assert http.timeout == MAX_DRIVE_TIMEOUT
+
+    gd.set_timeout(Deadline(3))
+    assert 2.5 < http.timeout <= 3
+    gd.set_timeout(Deadline(0.001))
+    assert http.timeout == MIN_DRIVE_TIMEOUT
+    gd.set_timeout(None)
+    assert http.timeout == MAX_DRIVE_TIMEOUT
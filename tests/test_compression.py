@@ -0,0 +1,79 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+
+from sgd import compression, httpcache
+from sgd.routes import app
+from tests.test_asgi import call
+
+STREAM = "/stream/movie/tt1234567.json"
+
+
+@pytest.fixture
+def gzip_only(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    monkeypatch.setattr(compression, "COMPRESS_MIN_BYTES", 100)
+
+
+def test_negotiation(gzip_only, monkeypatch):
+    assert compression.negotiate("gzip, deflate, br") == "gzip"
+    assert compression.negotiate("gzip;q=0, deflate") is None
+    assert compression.negotiate("*") == "gzip"
+    assert compression.negotiate(None) is None
+    # Too small to be worth it, unless the size isn't known yet.
+    assert compression.negotiate("gzip", 99) is None
+    assert compression.negotiate("gzip", 100) == "gzip"
+    monkeypatch.setattr(compression, "COMPRESSION", False)
+    assert compression.negotiate("gzip") is None
+
+
+def test_streamed_body_flushes_its_opening_chunk():
+    chunks = [b'{"streams":', b"[", b'{"name":"x"}' * 200, b"]}"]
+    out = list(compression.compress_stream(chunks, "gzip"))
+
+    # The client can decode the opening bytes before anything else arrives.
+    assert zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(out[0]) == b'{"streams":'
+    assert gzip.decompress(b"".join(out)) == b"".join(chunks)
+    assert sum(map(len, out)) < len(b"".join(chunks)) / 10
+
+
+def test_brotli_round_trip():
+    brotli = pytest.importorskip("brotli")
+    body = b'{"name":"x"}' * 200
+    assert compression.negotiate("gzip, br", len(body)) == "br"
+    out = list(compression.compress_stream([body[:10], body[10:]], "br"))
+    assert brotli.decompress(b"".join(out)) == body
+
+
+def test_flask_responses_are_compressed(gdrive, gzip_only):
+    client = app.test_client()
+    gz = {"Accept-Encoding": "gzip"}
+
+    searched = client.get(STREAM, headers=gz)
+    assert searched.headers["Content-Encoding"] == "gzip"
+    assert searched.headers["Vary"] == "Accept-Encoding"
+    plain = gzip.decompress(searched.get_data())
+
+    cached = client.get(STREAM, headers=gz)
+    assert gzip.decompress(cached.get_data()) == plain == client.get(STREAM).get_data()
+    etag = cached.headers["ETag"]
+    assert etag == f'"{httpcache.etag(plain, "gzip")}"'
+    assert client.get(STREAM, headers={**gz, "If-None-Match": etag}).status_code == 304
+    # The identity representation is another one.
+    assert client.get(STREAM, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_small_bodies_are_sent_as_is(gdrive, gzip_only, monkeypatch):
+    monkeypatch.setattr(compression, "COMPRESS_MIN_BYTES", 10_000)
+    resp = app.test_client().get("/manifest.json", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in resp.headers and resp.headers["Vary"] == "Accept-Encoding"
+
+
+def test_asgi_responses_are_compressed(gdrive, gzip_only):
+    gz = [("Accept-Encoding", "gzip")]
+    for _ in range(2):  # searched, then cached
+        status, headers, body = asyncio.run(call(STREAM, headers=gz))
+        assert headers[b"content-encoding"] == b"gzip"
+        assert gzip.decompress(body) == asyncio.run(call(STREAM))[2]
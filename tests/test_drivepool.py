@@ -0,0 +1,164 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import sgd
+from sgd.drivepool import DrivePool, merge_searches
+from sgd.encoder import StreamEncoder
+from sgd.gdrive import AccountHealth, DriveFile, DriveSearch
+from sgd.ptn import parse_title
+from sgd.streams import Candidate, PlaybackUrls
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeAccount:
+    def __init__(self, account, files=(), error=None):
+        self.account = account
+        self.files = list(files)
+        self.error = error
+        self.health = AccountHealth(f"test-{account}")
+        self.limiter = SimpleNamespace(tokens=10)
+        self.searches = 0
+
+    def search(self, stream_meta, deadline=None):
+        self.searches += 1
+        if self.error:
+            raise self.error
+        return DriveSearch([f"q{self.account}"], self.files, len(self.files))
+
+    def get_acc_token(self):
+        return f"token-{self.account}"
+
+    def token_expires_in(self):
+        return 1800 + self.account
+
+
+def drive_file(file_id, md5, size, account=0, drive_id=None):
+    return DriveFile(id=file_id, name=f"{file_id}.mkv", size=size, drive_id=drive_id, md5=md5, account=account)
+
+
+# --- load_tokens ---------------------------------------------------------
+
+def test_load_tokens_prefers_tokens_array(monkeypatch):
+    monkeypatch.setenv("TOKENS", json.dumps([{"client_id": "a"}, {"client_id": "b"}]))
+    assert [t["client_id"] for t in sgd.load_tokens()] == ["a", "b"]
+
+
+def test_load_tokens_falls_back_to_single_token(monkeypatch):
+    monkeypatch.delenv("TOKENS", raising=False)
+    monkeypatch.setenv("TOKEN", json.dumps({"client_id": "only"}))
+    assert sgd.load_tokens() == [{"client_id": "only"}]
+
+
+@pytest.mark.parametrize("value", ["not json", "{}", "[]", '["x"]'])
+def test_load_tokens_rejects_bad_tokens(monkeypatch, value):
+    monkeypatch.setenv("TOKENS", value)
+    with pytest.raises(RuntimeError):
+        sgd.load_tokens()
+
+
+# --- merging -------------------------------------------------------------
+
+def test_merge_dedupes_on_md5_across_accounts():
+    first = DriveSearch(["a"], [drive_file("f1", "md5-1", 10, 0, "drive-a"), drive_file("f2", "md5-2", 30, 0)], 2)
+    second = DriveSearch(
+        ["a", "b"],
+        # The same file seen from another account, in another drive.
+        [drive_file("f1-copy", "md5-1", 10, 1, "drive-b"), drive_file("f3", None, 20, 1)],
+        2, partial=True,
+    )
+
+    merged = merge_searches([first, second])
+
+    assert [f.id for f in merged.results] == ["f2", "f3", "f1"]
+    assert merged.results[-1].account == 0
+    assert merged.query == ["a", "b"]
+    assert (merged.len_response, merged.partial) == (4, True)
+
+
+def test_fanout_searches_every_account_and_merges():
+    accounts = [
+        FakeAccount(0, [drive_file("f1", "md5-1", 10)]),
+        FakeAccount(1, [drive_file("f1b", "md5-1", 10, 1), drive_file("f2", "md5-2", 5, 1)]),
+    ]
+    search = DrivePool(accounts, mode="fanout").search(SimpleNamespace())
+
+    assert [f.id for f in search.results] == ["f1", "f2"]
+    assert all(a.searches == 1 for a in accounts)
+
+
+def test_least_loaded_routes_to_one_healthy_account():
+    accounts = [FakeAccount(0), FakeAccount(1)]
+    accounts[0].health.cooldown_until = float("inf")
+    pool = DrivePool(accounts, mode="least_loaded")
+
+    pool.search(SimpleNamespace())
+
+    assert [a.searches for a in accounts] == [0, 1]
+
+
+@pytest.mark.parametrize("mode", ["fanout", "least_loaded"])
+def test_failed_account_search_is_recorded_and_not_raised(mode):
+    broken = FakeAccount(0, error=RuntimeError("token revoked"))
+    search = DrivePool([broken], mode=mode).search(SimpleNamespace())
+
+    assert search.results == [] and search.partial
+    assert broken.health.failures == 1
+
+
+def test_unknown_pool_mode_is_rejected():
+    with pytest.raises(RuntimeError):
+        DrivePool([FakeAccount(0)], mode="random")
+
+
+# --- health --------------------------------------------------------------
+
+def test_account_is_benched_after_repeated_failures_then_recovers():
+    clock = FakeClock()
+    health = AccountHealth("test-health", clock=clock)
+
+    health.record(5, 5)
+    health.record(5, 0, throttled=True)
+    assert health.healthy
+    health.record(5, 5)
+    assert not health.healthy
+    assert (health.requests, health.failures) == (15, 10)
+
+    clock.now += 15
+    assert health.healthy
+    # Still failing: the next cool-down is twice as long.
+    health.record(1, 1)
+    clock.now += 15
+    assert not health.healthy
+
+    clock.now += 15
+    health.record(1, 0)
+    assert health.healthy and health.consecutive_failures == 0
+
+
+# --- playback ------------------------------------------------------------
+
+def test_playback_urls_use_each_files_account_token(monkeypatch):
+    monkeypatch.delenv("CF_PROXY_URL", raising=False)
+    pool = DrivePool([FakeAccount(0), FakeAccount(1)], mode="least_loaded")
+    name = "Pirates.of.the.Goolag.2016.1080p.WEB-DL.mkv"
+    candidates = [
+        Candidate(DriveFile(id=f"id{i}", name=name, account=i), parse_title(name))
+        for i in (0, 1)
+    ]
+
+    urls = PlaybackUrls(pool, candidates)
+    streams = json.loads(b"".join(StreamEncoder().iter_encode(candidates, urls)))
+
+    assert [s["behaviorHints"]["proxyHeaders"]["request"]["Authorization"] for s in streams] == [
+        "Bearer token-0", "Bearer token-1",
+    ]
+    assert urls.token_lifetime() == 1800
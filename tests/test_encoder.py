@@ -0,0 +1,93 @@
+import json
+from types import SimpleNamespace
+
+from sgd.encoder import StreamEncoder, dumps, dumps_each, stream_object
+from sgd.gdrive import DriveFile
+from sgd.ptn import parse_title
+from sgd.streams import Candidate
+
+
+def make_candidate(file_id="abc", title="🎬 Pirates of the Goolag - (2016)"):
+    name = "Pirates.of.the.Goolag.2016.1080p.WEB-DL.mkv"
+    return Candidate(
+        file=DriveFile(id=file_id, name=name, size=1024),
+        parsed=parse_title(name),
+        name="▶️ Stream Helium [Full HD] 🇧🇷",
+        title=title,
+        behavior_hints={"notWebReady": True, "bingeGroup": "gdrive-1080p"},
+    )
+
+
+def make_urls(epoch="token-1"):
+    headers = {"request": {"Authorization": f"Bearer {epoch}"}}
+    return SimpleNamespace(
+        epoch=lambda file: epoch,
+        proxy_headers=lambda file: headers,
+        stream_url=lambda file: f"https://example.com/{file.id}",
+    )
+
+
+def test_stream_object_only_has_stremio_fields():
+    obj = stream_object(make_candidate(), make_urls())
+    assert set(obj) == {"name", "title", "url", "behaviorHints"}
+    assert obj["behaviorHints"]["filename"].startswith("Pirates.of.the.Goolag")
+    assert "sortkeys" not in json.dumps(obj)
+
+
+def test_stream_object_stamps_url_and_headers_from_urls():
+    obj = stream_object(make_candidate(file_id="xyz"), make_urls("tok"))
+    assert obj["url"] == "https://example.com/xyz"
+    assert obj["behaviorHints"]["proxyHeaders"] == {"request": {"Authorization": "Bearer tok"}}
+
+
+def test_encode_is_cached_per_file_and_epoch():
+    encoder = StreamEncoder()
+    candidate = make_candidate()
+
+    first = encoder.encode(candidate, make_urls("token-1"))
+    assert encoder.encode(candidate, make_urls("token-1")) is first
+    assert (encoder.hits, encoder.misses) == (1, 1)
+
+    encoder.encode(candidate, make_urls("token-2"))
+    assert encoder.misses == 2
+
+
+def test_encode_cache_is_not_reused_for_a_different_title():
+    encoder = StreamEncoder()
+    encoder.encode(make_candidate(title="one"), make_urls())
+    encoded = encoder.encode(make_candidate(title="two"), make_urls())
+    assert json.loads(encoded)["title"] == "two"
+
+
+def test_encode_cache_is_bounded():
+    encoder = StreamEncoder(maxsize=2)
+    for file_id in "abc":
+        encoder.encode(make_candidate(file_id=file_id), make_urls())
+    assert len(encoder._cache) == 2
+
+
+def test_iter_encode_yields_a_valid_array_one_stream_per_chunk():
+    encoder = StreamEncoder()
+    candidates = [make_candidate(file_id=f"id{i}") for i in range(3)]
+    chunks = list(encoder.iter_encode(candidates, make_urls()))
+
+    assert len(chunks) == 4
+    streams = json.loads(b"".join(chunks))
+    assert [s["url"] for s in streams] == [f"https://example.com/id{i}" for i in range(3)]
+
+
+def test_iter_encode_empty():
+    assert b"".join(StreamEncoder().iter_encode([], make_urls())) == b"[]"
+
+
+def test_dumps_each_matches_one_dumps_per_object():
+    objs = [stream_object(make_candidate(file_id=f"id{i}"), make_urls()) for i in range(3)]
+    # A filename that looks like an object boundary once unescaped.
+    objs[1]["behaviorHints"]["filename"] = 'a},{"name":"b'
+    assert dumps_each(objs) == [dumps(obj) for obj in objs]
+    assert dumps_each([]) == []
+
+
+def test_dumps_each_falls_back_when_items_cant_be_split():
+    objs = [{"a": [{"b": 1}, {"c": 2}]}, {"d": 3}]
+    assert dumps_each(objs) == [dumps(obj) for obj in objs]
@@ -0,0 +1,139 @@
+import sys
+
+import pytest
+import requests
+
+from benchmarks.fake_drive import FakeDriveServer, FakeFile, Query, synthetic_library
+from sgd import token
+from sgd.cache import Json, Pickle
+from sgd.gdrive import GoogleDrive
+from sgd.ratelimit import TokenBucket
+
+# `sgd.gdrive` is the DrivePool once sgd is imported; this is the module.
+gdrive_mod = sys.modules["sgd.gdrive"]
+
+FOLDER = "application/vnd.google-apps.folder"
+FILES = {
+    "show": FakeFile("show", "Pirates of the Goolag", drive_id="0Adrive", mime_type=FOLDER, parents=("0Adrive",)),
+    "ep1": FakeFile("ep1", "Pirates.of.the.Goolag.S01E01.1080p.mkv", 10, "0Adrive", "a" * 32, parents=("show",)),
+    "ep2": FakeFile("ep2", "Pirates.of.the.Goolag.S01E02.1080p.mkv", 20, "0Adrive", "b" * 32, parents=("show",)),
+    "movie": FakeFile("movie", "Pirates of the Goolag 2016 2160p.mkv", 30, "0Bdrive", "c" * 32),
+    "trash": FakeFile("trash", "Pirates of the Goolag 2016 720p.mkv", 5, "0Bdrive", "d" * 32, trashed=True),
+    "mine": FakeFile("mine", "Goolag Home Video.mp4", 1, md5="e" * 32),
+}
+DRIVES = {"0Adrive": "Series", "0Bdrive": "Movies"}
+
+
+def matches(q):
+    return sorted(f.id for f in FILES.values() if Query(q).match(f))
+
+
+@pytest.mark.parametrize("q, expected", [
+    ("name contains 'pirates'", ["ep1", "ep2", "movie", "show", "trash"]),
+    # Words, the last one as a prefix - not substrings.
+    ("name contains 'pira'", ["ep1", "ep2", "movie", "show", "trash"]),
+    ("name contains 'rates'", []),
+    ("name contains 'the goolag s01e0'", ["ep1", "ep2"]),
+    ("name contains 'goolag' and not name contains 'pirates'", ["mine"]),
+    ("(name contains 'S01E02' or name contains '2016') and trashed=false", ["ep2", "movie"]),
+    ("'show' in parents and mimeType contains 'video/'", ["ep1", "ep2"]),
+    ("mimeType = 'application/vnd.google-apps.folder'", ["show"]),
+    ("name contains 'it\\'s'", []),
+])
+def test_queries_match_like_drive(q, expected):
+    assert matches(q) == expected
+
+
+def test_malformed_queries_are_rejected():
+    with pytest.raises(ValueError):
+        Query("name contains pirates")
+    with pytest.raises(ValueError):
+        Query("(name contains 'pirates'")
+
+
+@pytest.fixture
+def drive_server():
+    with FakeDriveServer(FILES, DRIVES) as server:
+        yield server
+
+
+def list_files(server, **params):
+    resp = requests.get(
+        f"{server.url}/drive/v3/files", params=params, headers={"Authorization": "Bearer x"}
+    )
+    assert resp.status_code == 200, resp.text
+    return resp.json()
+
+
+def test_files_list_pages_through_the_corpus(drive_server):
+    q = "name contains 'goolag' and trashed=false"
+    page = list_files(drive_server, q=q, corpora="allDrives", includeItemsFromAllDrives="true", pageSize=3)
+    assert len(page["files"]) == 3
+    rest = list_files(
+        drive_server, q=q, corpora="allDrives", includeItemsFromAllDrives="true",
+        pageSize=3, pageToken=page["nextPageToken"],
+    )
+    assert "nextPageToken" not in rest
+    assert sorted(f["id"] for f in page["files"] + rest["files"]) == ["ep1", "ep2", "mine", "movie", "show"]
+
+    # One shared drive, or only My Drive.
+    in_drive = list_files(drive_server, q=q, corpora="drive", driveId="0Bdrive", fields="files(id)")
+    assert in_drive["files"] == [{"id": "movie"}]
+    assert [f["id"] for f in list_files(drive_server, q=q)["files"]] == ["mine"]
+
+
+def test_requests_without_a_token_are_refused(drive_server):
+    assert requests.get(f"{drive_server.url}/drive/v3/files").status_code == 401
+
+
+@pytest.fixture
+def drive(drive_server, request):
+    gd = GoogleDrive(token, api_url=drive_server.url)
+    gd.limiter = TokenBucket(f"test_{request.node.name}", 1000, 1000)
+    gd.drive_names = Json(f"test-drivenames-{request.node.name}.json")
+    gd.drive_names.contents = {}
+    return gd
+
+
+def test_googledrive_searches_the_fake_server_in_batches(drive, drive_server):
+    meta = type("Meta", (), dict(
+        type="series", stream_type="series", id="tt1234567", titles=["pirates of the goolag"], se="01", ep="02",
+    ))()
+
+    search = drive.search(meta)
+
+    assert [f.id for f in search.results] == ["ep2"]
+    assert not search.partial
+    assert drive.drive_names.contents == {"0Adrive": "Series"}
+    # Two files.list calls and a drives.get, in two batch round trips.
+    assert (drive_server.requests, drive_server.calls) == (2, 3)
+
+
+def test_injected_rate_limit_errors_are_retried_then_reported(drive, drive_server, monkeypatch):
+    monkeypatch.setattr(gdrive_mod, "RETRY_BASE_DELAY", 0)
+    drive_server.error_rate = 1.0
+
+    files, partial = drive.file_list("id, name", ["name contains 'pirates'"])
+
+    assert (files, partial) == ([], True)
+    assert drive_server.calls == 1 + gdrive_mod.DRIVE_MAX_RETRIES
+
+
+def test_access_tokens_come_from_the_overridden_url(drive, drive_server):
+    drive.acc_token = Pickle("test-acctoken-fake-drive.pickle")
+    drive.acc_token.contents = {}
+
+    assert drive.get_acc_token() == "fake-access-1"
+    assert drive.get_acc_token() == "fake-access-1"
+    assert drive_server.tokens_issued == 1
+
+
+def test_synthetic_library_files_episodes_under_season_folders():
+    files, drives = synthetic_library(movies=10, episodes=50)
+    episode = next(f for f in files.values() if f.mime_type != FOLDER and f.parents[0] in files)
+    season = files[episode.parents[0]]
+    show = files[season.parents[0]]
+
+    assert season.name.startswith("Season ") and season.mime_type == FOLDER
+    assert show.parents == (show.drive_id,) and show.drive_id in drives
+    assert episode.drive_id == season.drive_id == show.drive_id
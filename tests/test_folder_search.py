@@ -0,0 +1,79 @@
+import sys
+
+import pytest
+
+from benchmarks.fake_drive import FakeDriveServer, FakeFile
+from sgd import token
+from sgd.cache import Json, TTLCache
+from sgd.gdrive import GoogleDrive
+from sgd.ratelimit import TokenBucket
+
+# `sgd.gdrive` is the DrivePool once sgd is imported; this is the module.
+gdrive_mod = sys.modules["sgd.gdrive"]
+
+FOLDER = "application/vnd.google-apps.folder"
+
+
+def show_files():
+    files = {
+        "show": FakeFile("show", "Pirates of the Goolag", drive_id="0A", mime_type=FOLDER, parents=("0A",)),
+        "season1": FakeFile("season1", "Season 1", drive_id="0A", mime_type=FOLDER, parents=("show",)),
+        "season2": FakeFile("season2", "Season 2", drive_id="0A", mime_type=FOLDER, parents=("show",)),
+    }
+    for se, ep in [(1, 1), (1, 2), (1, 3), (2, 1), (2, 2)]:
+        # Named so that only the full-text search of S01E01 finds the show.
+        name = f"Pirates.of.the.Goolag.S0{se}E0{ep}.mkv" if (se, ep) in [(1, 1), (2, 1)] else f"POTG.S0{se}E0{ep}.mkv"
+        files[f"{se}x{ep}"] = FakeFile(f"{se}x{ep}", name, 10, "0A", f"{se}{ep}".ljust(32, "0"), parents=(f"season{se}",))
+    return files
+
+
+def episode(se, ep):
+    return type("Meta", (), dict(
+        type="series", stream_type="series", id="tt1234567",
+        titles=["pirates of the goolag"], se=f"{se:02d}", ep=f"{ep:02d}",
+    ))()
+
+
+@pytest.fixture
+def drive(monkeypatch, request):
+    monkeypatch.setattr(gdrive_mod, "FOLDER_SEARCH", True)
+    monkeypatch.setattr(GoogleDrive, "folder_cache", TTLCache(10, 3600))
+    with FakeDriveServer(show_files(), {"0A": "Series"}) as server:
+        gd = GoogleDrive(token, api_url=server.url)
+        gd.limiter = TokenBucket(f"test_{request.node.name}", 1000, 1000)
+        gd.drive_names = Json(f"test-drivenames-{request.node.name}.json")
+        gd.drive_names.contents = {}
+        yield gd
+
+
+def test_later_episodes_are_listed_from_the_learned_folder(drive):
+    first = drive.search(episode(1, 1))
+    assert [f.id for f in first.results] == ["1x1"]
+    assert first.results[0].parent == "season1"
+    assert drive.folder_cache.get((drive.account, "tt1234567")) == ["season1"]
+
+    # Not found by title, but listed from the season's folder.
+    second = drive.search(episode(1, 3))
+
+    assert [f.id for f in second.results] == ["1x3"]
+    assert second.query == ["'season1' in parents"]
+    assert second.len_response == 3
+
+
+def test_episodes_missing_from_known_folders_fall_back_to_search(drive):
+    drive.search(episode(1, 1))
+
+    other_season = drive.search(episode(2, 1))
+
+    assert [f.id for f in other_season.results] == ["2x1"]
+    assert "'season1' in parents" not in other_season.query
+    assert drive.folder_cache.get((drive.account, "tt1234567")) == ["season1", "season2"]
+    assert [f.id for f in drive.search(episode(2, 2)).results] == ["2x2"]
+
+
+def test_folders_too_big_to_list_are_dropped(drive):
+    drive.search(episode(1, 1))
+    drive.page_size = 2
+
+    assert drive.search(episode(1, 3)).results == []
+    assert drive.folder_cache.get((drive.account, "tt1234567")) == []
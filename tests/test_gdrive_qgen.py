@@ -76,13 +76,56 @@ def test_search_queries_by_id_even_when_titles_dont_match_the_file():
     gd.page_size = 1000
     captured = {}
 
-    def fake_file_list(fields):
-        captured["query"] = list(gd.query)
-        return []
+    def fake_file_list(fields, queries, deadline=None):
+        captured["query"] = list(queries)
+        return [], False
 
     gd.file_list = fake_file_list
-    gd.get_drive_names = lambda: {}
+    gd.get_drive_names = lambda results, deadline=None: {}
 
-    gd.search(sm)
+    search = gd.search(sm)
 
     assert "name contains 'tt15047880'" in captured["query"]
+    assert search.query == captured["query"]
+
+
+# --- search stages / time budget -----------------------------------------
+
+def make_staged_gdrive(captured):
+    gd = GoogleDrive.__new__(GoogleDrive)
+    gd.page_size = 1000
+
+    def fake_file_list(fields, queries, deadline=None):
+        captured.append(list(queries))
+        return [], False
+
+    gd.file_list = fake_file_list
+    gd.get_drive_names = lambda results, deadline=None: {}
+    return gd
+
+
+def test_search_runs_id_and_primary_title_before_aka_titles():
+    sm = SimpleNamespace(
+        id="tt15047880", stream_type="movie",
+        titles=["primary title", "aka one", "aka two"],
+    )
+    stages = []
+    search = make_staged_gdrive(stages).search(sm)
+
+    assert stages[0] == ["name contains 'tt15047880'", GoogleDrive.qgen("primary title")]
+    assert stages[1] == [GoogleDrive.qgen("aka one"), GoogleDrive.qgen("aka two")]
+    assert not search.partial
+
+
+def test_search_skips_aka_stages_once_the_budget_is_spent():
+    from sgd.utils import Deadline
+
+    sm = SimpleNamespace(
+        id="tt15047880", stream_type="movie", titles=["primary title", "aka one"],
+    )
+    stages = []
+    search = make_staged_gdrive(stages).search(sm, Deadline(0.001))
+
+    assert len(stages) == 1
+    assert search.partial
+    assert search.query == stages[0]
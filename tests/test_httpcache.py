@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from sgd import httpcache
+from sgd.httpcache import CachePolicy
+from sgd.routes import app
+from tests.test_asgi import call
+
+STREAM = "/stream/movie/tt1234567.json"
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_policy_fits_the_lifetime_of_the_body():
+    policy = CachePolicy(300, 900, 600)
+    assert policy.header() == "public, max-age=300, s-maxage=900, stale-while-revalidate=600"
+    assert policy.header(1200) == "public, max-age=300, s-maxage=900, stale-while-revalidate=300"
+    assert policy.header(120) == "public, max-age=120, s-maxage=120"
+    assert policy.header(-5) == "no-store"
+    assert CachePolicy(0, 0, 600).header() == "no-store"
+
+
+def test_stream_policy_keeps_a_margin_for_the_tokens(monkeypatch):
+    monkeypatch.setattr(httpcache, "STREAM_CACHE", CachePolicy(300, 900, 600))
+    monkeypatch.setattr(httpcache, "STREAM_TOKEN_MARGIN", 600)
+    # Behind CF_PROXY_URL the body has no tokens.
+    assert httpcache.stream_cache_control(None) == httpcache.STREAM_CACHE.header()
+    assert httpcache.stream_cache_control(3600) == httpcache.STREAM_CACHE.header()
+    assert httpcache.stream_cache_control(1000) == "public, max-age=300, s-maxage=400"
+    assert httpcache.stream_cache_control(500) == "no-store"
+
+
+def test_manifest_is_cacheable_and_revalidated(client):
+    first = client.get("/manifest.json")
+    assert first.headers["Cache-Control"] == httpcache.MANIFEST_CACHE.header()
+    assert first.headers["ETag"] == f'"{httpcache.etag(first.get_data())}"'
+
+    again = client.get("/manifest.json", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.get_data() == b""
+    assert again.headers["Cache-Control"] == first.headers["Cache-Control"]
+
+
+def test_only_cached_stream_responses_are_cacheable(gdrive, client):
+    # A search streams its body before it's known to be complete.
+    searched = client.get(STREAM)
+    searched_body = searched.get_data()
+    assert searched.headers["Cache-Control"] == "no-store"
+    assert "ETag" not in searched.headers
+
+    cached = client.get(STREAM)
+    assert cached.get_data() == searched_body
+    assert cached.headers["Cache-Control"] == httpcache.stream_cache_control(3600)
+    etag = cached.headers["ETag"]
+
+    revalidated = client.get(STREAM, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.headers["ETag"] == etag
+    assert client.get(STREAM, headers={"If-None-Match": '"other"'}).status_code == 200
+    assert gdrive.searches == 1
+
+
+def test_expiring_tokens_make_stream_responses_uncacheable(gdrive, client):
+    gdrive.token_lifetime = httpcache.STREAM_TOKEN_MARGIN - 1
+    client.get(STREAM).get_data()
+    cached = client.get(STREAM)
+    assert "ETag" in cached.headers and cached.headers["Cache-Control"] == "no-store"
+
+
+def test_asgi_answers_304s(gdrive):
+    status, headers, body = asyncio.run(call("/manifest.json"))
+    assert status == 200 and headers[b"cache-control"] == httpcache.MANIFEST_CACHE.header().encode()
+    etag = headers[b"etag"].decode()
+    assert asyncio.run(call("/manifest.json", headers=[("If-None-Match", etag)]))[:3:2] == (304, b"")
+
+    assert asyncio.run(call(STREAM))[1][b"cache-control"] == b"no-store"
+    status, headers, body = asyncio.run(call(STREAM))
+    assert status == 200 and headers[b"etag"] == f'"{httpcache.etag(body)}"'.encode()
+    assert asyncio.run(call(STREAM, headers=[("If-None-Match", headers[b"etag"].decode())]))[0] == 304
@@ -0,0 +1,43 @@
+from sgd.metrics import Counter, Histogram, Registry
+
+
+def test_counter_render_with_labels():
+    registry = Registry()
+    requests = registry.register(Counter("sgd_test_total", "Test counter.", ["flight"]))
+    requests.inc(flight="meta")
+    requests.inc(2, flight="meta")
+    requests.inc(flight='we"ird')
+
+    text = registry.render()
+    assert "# TYPE sgd_test_total counter" in text
+    assert 'sgd_test_total{flight="meta"} 3' in text
+    assert 'sgd_test_total{flight="we\\"ird"} 1' in text
+
+
+def test_register_returns_existing_metric():
+    registry = Registry()
+    first = registry.register(Counter("sgd_dupe_total", "x"))
+    assert registry.register(Counter("sgd_dupe_total", "x")) is first
+
+
+def test_histogram_render_is_cumulative():
+    registry = Registry()
+    latency = registry.register(Histogram("sgd_test_seconds", "Test.", ["stage"], buckets=(0.1, 1)))
+    latency.observe(0.05, stage="a")
+    latency.observe(0.1, stage="a")
+    latency.observe(5, stage="a")
+
+    text = registry.render()
+    assert "# TYPE sgd_test_seconds histogram" in text
+    assert 'sgd_test_seconds_bucket{stage="a",le="0.1"} 2' in text
+    assert 'sgd_test_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 'sgd_test_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'sgd_test_seconds_sum{stage="a"} 5.15' in text
+    assert 'sgd_test_seconds_count{stage="a"} 3' in text
+
+
+def test_histogram_time_context_manager():
+    latency = Histogram("sgd_timer_seconds", "Test.", ["stage"])
+    with latency.time(stage="x"):
+        pass
+    assert latency.count(stage="x") == 1
@@ -0,0 +1,75 @@
+import pytest
+
+from sgd import popular as popular_mod
+from sgd import prewarm, routes
+from sgd.popular import popular as tracker
+from sgd.prewarm import parse_ids
+from sgd.routes import app
+from sgd.utils import Deadline
+
+
+@pytest.fixture
+def popular():
+    tracker.counts.clear()
+    yield tracker
+    tracker.counts.clear()
+
+
+def test_ids_are_parsed_from_lists_and_logs():
+    lines = [
+        "# comment", "", "tt0000001", "movie/tt0000002", "series tt0000003:1:2", "tt0000004%3A2%3A3",
+        '127.0.0.1 - - [19/Oct/2026] "GET /stream/series/tt0000005%3A1%3A1.json HTTP/1.1" 200',
+        '127.0.0.1 - - [19/Oct/2026] "GET /manifest.json HTTP/1.1" 200',
+        "TT0000001",
+    ]
+    assert parse_ids(lines) == [
+        ("movie", "tt0000001"), ("movie", "tt0000002"), ("series", "tt0000003:1:2"),
+        ("series", "tt0000004:2:3"), ("series", "tt0000005:1:1"),
+    ]
+
+
+def test_popular_ids_are_ranked_and_capped(popular, monkeypatch):
+    for stream_id in ["tt1", "tt2", "TT2", "tt3", "tt3", "tt3"]:
+        popular.seen("movie", stream_id)
+    assert popular.top(2) == [("movie", "tt3"), ("movie", "tt2")]
+
+    monkeypatch.setattr(popular_mod, "MAX_TRACKED_IDS", 4)
+    popular.seen("movie", "tt4")
+    popular.seen("movie", "tt5")
+    assert popular.top(10) == [("movie", "tt3"), ("movie", "tt2")]
+
+
+def test_warm_fills_the_stream_cache(gdrive):
+    items = [("movie", "tt1234567"), ("movie", "garbage"), ("anime", "tt1234567")]
+
+    assert prewarm.warm(items, rate=100) == {"warmed": 1, "invalid": 2}
+    assert routes.stream_cache.get(("movie", "tt1234567")) is not None
+    assert prewarm.warm(items[:1]) == {"cached": 1}
+    assert gdrive.searches == 1
+
+    routes.stream_cache.clear()
+    assert prewarm.warm(items[:1], deadline=Deadline(1e-9)) == {"skipped": 1}
+
+
+def test_prewarm_route_requires_the_admin_secret(gdrive, popular, monkeypatch):
+    client = app.test_client()
+    monkeypatch.setenv("ADMIN_SECRET", "s3cret")
+    assert client.post("/admin/prewarm", data="tt1234567").status_code == 403
+
+    resp = client.post("/admin/prewarm", data="movie/tt1234567\n", headers={"X-Admin-Secret": "s3cret"})
+    assert resp.get_json() == {"warmed": 1}
+
+    # A cron's GET warms the most requested ids.
+    client.get("/stream/movie/tt1234567.json").get_data()
+    resp = client.get("/admin/prewarm", headers={"Authorization": "Bearer s3cret"})
+    assert resp.get_json() == {"cached": 1}
+
+
+def test_cli_warms_the_ids_of_a_file(gdrive, popular, tmp_path, capsys):
+    ids = tmp_path / "ids.txt"
+    ids.write_text("tt1234567\n")
+    prewarm.main(["--ids", str(ids), "--rate", "100"])
+    assert "'warmed': 1" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit):
+        prewarm.main([])
@@ -0,0 +1,85 @@
+import cProfile
+import json
+import os
+import pstats
+
+import pytest
+
+from sgd import app, profiling
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+    monkeypatch.delenv("PROFILE_SECRET", raising=False)
+    return tmp_path
+
+
+def test_profiling_is_off_by_default(gdrive, profile_dir):
+    app.test_client().get("/stream/movie/tt1234567.json").get_data()
+    assert not os.listdir(profile_dir)
+
+
+def test_secret_header_profiles_the_request(gdrive, profile_dir, monkeypatch):
+    monkeypatch.setenv("PROFILE_SECRET", "s3cret")
+    client = app.test_client()
+    client.get("/stream/movie/tt1234567.json", headers={"X-Profile": "wrong"}).get_data()
+    assert not os.listdir(profile_dir)
+
+    # A different id, so the search isn't served from the stream cache.
+    resp = client.get("/stream/movie/tt7654321.json", headers={"X-Profile": "s3cret"})
+    assert json.loads(resp.get_data())["streams"]
+
+    files = sorted(os.listdir(profile_dir))
+    assert [f.rsplit(".", 1)[1] for f in files] == ["collapsed", "json", "prof"]
+    base = profile_dir / files[0].rsplit(".", 1)[0]
+
+    info = json.loads((base.with_suffix(".json")).read_text())
+    assert info["stream_id"] == "tt7654321"
+    assert {"match", "rank", "serialize"} <= set(info["stages"])
+    assert pstats.Stats(str(base.with_suffix(".prof"))).total_calls > 0
+    lines = base.with_suffix(".collapsed").read_text().splitlines()
+    assert any("is_semi_valid_title (streams.py" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_concurrent_profiles_are_skipped_not_failed(gdrive, profile_dir, monkeypatch):
+    monkeypatch.setenv("PROFILE_SECRET", "s3cret")
+    # A profiled request that is part way through.
+    first = profiling.profile_stream("movie", "tt0000001", iter([b"[", b"]"]))
+    assert next(first) == b"["
+
+    resp = app.test_client().get("/stream/movie/tt7654322.json", headers={"X-Profile": "s3cret"})
+    assert json.loads(resp.get_data())["streams"]
+    assert not os.listdir(profile_dir)
+
+    assert list(first) == [b"]"]
+    assert len(os.listdir(profile_dir)) == 3
+
+
+def test_profiler_errors_dont_break_the_response(gdrive, profile_dir, monkeypatch):
+    monkeypatch.setenv("PROFILE_SECRET", "s3cret")
+    # Another profiler is active: enabling ours raises ValueError on 3.12+.
+    other = cProfile.Profile()
+    other.enable()
+    try:
+        resp = app.test_client().get("/stream/movie/tt7654323.json", headers={"X-Profile": "s3cret"})
+        body = resp.get_data()
+    finally:
+        other.disable()
+    assert json.loads(body)["streams"]
+
+    # And the lock was released: the next request is profiled.
+    app.test_client().get("/stream/movie/tt7654324.json", headers={"X-Profile": "s3cret"}).get_data()
+    assert any(f.endswith(".prof") for f in os.listdir(profile_dir))
+
+
+def test_only_the_newest_profiles_are_kept(profile_dir):
+    for i in range(5):
+        for ext in ("prof", "collapsed", "json"):
+            (profile_dir / f"2024010{i}.{ext}").write_text("")
+    profiling.prune(str(profile_dir), 2)
+    assert sorted(os.listdir(profile_dir)) == [
+        f"2024010{i}.{ext}" for i in (3, 4) for ext in ("collapsed", "json", "prof")
+    ]
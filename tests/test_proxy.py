@@ -0,0 +1,142 @@
+import os
+import time
+
+import pytest
+
+from benchmarks.fake_drive import FakeDriveServer, expected_bytes
+from sgd import app, proxy
+from sgd.gdrive import DriveFile
+from sgd.streams import PlaybackUrls
+
+FILE_ID = "fakefile0000"
+SIZE = 5 * 2**20
+
+
+@pytest.fixture
+def fake_drive_media(gdrive, monkeypatch):
+    monkeypatch.setenv("LOCAL_PROXY", "1")
+    with FakeDriveServer({FILE_ID: SIZE}) as server:
+        monkeypatch.setattr(proxy, "DRIVE_MEDIA_URL", f"{server.url}/drive/v3/files")
+        yield server
+
+
+def test_load_is_off_by_default(gdrive, monkeypatch):
+    monkeypatch.delenv("LOCAL_PROXY", raising=False)
+    assert app.test_client().get(f"/load/{FILE_ID}/movie.mkv").status_code == 404
+
+
+def test_load_relays_a_range(fake_drive_media):
+    resp = app.test_client().get(f"/load/{FILE_ID}/movie.mkv", headers={"Range": "bytes=1000-300000"})
+
+    assert resp.status_code == 206
+    assert resp.headers["Content-Range"] == f"bytes 1000-300000/{SIZE}"
+    assert resp.headers["Accept-Ranges"] == "bytes"
+    assert resp.get_data() == expected_bytes(1000, 300000)
+
+
+def test_load_without_range_sends_the_whole_file(fake_drive_media):
+    resp = app.test_client().get(f"/load/{FILE_ID}/movie.mkv")
+    assert resp.status_code == 200
+    assert int(resp.headers["Content-Length"]) == len(resp.get_data()) == SIZE
+
+
+def test_load_passes_upstream_errors_through(fake_drive_media):
+    client = app.test_client()
+    assert client.get("/load/missingfile00/x.mkv").status_code == 404
+    resp = client.get(f"/load/{FILE_ID}/x.mkv", headers={"Range": f"bytes={SIZE}-"})
+    assert resp.status_code == 416
+
+
+def test_load_rejects_malformed_file_ids(fake_drive_media):
+    assert app.test_client().get("/load/..%2F..%2Fabout/x.mkv").status_code == 404
+
+
+def test_load_answers_502_when_drive_is_unreachable(gdrive, monkeypatch):
+    monkeypatch.setenv("LOCAL_PROXY", "1")
+    monkeypatch.setattr(proxy, "DRIVE_MEDIA_URL", "http://127.0.0.1:9/drive/v3/files")
+    assert app.test_client().get(f"/load/{FILE_ID}/x.mkv").status_code == 502
+
+
+def test_proxy_urls_name_the_files_account(monkeypatch):
+    monkeypatch.setenv("CF_PROXY_URL", "https://addon.example")
+    urls = PlaybackUrls(None)
+    first = DriveFile(id="abc", name="a b.mkv")
+    second = DriveFile(id="def", name="c.mkv", account=2)
+
+    assert urls.stream_url(first) == "https://addon.example/load/abc/a%20b.mkv"
+    assert urls.stream_url(second) == "https://addon.example/load/def/c.mkv?account=2"
+
+
+# --- media cache ---------------------------------------------------------
+
+MD5 = "0123456789abcdef0123456789abcdef"
+BLOCK = 256 * 1024
+
+
+@pytest.fixture
+def media_cache(fake_drive_media, tmp_path, monkeypatch):
+    monkeypatch.setenv("MEDIA_CACHE_MB", "2")
+    monkeypatch.setenv("MEDIA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(proxy, "BLOCK_SIZE", BLOCK)
+    monkeypatch.setattr(proxy, "_cache", None)
+    # Read-ahead is off unless a test turns it on: it makes upstream requests.
+    monkeypatch.setattr(proxy, "READ_AHEAD_BLOCKS", 0)
+    return fake_drive_media
+
+
+def get_range(start, end, md5=MD5):
+    resp = app.test_client().get(
+        f"/load/{FILE_ID}/movie.mkv?md5={md5}", headers={"Range": f"bytes={start}-{end}"}
+    )
+    assert resp.status_code == 206
+    assert resp.get_data() == expected_bytes(start, end)
+    return resp
+
+
+def wait_for_blocks(indexes, timeout=5):
+    cache = proxy.media_cache()
+    deadline = time.monotonic() + timeout
+    while not all(((FILE_ID, MD5), i) in cache for i in indexes):
+        assert time.monotonic() < deadline, "blocks were never cached"
+        time.sleep(0.01)
+
+
+def test_relayed_blocks_are_served_from_the_cache(media_cache):
+    get_range(0, 3 * BLOCK + 99)
+    # Blocks 0-2 went by whole; block 3 only in part.
+    wait_for_blocks([0, 1, 2])
+    sent = media_cache.requests
+
+    resp = get_range(BLOCK + 10, 3 * BLOCK - 1)
+    assert resp.headers["Content-Range"] == f"bytes {BLOCK + 10}-{3 * BLOCK - 1}/{SIZE}"
+    assert media_cache.requests == sent
+    assert proxy.MEDIA_CACHE_HIT_RATIO.value() > 0
+
+
+def test_a_range_is_served_from_the_cache_then_from_drive(media_cache):
+    get_range(0, BLOCK - 1)
+    wait_for_blocks([0])
+    sent = media_cache.requests
+
+    # Block 0 from the cache, the rest (which is kept) from Drive.
+    get_range(100, 2 * BLOCK - 1)
+    assert media_cache.requests == sent + 1
+    wait_for_blocks([1])
+
+
+def test_blocks_after_a_range_are_read_ahead(media_cache, monkeypatch):
+    get_range(0, BLOCK - 1)
+    monkeypatch.setattr(proxy, "READ_AHEAD_BLOCKS", 2)
+    get_range(0, BLOCK - 1)
+    wait_for_blocks([1, 2])
+    monkeypatch.setattr(proxy, "READ_AHEAD_BLOCKS", 0)
+    sent = media_cache.requests
+
+    get_range(BLOCK, 3 * BLOCK - 1)
+    assert media_cache.requests == sent
+
+
+def test_files_without_md5_are_not_cached(media_cache, tmp_path):
+    resp = app.test_client().get(f"/load/{FILE_ID}/movie.mkv", headers={"Range": "bytes=0-1000"})
+    assert resp.get_data() == expected_bytes(0, 1000)
+    assert not os.listdir(tmp_path)
@@ -28,3 +28,16 @@ def test_missing_fields_default_to_none():
     parsed = parse_title("randomfile.mkv")
     assert parsed.season is None
     assert parsed.episode is None
+
+
+def test_parse_is_thread_safe():
+    # PTN's own module-level parser keeps per-parse state on the instance;
+    # concurrent requests used to get each other's fields (or crash).
+    from concurrent.futures import ThreadPoolExecutor
+
+    names = [f"Show.{i}.S0{i % 9 + 1}E{i:02d}.1080p.WEB-DL.mkv" for i in range(1, 60)]
+    parse = parse_title.__wrapped__  # bypass the memo cache
+    expected = [parse(name) for name in names]
+
+    with ThreadPoolExecutor(8) as pool:
+        assert list(pool.map(parse, names * 4)) == expected * 4
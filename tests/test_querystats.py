@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from sgd import querystats
+from sgd.gdrive import DriveFile, GoogleDrive
+from sgd.ptn import parse_title
+from sgd.querystats import QueryStats, contains, name_words
+from sgd.streams import Candidate
+
+
+def candidate(name):
+    return Candidate(DriveFile(name=name), parse_title(name))
+
+
+def episode(titles, sources):
+    return type("Meta", (), dict(
+        type="series", stream_type="series", id="tt1234567", se="01", ep="02",
+        titles=titles, title_sources=sources,
+    ))()
+
+
+@pytest.fixture
+def stats(monkeypatch, request):
+    stats = QueryStats(f"test-querystats-{request.node.name}.json")
+    stats.counts["clause"].clear()
+    stats.counts["source"].clear()
+    monkeypatch.setattr(querystats, "stats", stats)
+    yield stats
+    os.remove(stats._cache.filename)
+
+
+@pytest.mark.parametrize("name, phrase, expected", [
+    ("Show.S01E02.1080p.mkv", "S01E02", True),
+    ("Show.S01E02.1080p.mkv", "S01", True),
+    ("Show.S01E02.1080p.mkv", "s01 e02", False),
+    ("Show s01 e02 1080p.mkv", "s01 e02", True),
+    ("Show 1x02.mkv", '"1 x 02"', False),
+    ("Show 1 x 02.mkv", '"1 x 02"', True),
+    ("Show.Season.1.Episode.2.mkv", "season 1 episode 2", True),
+])
+def test_phrases_match_words_in_a_row(name, phrase, expected):
+    assert contains(name_words(name), phrase) is expected
+
+
+def test_searches_count_the_clauses_and_sources_their_streams_match(stats):
+    meta = episode(
+        ["pirates of the goolag", "piratas do goolag"],
+        {"pirates of the goolag": "cinemeta", "piratas do goolag": "imdb_html"},
+    )
+
+    stats.record(meta, [candidate("Pirates.of.the.Goolag.S01E02.1080p.mkv")])
+    stats.record(meta, [candidate("Pirates of the Goolag s01 e02.mkv")])
+    # Nothing validated: nothing to learn from.
+    stats.record(meta, [])
+
+    assert stats.counts["clause"]["S{se}E{ep}"] == [2, 1]
+    assert stats.counts["clause"]["s{se} e{ep}"] == [2, 1]
+    assert stats.counts["clause"]["season {s} episode {e}"] == [2, 0]
+    assert stats.counts["source"] == {"cinemeta": [2, 2], "imdb_html": [2, 0]}
+    assert stats.rate("source", "imdb_html") == (2, 0.0)
+
+
+def test_pruning_drops_parts_that_never_match(stats, monkeypatch):
+    meta = episode(
+        ["pirates of the goolag", "piratas do goolag", "goolag pirates"],
+        {"pirates of the goolag": "imdb_html", "piratas do goolag": "imdb_html", "goolag pirates": "tmdb"},
+    )
+    for _ in range(3):
+        stats.record(meta, [candidate("Pirates.of.the.Goolag.S01E02.1080p.mkv")])
+    gd = GoogleDrive.__new__(GoogleDrive)
+    meta.titles.append("os piratas")
+    meta.title_sources["os piratas"] = "cinemeta"
+    stats.record(meta, [candidate("Pirates.of.the.Goolag.S01E02.1080p.mkv")])
+    full = gd.get_query(meta)
+
+    monkeypatch.setattr(querystats, "QUERY_PRUNING", True)
+    monkeypatch.setattr(querystats, "QUERY_PRUNE_MIN_SAMPLES", 3)
+    pruned = gd.get_query(meta)
+
+    assert len(full) == 4 and "season 1 episode 2" in full[0]
+    # Cinemeta (1 search) hasn't been seen enough to judge; TMDB and IMDb
+    # titles matched, and only "S01E02" ever did.
+    assert stats.counts["source"] == {"imdb_html": [4, 4], "tmdb": [4, 4], "cinemeta": [1, 0]}
+    assert len(pruned) == 4
+    assert pruned[0] == "name contains 'pirates' and name contains 'goolag' and (name contains 'S01E02')"
+
+    monkeypatch.setattr(querystats, "QUERY_PRUNE_MIN_SAMPLES", 1)
+    # The primary title stays whatever its source, the Cinemeta one goes.
+    assert len(gd.get_query(meta)) == 3
@@ -0,0 +1,129 @@
+import json
+import sys
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from sgd.gdrive import is_retriable, is_throttled
+from sgd.ratelimit import TokenBucket
+from sgd.utils import Deadline
+
+# `sgd.gdrive` the attribute is the app's GoogleDrive instance, not the module.
+gdrive_mod = sys.modules["sgd.gdrive"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def http_error(status, reason=None):
+    content = json.dumps({"error": {"errors": [{"reason": reason}] if reason else []}})
+    return HttpError(httplib2.Response({"status": status}), content.encode())
+
+
+def test_bucket_allows_a_burst_then_paces_at_the_rate():
+    clock = FakeClock()
+    bucket = TokenBucket("test", rate=10, burst=5, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire(5) == 0
+    # A batch bigger than what's left goes into debt and waits it out.
+    assert bucket.acquire(3) == pytest.approx(0.3)
+    clock.now += 1.0
+    assert bucket.acquire(5) == 0
+
+
+def test_bucket_backs_off_when_throttled_and_recovers():
+    clock = FakeClock()
+    bucket = TokenBucket("test", rate=10, burst=5, min_rate=2, clock=clock, sleep=clock.sleep)
+
+    bucket.throttled()
+    assert bucket.rate == 5
+    for _ in range(3):
+        bucket.throttled()
+    assert bucket.rate == 2
+
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+
+def test_rate_limit_errors_are_classified():
+    assert is_throttled(http_error(429))
+    assert is_throttled(http_error(403, "userRateLimitExceeded"))
+    assert not is_throttled(http_error(403, "insufficientFilePermissions"))
+    assert is_retriable(http_error(503, "backendError"))
+    assert not is_retriable(http_error(404, "notFound"))
+    assert not is_retriable(ValueError("boom"))
+
+
+@pytest.fixture
+def slept(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gdrive_mod.time, "sleep", clock.sleep)
+    return clock.slept
+
+
+def test_throttled_sub_requests_are_retried_with_backoff(fake_drive, slept):
+    gd = fake_drive(errors={"1": [http_error(403, "userRateLimitExceeded"), http_error(429)]})
+
+    files, _ = gd.file_list("id, name", ["retry a", "retry b"])
+
+    assert len(files) == 2
+    assert gd.drive_instance.batches == [["0", "1"], ["1"], ["1"]]
+    # Exponential backoff with jitter: ~0.5s, then ~1s.
+    first, second = slept
+    assert 0.25 <= first <= 0.75 and 0.5 <= second <= 1.5
+    assert gd.limiter.rate < 100
+
+
+def test_retries_give_up_after_max_retries(fake_drive, slept, monkeypatch):
+    monkeypatch.setattr(gdrive_mod, "DRIVE_MAX_RETRIES", 1)
+    gd = fake_drive(errors={"0": [http_error(429)] * 5})
+
+    assert gd.file_list("id, name", ["give up"]) == ([], True)
+    assert len(gd.drive_instance.batches) == 2
+
+
+def test_permanent_errors_are_not_retried(fake_drive, slept):
+    gd = fake_drive(errors={"0": [http_error(400, "invalid")]})
+
+    assert gd.file_list("id, name", ["bad query"]) == ([], False)
+    assert gd.drive_instance.batches == [["0"]]
+
+
+def test_a_timed_out_batch_marks_the_list_partial(fake_drive):
+    gd = fake_drive(batch_error=TimeoutError("timed out"))
+
+    assert gd.file_list("id, name", ["slow"]) == ([], True)
+
+
+def test_bucket_skips_a_wait_longer_than_allowed():
+    clock = FakeClock()
+    bucket = TokenBucket("test_skip", rate=1, burst=5, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire(10, max_wait=2) is None
+    # Nothing was taken: the burst is still there.
+    assert bucket.acquire(5, max_wait=2) == 0
+    assert bucket.acquire(1, max_wait=2) == pytest.approx(1)
+
+
+def test_rate_limit_wait_past_the_budget_skips_the_batch(fake_drive, slept):
+    gd = fake_drive()
+    clock = FakeClock()
+    gd.limiter = TokenBucket("test_budget", rate=1, burst=1, clock=clock, sleep=clock.sleep)
+
+    # 40 queries at 1/s would wait ~40s: far past a 5s budget.
+    files, partial = gd.file_list("id, name", [f"q{i}" for i in range(40)], Deadline(5))
+
+    assert (files, partial) == ([], True)
+    assert gd.drive_instance.batches == [] and clock.slept == []
@@ -0,0 +1,77 @@
+"""Per-candidate memory budget for a large Drive response.
+
+Drive hits, PTN parses and validated candidates are kept as compact tuple
+records (DriveFile, ParsedRelease, Candidate) rather than dicts. This pins
+how much memory a big search costs per candidate so a regression back to
+per-item dicts shows up here.
+"""
+
+import gc
+import tracemalloc
+from types import SimpleNamespace
+
+from sgd.gdrive import DriveFile, GoogleDrive
+from sgd.streams import Streams
+
+N_FILES = 10_000
+N_RELEASES = 100
+# Bytes retained per validated candidate, including its DriveFile, the
+# display title/url strings and the behaviorHints dict.
+PER_CANDIDATE_BUDGET = 2 * 1024
+
+QUALITIES = [
+    "2160p.AMZN.WEB-DL.DDP5.1.HDR.H.265",
+    "1080p.BluRay.REMUX.AVC.DTS-HD.MA.5.1",
+    "720p.WEBRip.x264.AAC",
+    "1080p.NF.WEB-DL.DDP5.1.Atmos.H.264.DUAL",
+]
+
+
+class FakeGDrive:
+    results = []
+
+    def get_acc_token(self, account=0):
+        return "ya29." + "x" * 150
+
+
+def synthetic_response():
+    # The same release is usually present on several shared drives, so a
+    # large response repeats names across distinct file ids and drives.
+    return {
+        "files": [
+            {
+                "kind": "drive#file",
+                "id": f"1{i:032d}",
+                "name": f"Pirates.of.the.Goolag.2016.{QUALITIES[i % 4]}-GRP{i % N_RELEASES}.mkv",
+                "mimeType": "video/x-matroska",
+                "size": str(1_000_000_000 + i),
+                "driveId": f"0AB{i:08d}",
+                "md5Checksum": f"{i:032x}",
+            }
+            for i in range(N_FILES)
+        ]
+    }
+
+
+def test_per_candidate_memory_stays_under_budget():
+    meta = SimpleNamespace(
+        type="movie", stream_type="movie", titles=["pirates of the goolag"],
+        year="2016", id="tt1234567", se=0, ep=0, name="Pirates of the Goolag",
+    )
+    response = synthetic_response()
+    gd = FakeGDrive()
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        files = [DriveFile.from_api(item) for item in response["files"]]
+        gd.results = GoogleDrive._dedupe_and_sort(None, files)
+        del files
+        streams = Streams(gd, meta)
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(streams.results) == N_FILES
+    assert retained / len(streams.results) < PER_CANDIDATE_BUDGET
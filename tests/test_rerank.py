@@ -0,0 +1,77 @@
+import sys
+
+import pytest
+
+from benchmarks.fake_drive import FakeDriveServer, FakeFile
+from sgd import rerank, token
+from sgd.cache import Json
+from sgd.gdrive import DriveFile, GoogleDrive
+from sgd.ratelimit import TokenBucket
+from sgd.streams import Streams
+
+# `sgd.gdrive` is the DrivePool once sgd is imported; this is the module.
+gdrive_mod = sys.modules["sgd.gdrive"]
+
+TITLES = ["pirates of the goolag", "piratas do goolag", "les pirates du goolag", "goolag pirates returns", "it"]
+META = type("Meta", (), dict(
+    type="movie", stream_type="movie", id="tt1234567", year="2016", se=0, ep=0, titles=TITLES,
+))()
+
+
+@pytest.fixture(autouse=True)
+def word_counts(monkeypatch):
+    monkeypatch.setattr(rerank, "word_counts", rerank.Counter())
+
+
+def test_rare_tokens_cover_every_title_once():
+    tokens = rerank.rare_tokens(TITLES)
+
+    # The longest word until names have been seen.
+    assert tokens == ["pirates", "piratas", "it"]
+
+    # Once "pirates" is known to be common, "goolag" covers every title.
+    rerank.learn([DriveFile(name=f"Pirates.of.the.Caribbean.{i}.mkv") for i in range(3)])
+    assert rerank.rare_tokens(TITLES) == ["goolag", "it"]
+
+
+def test_files_are_kept_by_how_much_of_a_title_their_name_holds():
+    files = [
+        DriveFile(id="a", name="Piratas.do.Goolag.2016.1080p.mkv", size=1),
+        DriveFile(id="b", name="Pirates.of.the.Caribbean.2003.mkv", size=2),
+        DriveFile(id="c", name="It.2017.2160p.mkv", size=3),
+        DriveFile(id="d", name="Italian.Job.2003.mkv", size=4),
+        DriveFile(id="e", name="some upload tt1234567.mkv", size=5),
+    ]
+
+    assert [f.id for f in rerank.rerank(files, META)] == ["e", "c", "a"]
+
+
+@pytest.fixture
+def drive(request):
+    files = {
+        "p1": FakeFile("p1", "Pirates.of.the.Goolag.2016.1080p.mkv", 3, md5="a" * 32),
+        "p2": FakeFile("p2", "Les.Pirates.du.Goolag.2016.720p.mkv", 2, md5="b" * 32),
+        "p3": FakeFile("p3", "Goolag.Pirates.Returns.2016.mkv", 1, md5="c" * 32),
+        "x1": FakeFile("x1", "Pirates.of.the.Caribbean.2003.mkv", 4, md5="d" * 32),
+    }
+    with FakeDriveServer(files) as server:
+        gd = GoogleDrive(token, api_url=server.url)
+        gd.limiter = TokenBucket(f"test_{request.node.name}", 1000, 1000)
+        gd.drive_names = Json(f"test-drivenames-{request.node.name}.json")
+        gd.server = server
+        yield gd
+
+
+def test_broad_mode_finds_the_same_streams_with_fewer_queries(drive, monkeypatch):
+    strict = drive.search(META)
+    monkeypatch.setattr(gdrive_mod, "QUERY_MODE", "broad")
+    calls = drive.server.calls
+
+    broad = drive.search(META)
+
+    assert len(strict.query) == 6 and len(broad.query) == 2
+    assert broad.query[1] == "name contains 'pirates' or name contains 'piratas' or name contains 'it'"
+    assert drive.server.calls - calls == 2
+    assert broad.len_response == 4
+    streams = lambda search: sorted(c.file.id for c in Streams(search, META).results)
+    assert streams(broad) == streams(strict) == ["p1", "p2", "p3"]
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from sgd import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def get_response(client, stream_id="tt1234567"):
+    resp = client.get(f"/stream/movie/{stream_id}.json")
+    assert resp.status_code == 200
+    return json.loads(resp.data)
+
+
+def get_streams(client, stream_id="tt1234567"):
+    return get_response(client, stream_id)["streams"]
+
+
+def test_stream_response_is_cached_and_restamped(gdrive, client):
+    first = get_streams(client)
+    assert len(first) == 1
+    auth = first[0]["behaviorHints"]["proxyHeaders"]["request"]["Authorization"]
+    assert auth == "Bearer token-1"
+
+    # A new access token on a cache hit is stamped onto the cached candidates.
+    gdrive.searches = 41
+    second = get_streams(client, "TT1234567")
+    assert gdrive.searches == 41
+    auth = second[0]["behaviorHints"]["proxyHeaders"]["request"]["Authorization"]
+    assert auth == "Bearer token-41"
+
+
+def test_purge_requires_admin_secret(gdrive, client, monkeypatch):
+    monkeypatch.delenv("ADMIN_SECRET", raising=False)
+    assert client.post("/admin/cache/purge/tt1234567").status_code == 404
+
+    monkeypatch.setenv("ADMIN_SECRET", "s3cret")
+    resp = client.post("/admin/cache/purge/tt1234567", headers={"X-Admin-Secret": "nope"})
+    assert resp.status_code == 403
+
+
+def test_purge_by_id_forces_a_new_search(gdrive, client, monkeypatch):
+    monkeypatch.setenv("ADMIN_SECRET", "s3cret")
+    get_streams(client)
+
+    resp = client.post("/admin/cache/purge/tt1234567", headers={"X-Admin-Secret": "s3cret"})
+    assert resp.get_json() == {"purged": 1}
+
+    get_streams(client)
+    assert gdrive.searches == 2
+
+
+def test_partial_response_is_flagged_and_not_cached(gdrive, client):
+    gdrive.partial = True
+    body = get_response(client)
+    assert len(body["streams"]) == 1
+    assert body["partial"] is True
+    assert body["cacheMaxAge"] == 0
+
+    gdrive.partial = False
+    body = get_response(client)
+    assert gdrive.searches == 2
+    assert "partial" not in body
+
+
+def test_stream_request_records_stage_metrics(gdrive, client):
+    from sgd.metrics import CACHE_REQUESTS, STAGE_SECONDS
+
+    before = {stage: STAGE_SECONDS.count(stage=stage) for stage in ("parse", "match", "rank", "serialize")}
+    misses = CACHE_REQUESTS.value(cache="streams", result="miss")
+    get_streams(client)
+    get_streams(client)
+
+    for stage, count in before.items():
+        assert STAGE_SECONDS.count(stage=stage) > count, stage
+    assert CACHE_REQUESTS.value(cache="streams", result="miss") == misses + 1
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'sgd_stage_duration_seconds_count{stage="match"}' in text
+    assert 'sgd_cache_requests_total{cache="streams",result="hit"}' in text
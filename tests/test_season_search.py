@@ -0,0 +1,92 @@
+import sys
+import time
+
+import pytest
+
+from benchmarks.fake_drive import FakeDriveServer, FakeFile
+from sgd import token
+from sgd.cache import Json, TTLCache
+from sgd.gdrive import GoogleDrive, index_episodes
+from sgd.ratelimit import TokenBucket
+
+# `sgd.gdrive` is the DrivePool once sgd is imported; this is the module.
+gdrive_mod = sys.modules["sgd.gdrive"]
+
+FILES = {
+    "e1": FakeFile("e1", "Pirates.of.the.Goolag.S01E01.1080p.mkv", 10, "0Adrive", "a" * 32),
+    "e2": FakeFile("e2", "Pirates.of.the.Goolag.S01E02.1080p.mkv", 20, "0Adrive", "b" * 32),
+    "e3": FakeFile("e3", "Pirates of the Goolag S01E03-E04 720p.mkv", 30, "0Adrive", "c" * 32),
+    "s2": FakeFile("s2", "Pirates.of.the.Goolag.S02E01.1080p.mkv", 40, "0Adrive", "d" * 32),
+}
+
+
+def episode(se, ep):
+    return type("Meta", (), dict(
+        type="series", stream_type="series", id="tt1234567",
+        titles=["pirates of the goolag"], se=f"{se:02d}", ep=f"{ep:02d}",
+    ))()
+
+
+@pytest.fixture
+def drive(monkeypatch, request):
+    monkeypatch.setattr(gdrive_mod, "SERIES_SEARCH", "season")
+    monkeypatch.setattr(GoogleDrive, "season_cache", TTLCache(10, 3600))
+    with FakeDriveServer(FILES, {"0Adrive": "Series"}) as server:
+        gd = GoogleDrive(token, api_url=server.url)
+        gd.limiter = TokenBucket(f"test_{request.node.name}", 1000, 1000)
+        gd.drive_names = Json(f"test-drivenames-{request.node.name}.json")
+        gd.drive_names.contents = {}
+        gd.server = server
+        yield gd
+
+
+def test_episodes_are_indexed_by_every_season_and_episode_they_hold():
+    files = [FILES["e1"], FILES["e3"], FakeFile("x", "Pirates 2x05 HDTV.avi"), FakeFile("y", "Pirates 2016.mkv")]
+
+    episodes = index_episodes(files)
+
+    assert {k: [f.id for f in v] for k, v in episodes.items()} == {
+        (1, 1): ["e1"], (1, 3): ["e3"], (1, 4): ["e3"], (2, 5): ["x"],
+    }
+
+
+def test_later_episodes_of_a_season_are_served_from_its_index(drive):
+    first = drive.search(episode(1, 1))
+    requests_ = drive.server.requests
+
+    second = drive.search(episode(1, 2))
+    double = drive.search(episode(1, 4))
+
+    assert [f.id for f in first.results] == ["e1"]
+    assert [f.id for f in second.results] == ["e2"]
+    assert [f.id for f in double.results] == ["e3"]
+    assert second.len_response == 3
+    assert drive.server.requests == requests_
+
+    # Another season is another search.
+    assert [f.id for f in drive.search(episode(2, 1)).results] == ["s2"]
+    assert drive.server.requests > requests_
+
+
+def test_stale_seasons_are_served_then_refreshed_in_the_background(drive, monkeypatch):
+    drive.search(episode(1, 1))
+    calls = drive.server.calls
+    monkeypatch.setattr(gdrive_mod, "SEASON_CACHE_FRESH", -1)
+
+    assert [f.id for f in drive.search(episode(1, 2)).results] == ["e2"]
+
+    key = (drive.account, "tt1234567", 1)
+    for _ in range(100):
+        if drive.server.calls > calls and key not in GoogleDrive._refreshing:
+            break
+        time.sleep(0.02)
+    assert drive.server.calls > calls
+    assert key not in GoogleDrive._refreshing
+
+
+def test_partial_seasons_are_not_cached(drive, monkeypatch):
+    monkeypatch.setattr(gdrive_mod, "RETRY_BASE_DELAY", 0)
+    drive.server.error_rate = 1.0
+
+    assert drive.search(episode(1, 1)).partial
+    assert drive.season_cache.get((drive.account, "tt1234567", 1)) is None
@@ -0,0 +1,153 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import sgd.routes as routes
+from sgd.meta import title_id
+from sgd.singleflight import COALESCED, SingleFlight
+from sgd.utils import Deadline
+
+
+def wait_for_waiters(flight, n, timeout=2):
+    """Block until `n` callers have been coalesced onto `flight`.
+
+    Each test uses its own flight name, so the count starts at zero.
+    """
+    deadline = time.monotonic() + timeout
+    while COALESCED.value(flight=flight.name) < n:
+        assert time.monotonic() < deadline, "followers never joined the flight"
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_computation():
+    flight = SingleFlight("test_share")
+    release = threading.Event()
+    runs = []
+
+    def compute():
+        runs.append(1)
+        release.wait(2)
+        return "result"
+
+    with ThreadPoolExecutor(5) as pool:
+        leader = pool.submit(flight.do, "key", compute)
+        while not runs:
+            time.sleep(0.001)
+        followers = [pool.submit(flight.do, "key", compute) for _ in range(4)]
+        wait_for_waiters(flight, 4)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert results == ["result"] * 5
+    assert len(runs) == 1
+
+
+def test_followers_get_the_leaders_exception():
+    flight = SingleFlight("test_error")
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(2)
+        raise LookupError("nope")
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(flight.do, "key", compute)
+        started.wait(2)
+        follower = pool.submit(flight.do, "key", compute)
+        wait_for_waiters(flight, 1)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(LookupError):
+                future.result()
+
+
+def test_nothing_is_remembered_after_completion():
+    flight = SingleFlight("test_forget")
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+
+
+# --- metadata: one lookup per title, shared across episodes ---------------
+
+@pytest.mark.parametrize("stream_id, expected", [
+    ("tt1234567", "tt1234567"),
+    ("TT1234567%3A1%3A2", "tt1234567"),
+    ("tmdb:1399:1:2", "tmdb:1399"),
+])
+def test_title_id_drops_season_and_episode(stream_id, expected):
+    assert title_id(stream_id) == expected
+
+
+def test_episodes_of_one_series_share_a_metadata_lookup(gdrive, monkeypatch):
+    monkeypatch.setattr(routes, "meta_flight", SingleFlight("test_meta"))
+    fake_meta, fake_search = routes.Meta, gdrive.search
+    started = threading.Event()
+    release = threading.Event()
+    lookups = []
+    searched = []
+
+    def slow_meta(stream_type, stream_id, deadline=None):
+        lookups.append(stream_id)
+        started.set()
+        release.wait(2)
+        return fake_meta(stream_type, stream_id, deadline)
+
+    def search(stream_meta, deadline=None):
+        searched.append((stream_meta.se, stream_meta.ep))
+        return fake_search(stream_meta, deadline)
+
+    monkeypatch.setattr(routes, "Meta", slow_meta)
+    monkeypatch.setattr(gdrive, "search", search)
+
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(routes.search_streams, "series", "tt1234567:1:1")
+        started.wait(2)
+        second = pool.submit(routes.search_streams, "series", "tt1234567:1:2")
+        wait_for_waiters(routes.meta_flight, 1)
+        release.set()
+        first.result(), second.result()
+
+    assert lookups == ["tt1234567:1:1"]
+    # Each request still searched for its own episode.
+    assert sorted(searched) == [("01", "01"), ("01", "02")]
+
+
+# --- GoogleDrive.file_list: identical queries in flight share a Drive call ---
+
+def test_file_list_coalesces_identical_in_flight_queries(fake_drive):
+    gd = fake_drive(blocked=True)
+
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(gd.file_list, "id, name", ["a", "b"])
+        while not gd.drive_instance.batches:
+            time.sleep(0.001)
+        second = pool.submit(gd.file_list, "id, name", ["b", "c"])
+        while len(gd.drive_instance.batches) < 2:
+            time.sleep(0.001)
+        gd.drive_instance.release.set()
+        first_ids = sorted(f.id for f in first.result()[0])
+        second_ids = sorted(f.id for f in second.result()[0])
+
+    # "b" was already in flight, so the second request only sent "c".
+    assert gd.drive_instance.queries == [["a", "b"], ["c"]]
+    assert len(first_ids) == 2 and len(second_ids) == 2
+
+
+def test_file_list_waits_on_other_requests_queries_only_within_budget(fake_drive):
+    gd = fake_drive(blocked=True)
+
+    with ThreadPoolExecutor(1) as pool:
+        leader = pool.submit(gd.file_list, "id, name", ["a"])
+        while not gd.drive_instance.batches:
+            time.sleep(0.001)
+        start = time.monotonic()
+        files, partial = gd.file_list("id, name", ["a"], Deadline(0.05))
+        assert time.monotonic() - start < 1
+        gd.drive_instance.release.set()
+        leader.result()
+
+    assert (files, partial) == ([], True)
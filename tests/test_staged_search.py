@@ -0,0 +1,60 @@
+import sys
+
+import pytest
+
+from benchmarks.fake_drive import FakeDriveServer, FakeFile
+from sgd import token
+from sgd.cache import Json
+from sgd.gdrive import SEARCH_TIERS, GoogleDrive
+from sgd.ratelimit import TokenBucket
+
+# `sgd.gdrive` is the DrivePool once sgd is imported; this is the module.
+gdrive_mod = sys.modules["sgd.gdrive"]
+
+FILES = {
+    "tagged": FakeFile("tagged", "Pirates of the Goolag 2016 tt1234567 2160p.mkv", 40, md5="a" * 32),
+    "year": FakeFile("year", "Pirates.of.the.Goolag.2016.1080p.mkv", 30, md5="b" * 32),
+    "noyear": FakeFile("noyear", "Pirates.of.the.Goolag.720p.mkv", 20, md5="c" * 32),
+    "aka": FakeFile("aka", "Piratas.do.Goolag.2016.1080p.mkv", 10, md5="d" * 32),
+}
+META = type("Meta", (), dict(
+    type="movie", stream_type="movie", id="tt1234567", year="2016", se=0, ep=0,
+    titles=["pirates of the goolag", "piratas do goolag"],
+))()
+
+
+@pytest.fixture
+def drive(request):
+    with FakeDriveServer(FILES) as server:
+        gd = GoogleDrive(token, api_url=server.url)
+        gd.limiter = TokenBucket(f"test_{request.node.name}", 1000, 1000)
+        gd.drive_names = Json(f"test-drivenames-{request.node.name}.json")
+        yield gd
+
+
+def test_tiers_go_from_the_id_to_the_aka_titles(drive):
+    tiers = drive.search_tiers(META)
+
+    assert [tier for tier, _ in tiers] == ["id", "title", "aka"]
+    assert tiers[1][1] == ["name contains 'pirates' and name contains 'goolag' and name contains '2016'"]
+    # The primary title without the year goes with the AKAs.
+    assert tiers[2][1] == ["name contains 'pirates' and name contains 'goolag'", "name contains 'piratas' and name contains 'goolag'"]
+
+
+@pytest.mark.parametrize("min_streams, last_tier, queries, found", [
+    (1, "id", 1, ["tagged"]),
+    (2, "title", 2, ["tagged", "year"]),
+    (10, "aka", 4, ["tagged", "year", "noyear", "aka"]),
+])
+def test_search_stops_once_enough_streams_are_found(drive, monkeypatch, min_streams, last_tier, queries, found):
+    monkeypatch.setattr(gdrive_mod, "STAGED_MIN_STREAMS", min_streams)
+    short_circuits = SEARCH_TIERS.value(tier=last_tier, result="short_circuit")
+
+    search = drive.search(META)
+
+    assert [f.id for f in search.results] == found
+    assert len(search.query) == queries
+    assert not search.partial
+    # Running out of tiers isn't a short circuit.
+    stopped_early = last_tier != "aka"
+    assert SEARCH_TIERS.value(tier=last_tier, result="short_circuit") == short_circuits + stopped_early
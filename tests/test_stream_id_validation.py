@@ -1,6 +1,6 @@
 import pytest
 
-from sgd.utils import split_stream_id
+from sgd.utils import normalize_stream_id, split_stream_id
 from sgd.routes import is_valid_stream_id
 
 
@@ -13,6 +13,18 @@ def test_split_stream_id_no_separator():
     assert split_stream_id("tt1234567") == ["tt1234567"]
 
 
+@pytest.mark.parametrize(
+    "stream_id",
+    ["tt1234567:1:2", "tt1234567%3A01%3A02", "TT1234567:1:02"],
+)
+def test_normalize_stream_id(stream_id):
+    assert normalize_stream_id(stream_id) == "tt1234567:1:2"
+
+
+def test_normalize_stream_id_tmdb():
+    assert normalize_stream_id("TMDB%3A0123") == "tmdb:123"
+
+
 @pytest.mark.parametrize(
     "stream_id",
     [
@@ -1,6 +1,8 @@
 from types import SimpleNamespace
 
-from sgd.streams import Streams
+from sgd.gdrive import DriveFile
+from sgd.ptn import ParsedRelease
+from sgd.streams import Candidate, Streams
 
 
 class FakeGDrive:
@@ -30,20 +32,20 @@ def make_streams(**meta_kwargs):
 
 def test_title_matches_filename():
     s = make_streams()
-    s.item = {"name": "Pirates.of.the.Goolag.2016.1080p.WEB-DL.mkv"}
-    assert s.is_semi_valid_title({"sortkeys": {"title": "Pirates of the Goolag"}})
+    s.item = DriveFile(name="Pirates.of.the.Goolag.2016.1080p.WEB-DL.mkv")
+    assert s.is_semi_valid_title(ParsedRelease(title="Pirates of the Goolag"))
 
 
 def test_title_does_not_match_unrelated_filename():
     s = make_streams()
-    s.item = {"name": "Totally.Different.Movie.2016.mkv"}
-    assert not s.is_semi_valid_title({"sortkeys": {"title": "Totally Different Movie"}})
+    s.item = DriveFile(name="Totally.Different.Movie.2016.mkv")
+    assert not s.is_semi_valid_title(ParsedRelease(title="Totally Different Movie"))
 
 
 def test_imdb_id_in_filename_always_matches():
     s = make_streams(id="tt9999999")
-    s.item = {"name": "video_tt9999999_source.mkv"}
-    assert s.is_semi_valid_title({"sortkeys": {}})
+    s.item = DriveFile(name="video_tt9999999_source.mkv")
+    assert s.is_semi_valid_title(ParsedRelease())
 
 
 def test_rejects_when_parsed_title_has_unexplained_extra_words():
@@ -51,9 +53,9 @@ def test_rejects_when_parsed_title_has_unexplained_extra_words():
     # part of the searched title and aren't a known release-tag word -
     # this is the "leaked other content" guard.
     s = make_streams()
-    s.item = {"name": "Pirates.of.the.Goolag.2016.BONUSCONTENT.mkv"}
+    s.item = DriveFile(name="Pirates.of.the.Goolag.2016.BONUSCONTENT.mkv")
     matched = s.is_semi_valid_title(
-        {"sortkeys": {"title": "Pirates of the Goolag BONUSCONTENT"}}
+        ParsedRelease(title="Pirates of the Goolag BONUSCONTENT")
     )
     assert not matched
 
@@ -65,8 +67,8 @@ def test_apostrophe_in_filename_matches_spaced_search_title():
     # comparison, so this should still match. Use an id that isn't in the
     # filename so the id shortcut doesn't mask this path.
     s = make_streams(titles=["Dia D"], id="tt0000000")
-    s.item = {"name": "Dia'D (2026) WEB-DL 2160p DV HDR10+ DDP5.1 H.265.mkv"}
-    assert s.is_semi_valid_title({"sortkeys": {"title": "Dia'D"}})
+    s.item = DriveFile(name="Dia'D (2026) WEB-DL 2160p DV HDR10+ DDP5.1 H.265.mkv")
+    assert s.is_semi_valid_title(ParsedRelease(title="Dia'D"))
 
 
 def test_get_title_uses_metadata_name_when_filename_has_no_real_title():
@@ -77,8 +79,8 @@ def test_get_title_uses_metadata_name_when_filename_has_no_real_title():
     from sgd.ptn import parse_title
 
     s = make_streams(name="Dia D", titles=["dia d"], id="tt15047880")
-    s.item = {"name": "WEB-DL 2160p DV HDR10+ DDP5.1 H.265 tt15047880.mkv"}
-    s.parsed = parse_title(s.item["name"])
+    s.item = DriveFile(name="WEB-DL 2160p DV HDR10+ DDP5.1 H.265 tt15047880.mkv")
+    s.parsed = parse_title(s.item.name)
 
     title = s.get_title("2160p")
     line3 = title.splitlines()[0]
@@ -103,9 +105,9 @@ def test_apostrophe_dropped_and_merged_into_word_still_matches():
         "Margos.Got.Money.Troubles.S01E01.The.Hungry.Ghost.1080p.ATVP."
         "WEB-DL.DDP5.1.Atmos.H.264.DUAL-JHOM.mkv"
     )
-    s.item = {"name": name}
+    s.item = DriveFile(name=name)
     parsed = parse_title(name)
-    assert s.is_semi_valid_title({"sortkeys": parsed.sortkeys})
+    assert s.is_semi_valid_title(parsed)
 
 
 def test_apostrophe_kept_in_filename_still_matches_sanitized_title():
@@ -116,78 +118,78 @@ def test_apostrophe_kept_in_filename_still_matches_sanitized_title():
 
     s = make_streams(titles=["margo s got money troubles"], id="tt0000000")
     name = "Margo's.Got.Money.Troubles.S01E01.2160p.ATVP.WEB-DL.DD5.1.DV.HDR.H.265.mkv"
-    s.item = {"name": name}
+    s.item = DriveFile(name=name)
     parsed = parse_title(name)
-    assert s.is_semi_valid_title({"sortkeys": parsed.sortkeys})
+    assert s.is_semi_valid_title(parsed)
 
 
 def test_no_titles_never_matches():
     s = make_streams(titles=[])
-    s.item = {"name": "Pirates.of.the.Goolag.2016.mkv"}
-    assert not s.is_semi_valid_title({"sortkeys": {}})
+    s.item = DriveFile(name="Pirates.of.the.Goolag.2016.mkv")
+    assert not s.is_semi_valid_title(ParsedRelease())
 
 
 # --- is_valid_year -------------------------------------------------------
 
 def test_valid_year_exact_match():
     s = make_streams(year="2016")
-    assert s.is_valid_year({"sortkeys": {"year": "2016"}})
+    assert s.is_valid_year(ParsedRelease(year=2016))
 
 
 def test_valid_year_off_by_one_is_tolerated():
     s = make_streams(year="2016")
-    assert s.is_valid_year({"sortkeys": {"year": "2017"}})
+    assert s.is_valid_year(ParsedRelease(year=2017))
 
 
 def test_valid_year_rejects_far_mismatch():
     s = make_streams(year="2016")
-    assert not s.is_valid_year({"sortkeys": {"year": "1999"}})
+    assert not s.is_valid_year(ParsedRelease(year=1999))
 
 
 def test_valid_year_missing_file_year_defaults_to_valid():
     s = make_streams(year="2016")
-    assert s.is_valid_year({"sortkeys": {}})
+    assert s.is_valid_year(ParsedRelease())
 
 
 # --- is_valid_episode ------------------------------------------------------
 
 def test_valid_episode_matches_sortkeys():
     s = make_streams(stream_type="series", se=1, ep=2)
-    s.item = {"name": "irrelevant.mkv"}
-    assert s.is_valid_episode({"sortkeys": {"se": 1, "ep": 2}})
+    s.item = DriveFile(name="irrelevant.mkv")
+    assert s.is_valid_episode(ParsedRelease(season=1, episode=2))
 
 
 def test_valid_episode_rejects_other_season():
     s = make_streams(stream_type="series", se=1, ep=2)
-    s.item = {"name": "irrelevant.mkv"}
-    assert not s.is_valid_episode({"sortkeys": {"se": 2, "ep": 2}})
+    s.item = DriveFile(name="irrelevant.mkv")
+    assert not s.is_valid_episode(ParsedRelease(season=2, episode=2))
 
 
 def test_valid_episode_falls_back_to_filename_regex():
     s = make_streams(stream_type="series", se=1, ep=2)
-    s.item = {"name": "Show.Name.S01E02.mkv"}
-    assert s.is_valid_episode({"sortkeys": {}})
+    s.item = DriveFile(name="Show.Name.S01E02.mkv")
+    assert s.is_valid_episode(ParsedRelease())
 
 
 def test_valid_episode_no_episode_info_anywhere_is_invalid():
     s = make_streams(stream_type="series", se=1, ep=2)
-    s.item = {"name": "Show.Name.mkv"}
-    assert not s.is_valid_episode({"sortkeys": {}})
+    s.item = DriveFile(name="Show.Name.mkv")
+    assert not s.is_valid_episode(ParsedRelease())
 
 
 # --- best_res --------------------------------------------------------------
 
 def test_best_res_prefers_higher_resolution():
     s = make_streams()
-    low = {"filename": "Movie.720p.WEB-DL.mkv", "sortkeys": {"res": "720p"}}
-    high = {"filename": "Movie.2160p.WEB-DL.mkv", "sortkeys": {"res": "2160p"}}
+    low = Candidate(DriveFile(name="Movie.720p.WEB-DL.mkv"), ParsedRelease(resolution="720p"))
+    high = Candidate(DriveFile(name="Movie.2160p.WEB-DL.mkv"), ParsedRelease(resolution="2160p"))
     assert s.best_res(high) > s.best_res(low)
 
 
 def test_best_res_prefers_remux_over_webdl_at_same_resolution():
     s = make_streams()
-    webdl = {"filename": "Movie.1080p.WEB-DL.mkv", "sortkeys": {"res": "1080p"}}
-    remux = {"filename": "Movie.1080p.BluRay.REMUX.mkv", "sortkeys": {"res": "1080p"}}
+    webdl = Candidate(DriveFile(name="Movie.1080p.WEB-DL.mkv"), ParsedRelease(resolution="1080p"))
+    remux = Candidate(DriveFile(name="Movie.1080p.BluRay.REMUX.mkv"), ParsedRelease(resolution="1080p"))
     assert s.best_res(remux) > s.best_res(webdl)
 
 
@@ -10,6 +10,7 @@ out of the filename (see sgd/streams.py:is_semi_valid_title).
 
 from types import SimpleNamespace
 
+from sgd.gdrive import DriveFile
 from sgd.ptn import parse_title
 from sgd.streams import Streams
 
@@ -27,9 +28,8 @@ def is_match(file_name, titles, stream_type="movie"):
         year=None, id="ttNOPE", se=0, ep=0,
     )
     s = Streams(FakeGDrive(), meta)
-    s.item = {"name": file_name}
-    parsed = parse_title(file_name)
-    return s.is_semi_valid_title({"sortkeys": parsed.sortkeys})
+    s.item = DriveFile(name=file_name)
+    return s.is_semi_valid_title(parse_title(file_name))
 
 
 # Real-world filename samples, each pinned to the show/movie they belong to.
@@ -1,4 +1,4 @@
-from sgd.utils import hr_size, safe_get, num_extract, is_year, sanitize, strip_accents
+from sgd.utils import Deadline, hr_size, safe_get, num_extract, is_year, sanitize, strip_accents
 
 
 def test_hr_size_bytes():
@@ -45,3 +45,20 @@ def test_sanitize_strips_symbols_keeps_dots_and_spaces():
 def test_strip_accents():
     assert strip_accents("ação") == "acao"
     assert strip_accents("Café") == "Cafe"
+
+
+def test_deadline_counts_down():
+    now = [100.0]
+    deadline = Deadline(10, clock=lambda: now[0])
+    assert deadline.allows(10)
+    now[0] = 104.0
+    assert deadline.remaining() == 6.0
+    assert not deadline.allows(6.5)
+    now[0] = 200.0
+    assert deadline.remaining() == 0.0
+
+
+def test_deadline_without_budget_never_runs_out():
+    assert Deadline(0).allows(1e9)
+    assert Deadline(None).remaining() == float("inf")
+    assert Deadline(0).timeout() is None